@@ -19,11 +19,10 @@ from pathlib import Path
 from datetime import datetime
 import logging
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 import openai
@@ -31,10 +30,29 @@ import uuid
 import aiofiles
 import asyncio
 import sys
-from typing import Optional, AsyncGenerator, Dict, Any
+from typing import Optional, AsyncGenerator, Dict, Any, List
 import httpx
 from sse_starlette.sse import EventSourceResponse
 import json
+import time
+import re
+import codecs
+import hashlib
+import hmac
+import shutil
+import gzip
+import math
+import bisect
+import random
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+from collections import OrderedDict
+from html import escape as html_escape, unescape as html_unescape
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager, contextmanager
 
 # 加载环境变量
 load_dotenv()
@@ -74,13 +92,39 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 # 验证配置
 logger.info(f"验证 OpenAI 配置: base_url={openai.base_url}")
 
-app = FastAPI(title="易读工具")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享客户端，关闭时取消仍在运行的后台任务并释放连接"""
+    try:
+        get_ai_client()
+    except openai.OpenAIError as e:
+        # 配置缺失时不阻止服务启动，任务执行时会再次尝试创建并报告错误
+        logger.error(f"创建 OpenAI 客户端失败: {str(e)}")
+    get_fetch_client()
+    storage_sweeper = asyncio.create_task(run_storage_sweeper()) if STORAGE_SWEEP_INTERVAL > 0 else None
+    yield
+    if storage_sweeper is not None:
+        storage_sweeper.cancel()
+    runners = list(task_runners.values())
+    for runner in runners:
+        runner.cancel()
+    if runners:
+        await asyncio.gather(*runners, return_exceptions=True)
+        logger.info(f"已取消 {len(runners)} 个未完成的后台任务")
+    await close_ai_client()
+    if fetch_client is not None:
+        await fetch_client.aclose()
+    await task_store.close()
+
+app = FastAPI(title="易读工具", lifespan=lifespan)
 
 # 创建必要的目录
 STATIC_DIR = Path("static")
 HTML_DIR = Path("static/html")
 STATIC_DIR.mkdir(exist_ok=True)
 HTML_DIR.mkdir(exist_ok=True)
+CACHE_DIR = Path("cache")
+CACHE_DIR.mkdir(exist_ok=True)
 
 # 挂载静态文件目录
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -99,54 +143,744 @@ class ContentRequest(BaseModel):
     url: Optional[str] = None
     text: Optional[str] = None
 
-def extract_main_content(url: str) -> str:
-    """提取网页主要内容"""
-    try:
-        # 设置请求头，模拟正常浏览器访问
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Cache-Control': 'max-age=0',
-            'Sec-Ch-Ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
-            'Sec-Ch-Ua-Mobile': '?0',
-            'Sec-Ch-Ua-Platform': '"Windows"',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'Upgrade-Insecure-Requests': '1'
-        }
-        
-        response = requests.get(
-            url, 
-            headers=headers,
-            timeout=440,
-            verify=False  # 验证 SSL 证书
+# 运行指标：以 Prometheus 文本格式通过 /metrics 暴露，每个 worker 进程各自统计
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# 耗时直方图的桶（秒），覆盖从毫秒级的合并到分钟级的AI请求
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+metrics_registry: List["Metric"] = []
+
+def format_metric_value(value: float) -> str:
+    """指标值的文本表示，整数不带小数点"""
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metric:
+    """指标基类：按标签值分组保存数据，渲染为 Prometheus 文本格式"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values: Dict[tuple, Any] = {}
+        metrics_registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _labels(self, key: tuple, extra: tuple = ()) -> str:
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._labels(key)} {format_metric_value(value)}" for key, value in self.values.items()]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"] + self.samples()
+
+class Counter(Metric):
+    """只增不减的计数器"""
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """当前值，collect 返回 {标签值元组: 值} 时在渲染时读取"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), collect=None):
+        super().__init__(name, help_text, label_names)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        if self.collect is not None:
+            self.values = self.collect()
+        return super().samples()
+
+class Histogram(Metric):
+    """直方图：累计各桶的观测次数以及总和、总次数"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        data = self.values.get(key)
+        if data is None:
+            # [各桶计数（非累计）, 总和, 总次数]
+            data = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块的耗时（秒）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._labels(key, (('le', format_metric_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {format_metric_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram(
+    "easyread_stage_duration_seconds",
+    "各处理阶段耗时：fetch 抓取网页、extract 提取正文、ai_round 单次AI请求、merge 合并、post_process 页面后处理、write 写入结果",
+    ("stage",)
+)
+AI_ROUND_ERRORS = Counter("easyread_ai_round_errors_total", "失败的AI请求次数", ("retryable",))
+AI_TOKENS = Counter(
+    "easyread_ai_tokens_total", "AI token 用量：input 输入（含缓存命中）、cached 缓存命中的输入、output 输出", ("type",)
+)
+JOB_ROUNDS = Histogram(
+    "easyread_job_rounds", "每个任务的AI生成轮数（章节模式下为章节数）", buckets=(1, 2, 3, 4, 5, 8, 10, 15, 20, 30, 50)
+)
+JOB_SECONDS = Histogram("easyread_job_duration_seconds", "任务开始处理到结束的耗时", ("outcome",))
+JOBS = Counter("easyread_jobs_total", "结束的任务数：completed、cached、error、cancelled", ("outcome",))
+JOBS_REJECTED = Counter("easyread_jobs_rejected_total", "被拒绝的提交：queue_full 排队已满、circuit_open 熔断中", ("reason",))
+Gauge("easyread_jobs_running", "正在运行的任务数", collect=lambda: {(): job_scheduler.running})
+Gauge("easyread_jobs_queued", "排队中的任务数", collect=lambda: {(): len(job_scheduler.queue)})
+Gauge(
+    "easyread_ai_requests", "AI请求并发情况：in_flight 进行中、waiting 等待并发名额", ("state",),
+    collect=lambda: {("in_flight",): ai_pool_stats["in_flight"], ("waiting",): ai_pool_stats["waiting"]}
+)
+Gauge(
+    "easyread_circuit_breaker_state", "AI请求熔断器状态，当前状态为 1", ("state",),
+    collect=lambda: {(state,): int(ai_circuit_breaker.state == state) for state in ("closed", "open", "half_open")}
+)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="指标未启用")
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# 网页抓取配置：连接/读取超时、总时长预算、响应大小上限及连接池大小
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "10"))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "30"))
+FETCH_TOTAL_TIMEOUT = float(os.getenv("FETCH_TOTAL_TIMEOUT", "60"))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "50"))
+
+# 设置请求头，模拟正常浏览器访问（压缩格式由 httpx 按已安装的解码器自动协商）
+FETCH_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Cache-Control': 'max-age=0',
+    'Sec-Ch-Ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
+    'Sec-Ch-Ua-Mobile': '?0',
+    'Sec-Ch-Ua-Platform': '"Windows"',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+# 安装了 h2 时启用 HTTP/2
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+fetch_client: Optional[httpx.AsyncClient] = None
+
+def get_fetch_client() -> httpx.AsyncClient:
+    """获取共享的网页抓取客户端（连接池复用）"""
+    global fetch_client
+    if fetch_client is None or fetch_client.is_closed:
+        fetch_client = httpx.AsyncClient(
+            headers=FETCH_HEADERS,
+            http2=HTTP2_AVAILABLE,
+            verify=False,  # 不验证 SSL 证书
+            follow_redirects=True,
+            timeout=httpx.Timeout(
+                connect=FETCH_CONNECT_TIMEOUT,
+                read=FETCH_READ_TIMEOUT,
+                write=FETCH_READ_TIMEOUT,
+                pool=FETCH_CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=FETCH_MAX_CONNECTIONS,
+                max_keepalive_connections=FETCH_MAX_CONNECTIONS // 2
+            )
         )
+    return fetch_client
+
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+def sniff_html_encoding(head: bytes) -> Optional[str]:
+    """从HTML开头的 meta 标签中识别编码"""
+    match = META_CHARSET_PATTERN.search(head)
+    if not match:
+        return None
+    encoding = match.group(1).decode('ascii', 'ignore')
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+async def fetch_page(url: str, extra_headers: Optional[dict] = None) -> dict:
+    """流式下载网页并增量解码，超过大小上限时中止；支持条件请求，未修改时 not_modified 为 True"""
+    client = get_fetch_client()
+    async with client.stream("GET", url, headers=extra_headers) as response:
+        if response.status_code == 304:
+            return {"not_modified": True}
         response.raise_for_status()
+
+        # 检测并使用正确的编码：响应头未声明或为默认的 iso-8859-1 时从页面中识别
+        encoding = response.charset_encoding
+        if encoding and encoding.lower() == 'iso-8859-1':
+            encoding = None
+
+        decoder = None
+        parts = []
+        received = 0
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+            if received > FETCH_MAX_BYTES:
+                raise ValueError(f"网页内容超过大小上限 {FETCH_MAX_BYTES} 字节")
+            if decoder is None:
+                encoding = encoding or sniff_html_encoding(chunk[:4096]) or 'utf-8'
+                try:
+                    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+                except LookupError:
+                    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            parts.append(decoder.decode(chunk))
+        if decoder is not None:
+            parts.append(decoder.decode(b'', final=True))
+        return {
+            "not_modified": False,
+            "html": ''.join(parts),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified")
+        }
+
+def parse_main_content_bs4(html: str, base_url: str = "") -> str:
+    """从HTML中解析出主要文本内容（旧版：整页去掉固定标签后取文本）"""
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # 移除不需要的元素
+    for element in soup(['script', 'style', 'nav', 'header', 'footer', 'iframe', 'noscript']):
+        element.decompose()
         
-        # 检测并使用正确的编码
-        if response.encoding.lower() == 'iso-8859-1':
-            response.encoding = response.apparent_encoding
-            
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 移除不需要的元素
-        for element in soup(['script', 'style', 'nav', 'header', 'footer', 'iframe', 'noscript']):
-            element.decompose()
-            
-        # 获取文本
-        text = soup.get_text()
-        
-        # 清理文本
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
-        
-        return text
+    # 获取文本
+    text = soup.get_text()
+    
+    # 清理文本
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = ' '.join(chunk for chunk in chunks if chunk)
+    
+    return text
+
+# 正文提取后端：density（标准库流式解析 + 文本密度打分）、lxml（同样的打分，使用 lxml 解析，更快）、bs4（旧版）
+EXTRACTOR_BACKEND = os.getenv("EXTRACTOR_BACKEND", "density").lower()
+
+# 安装了 lxml 时可使用 lxml 解析
+try:
+    from lxml import etree as lxml_etree
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+class DensityExtractor:
+    """流式正文提取：不构建DOM树，边解析边收集文本块，按文本密度为容器打分后输出得分最高的容器
+
+    实现 lxml 解析器的 target 接口（start/end/data/close），标准库 HTMLParser 通过 HtmlParserFeeder 驱动。
+    输出保留标题、列表、表格和图片链接，使用类 Markdown 的格式。
+    """
+
+    # 整个子树都不输出的元素
+    SKIP_TAGS = {
+        "script", "style", "noscript", "iframe", "svg", "nav", "header", "footer",
+        "aside", "button", "select", "template", "head", "canvas",
+    }
+    # 参与打分的容器元素；form 也作为容器，ASP.NET WebForms 等页面的正文整体包在 form 中
+    CONTAINER_TAGS = {"body", "main", "article", "section", "div", "form"}
+    # 文本块元素，开始和结束处都会断开文本块
+    BLOCK_TAGS = {
+        "p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "pre", "blockquote",
+        "tr", "dt", "dd", "figcaption", "caption", "ul", "ol", "table", "br", "hr",
+    } | CONTAINER_TAGS
+    HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+    # 这些元素一定不会被当作样板内容跳过
+    NEVER_SKIP_TAGS = {"html", "body", "main", "article"}
+    UNLIKELY_PATTERN = re.compile(
+        r"comment|sidebar|footer|navbar|menu|share|related|advert|\bads?\b|banner|promo|"
+        r"subscribe|breadcrumb|cookie|popup|modal|social|recommend|pagination",
+        re.IGNORECASE,
+    )
+    LIKELY_PATTERN = re.compile(r"article|content|main|post|entry|body|story", re.IGNORECASE)
+    SPACE_PATTERN = re.compile(r"\s+")
+    # 参与打分的最短文本块
+    MIN_BLOCK_CHARS = 25
+    # 选中内容过短时认为打分失败，退回输出全部文本块
+    MIN_RESULT_CHARS = 200
+    # 文本少于此长度或以链接为主的 form 视为搜索框、登录框等样板内容
+    MIN_FORM_CHARS = 200
+
+    def __init__(self, base_url: str = ""):
+        self.base_url = base_url
+        # 打开的元素：(标签, 所属容器下标)
+        self.stack: List[tuple] = []
+        self.skip_tag = ""
+        self.skip_depth = 0
+        self.link_depth = 0
+        self.title_depth = 0
+        self.title = ""
+        # 容器：父容器下标、得分、文本长度、链接文本长度
+        self.container_parent: List[Optional[int]] = []
+        self.container_score: List[float] = []
+        self.container_text: List[int] = []
+        self.container_links: List[int] = []
+        # form 元素对应的容器下标
+        self.form_containers: set = set()
+        # 文本块：(容器下标, 类型, 文本, 链接文本长度)
+        self.blocks: List[tuple] = []
+        self.buffer: List[str] = []
+        self.buffer_links = 0
+
+    def current_container(self) -> Optional[int]:
+        return self.stack[-1][1] if self.stack else None
+
+    def block_kind(self) -> str:
+        for tag, _ in reversed(self.stack):
+            if tag in self.HEADING_TAGS or tag in ("li", "pre", "blockquote", "tr", "dt", "dd"):
+                return tag
+            if tag in self.CONTAINER_TAGS:
+                break
+        return "p"
+
+    def flush(self):
+        """结束当前文本块"""
+        if not self.buffer:
+            return
+        raw = "".join(self.buffer)
+        kind = self.block_kind()
+        text = raw.strip("\n") if kind == "pre" else self.SPACE_PATTERN.sub(" ", raw).strip()
+        if text:
+            self.add_block(kind, text, self.buffer_links)
+        self.buffer = []
+        self.buffer_links = 0
+
+    def add_block(self, kind: str, text: str, link_chars: int):
+        container = self.current_container()
+        self.blocks.append((container, kind, text, link_chars))
+        # 文本和链接长度计入所有祖先容器，用于计算链接密度
+        ancestor = container
+        while ancestor is not None:
+            self.container_text[ancestor] += len(text)
+            self.container_links[ancestor] += link_chars
+            ancestor = self.container_parent[ancestor]
+        if kind in ("p", "pre", "blockquote") and len(text) >= self.MIN_BLOCK_CHARS and container is not None:
+            # readability 打分：基础分 + 逗号数 + 每100字1分（最多3分），父容器得全分，祖父容器得一半
+            score = 1 + text.count(",") + text.count("，") + min(len(text) / 100, 3)
+            self.container_score[container] += score
+            grandparent = self.container_parent[container]
+            if grandparent is not None:
+                self.container_score[grandparent] += score / 2
+
+    def is_boilerplate(self, tag: str, attrs: Dict[str, Any]) -> bool:
+        if tag in self.NEVER_SKIP_TAGS:
+            return False
+        marker = f"{attrs.get('class') or ''} {attrs.get('id') or ''}"
+        if not marker.strip():
+            return False
+        return bool(self.UNLIKELY_PATTERN.search(marker)) and not self.LIKELY_PATTERN.search(marker)
+
+    def start(self, tag, attrs):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag == "title":
+            self.title_depth += 1
+        if self.skip_depth:
+            # 跳过的子树内只统计同名元素的嵌套，避免未闭合的内部元素导致后续内容全部被跳过
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+        if tag in self.SKIP_TAGS or self.is_boilerplate(tag, attrs):
+            self.skip_tag = tag
+            self.skip_depth = 1
+            return
+        if tag in self.BLOCK_TAGS:
+            self.flush()
+        elif tag in ("td", "th") and self.buffer:
+            self.buffer.append(" | ")
+        container = self.current_container()
+        if tag in self.CONTAINER_TAGS:
+            self.container_parent.append(container)
+            self.container_score.append(0.0)
+            self.container_text.append(0)
+            self.container_links.append(0)
+            container = len(self.container_parent) - 1
+            if tag == "form":
+                self.form_containers.add(container)
+        self.stack.append((tag, container))
+        if tag == "a":
+            self.link_depth += 1
+        elif tag == "img":
+            src = attrs.get("src") or attrs.get("data-src")
+            if src and not src.startswith("data:"):
+                self.flush()
+                alt = self.SPACE_PATTERN.sub(" ", attrs.get("alt") or "").strip()
+                self.add_block("img", f"![{alt}]({urljoin(self.base_url, src)})", 0)
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag == "title" and self.title_depth:
+            self.title_depth -= 1
+        if self.skip_depth:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+            return
+        # 容忍未闭合的元素：弹出到最近的同名元素为止，找不到则忽略
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                break
+        else:
+            return
+        if tag in self.BLOCK_TAGS or any(open_tag in self.BLOCK_TAGS for open_tag, _ in self.stack[index + 1:]):
+            self.flush()
+        self.link_depth -= sum(1 for open_tag, _ in self.stack[index:] if open_tag == "a")
+        del self.stack[index:]
+
+    def data(self, text):
+        if self.title_depth:
+            self.title += text
+            return
+        if self.skip_depth:
+            return
+        self.buffer.append(text)
+        if self.link_depth:
+            self.buffer_links += len(text.strip())
+
+    def close(self) -> str:
+        self.flush()
+        selected = self.select_blocks()
+        lines = []
+        title = self.SPACE_PATTERN.sub(" ", self.title).strip()
+        if title and not any(kind == "h1" and text == title for _, kind, text, _ in selected):
+            lines.append(f"# {title}")
+        for _, kind, text, link_chars in selected:
+            # 正文中的导航式链接列表
+            if kind not in self.HEADING_TAGS and kind != "img" and link_chars > len(text) * 0.5:
+                continue
+            if kind in self.HEADING_TAGS:
+                lines.append(f"{'#' * int(kind[1])} {text}")
+            elif kind in ("li", "dt", "dd"):
+                lines.append(f"- {text}")
+            elif kind == "tr":
+                lines.append(f"| {text} |")
+            elif kind == "blockquote":
+                lines.append(f"> {text}")
+            elif kind == "pre":
+                lines.append(f"```\n{text}\n```")
+            else:
+                lines.append(text)
+        return "\n".join(lines)
+
+    def content_blocks(self) -> List[tuple]:
+        """去掉文本密度低的 form（搜索框、登录框等）中的文本块"""
+        boilerplate = {
+            i for i in self.form_containers
+            if self.container_text[i] < self.MIN_FORM_CHARS or self.container_links[i] > self.container_text[i] * 0.5
+        }
+        if not boilerplate:
+            return self.blocks
+        inside: Dict[Optional[int], bool] = {None: False}
+
+        def in_boilerplate(container: Optional[int]) -> bool:
+            if container not in inside:
+                inside[container] = container in boilerplate or in_boilerplate(self.container_parent[container])
+            return inside[container]
+
+        return [block for block in self.blocks if not in_boilerplate(block[0])]
+
+    def select_blocks(self) -> List[tuple]:
+        """选出得分最高的容器及得分相近的兄弟容器中的文本块"""
+        blocks = self.content_blocks()
+        if not self.container_score:
+            return blocks
+        scores = [
+            score * (1 - (self.container_links[i] / self.container_text[i] if self.container_text[i] else 0))
+            for i, score in enumerate(self.container_score)
+        ]
+        best = max(range(len(scores)), key=scores.__getitem__)
+        if scores[best] <= 0:
+            return blocks
+        threshold = max(10, scores[best] * 0.2)
+        chosen = {best} | {
+            i for i, score in enumerate(scores)
+            if score >= threshold and self.container_parent[i] is not None
+            and self.container_parent[i] == self.container_parent[best]
+        }
+        inside: Dict[Optional[int], bool] = {None: False}
+
+        def is_inside(container: Optional[int]) -> bool:
+            if container not in inside:
+                inside[container] = container in chosen or is_inside(self.container_parent[container])
+            return inside[container]
+
+        selected = [block for block in blocks if is_inside(block[0])]
+        if sum(len(block[2]) for block in selected) < self.MIN_RESULT_CHARS:
+            return blocks
+        return selected
+
+class HtmlParserFeeder(HTMLParser):
+    """用标准库 HTMLParser 驱动 lxml 风格的解析 target"""
+
+    VOID_ELEMENTS = {
+        "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+        "meta", "param", "source", "track", "wbr",
+    }
+
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+        if tag in self.VOID_ELEMENTS:
+            self.target.end(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+        self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.VOID_ELEMENTS:
+            self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+def parse_main_content_density(html: str, base_url: str = "") -> str:
+    """标准库流式解析 + 文本密度打分提取正文"""
+    extractor = DensityExtractor(base_url)
+    feeder = HtmlParserFeeder(extractor)
+    feeder.feed(html)
+    feeder.close()
+    return extractor.close()
+
+def parse_main_content_lxml(html: str, base_url: str = "") -> str:
+    """lxml 流式解析 + 文本密度打分提取正文"""
+    parser = lxml_etree.HTMLParser(target=DensityExtractor(base_url))
+    parser.feed(html)
+    return parser.close()
+
+EXTRACTORS = {
+    "density": parse_main_content_density,
+    "lxml": parse_main_content_lxml,
+    "bs4": parse_main_content_bs4,
+}
+
+def parse_main_content(html: str, base_url: str = "", backend: Optional[str] = None) -> str:
+    """从HTML中解析出主要文本内容，按 EXTRACTOR_BACKEND 选择提取后端"""
+    backend = backend or EXTRACTOR_BACKEND
+    if backend == "lxml" and not LXML_AVAILABLE:
+        logger.warning("未安装 lxml，使用 density 提取后端")
+        backend = "density"
+    extractor = EXTRACTORS.get(backend)
+    if extractor is None:
+        logger.warning(f"未知的提取后端 {backend}，使用 density")
+        extractor = parse_main_content_density
+    content = extractor(html, base_url)
+    if extractor is not parse_main_content_bs4 and len(content) < DensityExtractor.MIN_RESULT_CHARS:
+        # 提取结果几乎为空时（页面结构特殊），退回旧版整页提取
+        fallback = parse_main_content_bs4(html, base_url)
+        if len(fallback) > len(content):
+            logger.info(f"正文提取结果过短（{len(content)} 字符），使用 bs4 提取")
+            return fallback
+    return content
+
+# 网页缓存配置：是否启用、无需重新验证的新鲜期（秒）及磁盘占用上限（字节）
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+PAGE_CACHE_FRESH_SECONDS = int(os.getenv("PAGE_CACHE_FRESH_SECONDS", "300"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+class PageCache:
+    """网页抓取缓存：保存原始响应和提取出的文本，按 LRU 在字节预算内淘汰"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # key -> {"size": 占用字节数, "last_used": 最近使用时间}
+        self.index: "OrderedDict[str, dict]" = OrderedDict()
+        self.total_bytes = 0
+        self._load()
+
+    def _load(self):
+        entries = []
+        for meta_file in self.cache_dir.glob("*.json"):
+            raw_file = meta_file.with_suffix(".html")
+            size = meta_file.stat().st_size + (raw_file.stat().st_size if raw_file.exists() else 0)
+            entries.append((meta_file.stem, size, meta_file.stat().st_mtime))
+        for key, size, last_used in sorted(entries, key=lambda entry: entry[2]):
+            self.index[key] = {"size": size, "last_used": last_used}
+            self.total_bytes += size
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _remove(self, key: str):
+        entry = self.index.pop(key, None)
+        if entry:
+            self.total_bytes -= entry["size"]
+        for suffix in (".json", ".html"):
+            (self.cache_dir / f"{key}{suffix}").unlink(missing_ok=True)
+
+    def _touch(self, key: str):
+        self.index[key]["last_used"] = time.time()
+        self.index.move_to_end(key)
+
+    async def lookup(self, url: str) -> Optional[dict]:
+        """查询缓存的网页元数据（含提取文本），不存在时返回 None"""
+        key = self.key_for(url)
+        if key not in self.index:
+            return None
+        try:
+            async with aiofiles.open(self.cache_dir / f"{key}.json", 'r', encoding='utf-8') as f:
+                meta = json.loads(await f.read())
+        except Exception as e:
+            logger.warning(f"读取网页缓存失败，已丢弃: {str(e)}")
+            self._remove(key)
+            return None
+        self._touch(key)
+        return meta
+
+    async def store(self, url: str, html: str, text: str, etag: Optional[str], last_modified: Optional[str]):
+        """保存原始响应及提取文本"""
+        key = self.key_for(url)
+        self._remove(key)
+        meta = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+            "extractor": EXTRACTOR_BACKEND,
+            "text": text
+        }
+        meta_data = json.dumps(meta, ensure_ascii=False)
+        async with aiofiles.open(self.cache_dir / f"{key}.html", 'w', encoding='utf-8') as f:
+            await f.write(html)
+        async with aiofiles.open(self.cache_dir / f"{key}.json", 'w', encoding='utf-8') as f:
+            await f.write(meta_data)
+        size = len(html.encode("utf-8")) + len(meta_data.encode("utf-8"))
+        self.index[key] = {"size": size, "last_used": time.time()}
+        self.total_bytes += size
+        # 超出字节预算时淘汰最久未使用的条目
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            oldest_key = next(iter(self.index))
+            self._remove(oldest_key)
+
+    async def load_html(self, url: str) -> Optional[str]:
+        """读取缓存的原始响应"""
+        raw_file = self.cache_dir / f"{self.key_for(url)}.html"
+        if not raw_file.exists():
+            return None
+        async with aiofiles.open(raw_file, 'r', encoding='utf-8') as f:
+            return await f.read()
+
+    async def save_meta(self, url: str, meta: dict):
+        """更新缓存的元数据"""
+        key = self.key_for(url)
+        meta_data = json.dumps(meta, ensure_ascii=False)
+        async with aiofiles.open(self.cache_dir / f"{key}.json", 'w', encoding='utf-8') as f:
+            await f.write(meta_data)
+
+    async def mark_revalidated(self, url: str, meta: dict):
+        """条件请求返回 304 后刷新抓取时间"""
+        meta["fetched_at"] = time.time()
+        await self.save_meta(url, meta)
+
+page_cache = PageCache(CACHE_DIR / "pages", PAGE_CACHE_MAX_BYTES)
+# 正在进行中的抓取，相同URL的并发请求共享同一次下载
+page_fetches: Dict[str, asyncio.Task] = {}
+
+async def load_page_text(url: str) -> str:
+    """获取网页正文，优先使用缓存并通过 ETag/Last-Modified 条件请求重新验证"""
+    meta = await page_cache.lookup(url) if PAGE_CACHE_ENABLED else None
+    if meta and meta.get("extractor") != EXTRACTOR_BACKEND:
+        # 提取后端已切换，用缓存的原始响应重新提取
+        html = await page_cache.load_html(url)
+        if html is not None:
+            with STAGE_SECONDS.time(stage="extract"):
+                meta["text"] = await asyncio.to_thread(parse_main_content, html, url)
+            meta["extractor"] = EXTRACTOR_BACKEND
+            await page_cache.save_meta(url, meta)
+        else:
+            meta = None
+    if meta and time.time() - meta["fetched_at"] < PAGE_CACHE_FRESH_SECONDS:
+        logger.info(f"使用网页缓存: {url}")
+        return meta["text"]
+
+    conditional_headers = {}
+    if meta:
+        if meta.get("etag"):
+            conditional_headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            conditional_headers["If-Modified-Since"] = meta["last_modified"]
+
+    with STAGE_SECONDS.time(stage="fetch"):
+        result = await fetch_page(url, conditional_headers or None)
+    if result["not_modified"] and meta:
+        logger.info(f"网页未修改，使用缓存: {url}")
+        await page_cache.mark_revalidated(url, meta)
+        return meta["text"]
+
+    # 解析是CPU密集操作，放到线程中执行，避免阻塞事件循环
+    with STAGE_SECONDS.time(stage="extract"):
+        text = await asyncio.to_thread(parse_main_content, result["html"], url)
+    if PAGE_CACHE_ENABLED:
+        await page_cache.store(url, result["html"], text, result["etag"], result["last_modified"])
+    return text
+
+async def extract_main_content(url: str) -> str:
+    """提取网页主要内容"""
+    try:
+        fetch_task = page_fetches.get(url)
+        if fetch_task is None:
+            fetch_task = asyncio.create_task(
+                asyncio.wait_for(load_page_text(url), timeout=FETCH_TOTAL_TIMEOUT)
+            )
+            page_fetches[url] = fetch_task
+            fetch_task.add_done_callback(lambda _: page_fetches.pop(url, None))
+        # shield 保证某个等待方被取消时不会中断其他任务共享的下载
+        return await asyncio.shield(fetch_task)
+    except asyncio.TimeoutError:
+        logger.error(f"提取内容超时: {url}")
+        raise HTTPException(status_code=400, detail=f"无法访问URL: 超过 {FETCH_TOTAL_TIMEOUT} 秒未完成")
     except Exception as e:
         logger.error(f"提取内容失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=400, detail=f"无法访问URL: {str(e)}")
@@ -155,10 +889,23 @@ def extract_main_content(url: str) -> str:
 PROMPT_DIR = Path("prompts")
 PROMPT_DIR.mkdir(exist_ok=True)
 
-def load_prompt(filename: str) -> str:
+SECTION_PROMPT_DEFAULT = """我会给你一篇长文档中的一个部分，请将其转化为美观漂亮的中文可视化网页中的一个内容区块：
+- 只输出一个或多个 <section> 元素的HTML片段，不要输出 <!DOCTYPE>、<html>、<head>、<body> 等页面结构
+- 保持原文的核心信息，以易读、可视化的方式呈现，使用清晰的标题层次
+- 使用 TailwindCSS 类名进行排版，风格参考Linear App的简约现代设计，并通过 dark: 前缀支持深色模式
+- 图标使用 Font Awesome（页面已引入），避免使用emoji作为主要图标
+- 不要添加作者信息、页脚或与其他部分重复的导航内容
+- 不要输出任何解释说明，直接输出HTML片段"""
+
+SUMMARIZE_PROMPT_DEFAULT = """我会给你一篇长文档中的一个部分，文档整体超出了处理长度，请压缩这一部分：
+- 按要求的目标长度输出这一部分的中文摘要，保留标题层次、关键数据、结论、列表要点和图片链接
+- 删除重复、寒暄、广告和与主题无关的内容
+- 使用原文的 Markdown 结构输出，不要输出任何解释说明"""
+
+def read_prompt_file(filename: str, prompt_dir: Path = PROMPT_DIR) -> str:
     """从文件加载提示词"""
     try:
-        prompt_path = PROMPT_DIR / filename
+        prompt_path = prompt_dir / filename
         if not prompt_path.exists():
             logger.warning(f"提示词文件不存在: {filename}，使用默认提示词")
             if filename == "continue_prompt.txt":
@@ -207,6 +954,10 @@ https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/lib/index.min.js
 - 确保代码符合W3C标准，无错误警告
 - 页面在不同浏览器中保持一致的外观和功能
 请根据上传文件的内容类型（文档、数据、图片等），创建最适合展示该内容的可视化网页。"""
+            elif filename == "section_prompt.txt":
+                return SECTION_PROMPT_DEFAULT
+            elif filename == "summarize_prompt.txt":
+                return SUMMARIZE_PROMPT_DEFAULT
             else:
                 raise ValueError(f"加载提示词文件失败，未知的提示词文件: {filename}")
         
@@ -216,63 +967,568 @@ https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/lib/index.min.js
         logger.error(f"加载提示词文件失败: {str(e)}")
         raise ValueError(f"加载提示词文件失败: {str(e)}")
 
-# 存储任务状态和处理器
-tasks: Dict[str, dict] = {}
-task_processors: Dict[str, Any] = {}
+# 配置热加载：最多每隔 CONFIG_CHECK_INTERVAL 秒检查一次 .env 和提示词文件的修改时间，有变化才重新读取
+CONFIG_CHECK_INTERVAL = float(os.getenv("CONFIG_CHECK_INTERVAL", "5"))
+ENV_FILE = Path(__file__).resolve().parent / ".env"
+
+class ConfigRegistry:
+    """配置与提示词注册表：缓存解析结果，文件修改时间变化或调用管理接口时重新加载"""
+
+    def __init__(self, env_file: Path, prompt_dir: Path, check_interval: float):
+        self.env_file = env_file
+        self.prompt_dir = prompt_dir
+        self.check_interval = check_interval
+        # 文件名 -> (修改时间, 提示词内容)
+        self.prompts: Dict[str, tuple] = {}
+        self.env_mtime = self._mtime(env_file)
+        self.last_check = time.monotonic()
+        self.version = 0
+
+    @staticmethod
+    def _mtime(path: Path) -> Optional[int]:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """检查文件是否有变化（按间隔节流），返回是否重新加载了内容"""
+        now = time.monotonic()
+        if not force and now - self.last_check < self.check_interval:
+            return False
+        self.last_check = now
+        changed = False
+        env_mtime = self._mtime(self.env_file)
+        if force or env_mtime != self.env_mtime:
+            self.env_mtime = env_mtime
+            if env_mtime is not None:
+                load_dotenv(self.env_file, override=True)
+            changed = True
+        for filename, (mtime, _) in list(self.prompts.items()):
+            if force or self._mtime(self.prompt_dir / filename) != mtime:
+                del self.prompts[filename]
+                changed = True
+        if changed:
+            self.version += 1
+            logger.info(f"配置已重新加载，版本 {self.version}")
+        return changed
+
+    def get_prompt(self, filename: str) -> str:
+        """获取提示词，文件未变化时使用缓存"""
+        self.refresh()
+        cached = self.prompts.get(filename)
+        if cached is None:
+            cached = (self._mtime(self.prompt_dir / filename), read_prompt_file(filename, self.prompt_dir))
+            self.prompts[filename] = cached
+        return cached[1]
+
+    def get_int(self, name: str, default: int) -> int:
+        """获取整数配置，.env 有变化时先重新加载"""
+        self.refresh()
+        return int(os.getenv(name, str(default)))
+
+    def get_str(self, name: str, default: str) -> str:
+        """获取字符串配置，.env 有变化时先重新加载"""
+        self.refresh()
+        return os.getenv(name, default)
+
+config_registry = ConfigRegistry(ENV_FILE, PROMPT_DIR, CONFIG_CHECK_INTERVAL)
 
-async def get_task_status(task: dict) -> dict:
-    """获取任务状态"""
-    task_id = task.get("task_id")
-    processor = task_processors.get(task_id)
-    
-    try:
-        if not processor:
-            # 创建新的处理器
-            processor = process_status_generator(task.get("url"), task.get("text"))
-            task_processors[task_id] = processor
-        
-        # 获取下一个状态
-        status_data = await anext(processor)
-        # 确保返回的数据包含 status 字段
-        parsed_status = json.loads(status_data)
-        if "data" in parsed_status:
-            # 如果状态包含在 data 字段中，提取出来
-            return parsed_status["data"]
-        return parsed_status
+def load_prompt(filename: str) -> str:
+    """加载提示词（带缓存，文件修改后自动重新读取）"""
+    return config_registry.get_prompt(filename)
+
+# 管理接口口令：调用管理接口需在 X-Admin-Token 请求头中携带；未设置时管理接口关闭
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def check_admin_token(request: Request):
+    """校验管理接口口令，未配置口令时管理接口视为不存在"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="无权访问")
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    """立即重新加载 .env 和提示词文件"""
+    check_admin_token(request)
+    config_registry.refresh(force=True)
+    return {
+        "version": config_registry.version,
+        "max_ai_segments": config_registry.get_int("MAX_AI_SEGMENTS", 20),
+        "model": config_registry.get_str("OPENAI_MODEL", "claude 3.7")
+    }
+
+# 任务后台执行器（仅在启动任务的 worker 内）
+task_runners: Dict[str, asyncio.Task] = {}
+
+# 任务结束后状态保留的时间（秒），超时后自动清理，避免前端未读取时内存泄漏
+TASK_RESULT_TTL = int(os.getenv("TASK_RESULT_TTL", "600"))
+TERMINAL_STATUSES = ("completed", "error")
+
+# SSE 心跳间隔（秒）及断线重连建议间隔（毫秒）
+SSE_PING_INTERVAL = int(os.getenv("SSE_PING_INTERVAL", "15"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+
+# 任务状态存储：memory 为进程内存储；sqlite 为同一台主机上多个 worker 共享的存储（WAL 模式，不能放在网络文件系统上）
+TASK_STORE = os.getenv("TASK_STORE", "memory").lower()
+TASK_STORE_PATH = Path(os.getenv("TASK_STORE_PATH", "cache/tasks.db"))
+TASK_STORE_POLL_INTERVAL = float(os.getenv("TASK_STORE_POLL_INTERVAL", "0.5"))
+# SQLite 存储中 AI 流式增量事件的合并间隔（秒），0 表示每个增量单独落库
+TASK_STORE_STREAM_INTERVAL = float(os.getenv("TASK_STORE_STREAM_INTERVAL", "2"))
+
+class TaskStore(ABC):
+    """任务状态存储接口：保存任务记录、最新状态及全部状态事件（用于断线重连补发）"""
+
+    @abstractmethod
+    async def create(self, record: dict):
+        """保存新任务的记录"""
+
+    @abstractmethod
+    async def get(self, task_id: str) -> Optional[dict]:
+        """获取任务记录，不存在或已过期时返回 None"""
+
+    @abstractmethod
+    async def append_event(self, task_id: str, status: dict):
+        """记录一条状态事件，并更新任务的最新状态"""
+
+    @abstractmethod
+    async def events_since(self, task_id: str, index: int) -> Optional[List[dict]]:
+        """获取第 index 条及之后的状态事件，任务不存在时返回 None"""
+
+    @abstractmethod
+    async def wait_for_events(self, task_id: str, index: int, timeout: float):
+        """等待第 index 条事件出现，最多等待 timeout 秒"""
+
+    @abstractmethod
+    async def expire(self, task_id: str, ttl: float):
+        """设置任务在 ttl 秒后过期清理"""
+
+    async def close(self):
+        pass
+
+class MemoryTaskStore(TaskStore):
+    """进程内任务状态存储（默认），仅对当前 worker 可见"""
+
+    def __init__(self):
+        self.records: Dict[str, dict] = {}
+        self.events: Dict[str, List[dict]] = {}
+        self.wakers: Dict[str, asyncio.Event] = {}
+
+    async def create(self, record: dict):
+        task_id = record["task_id"]
+        self.records[task_id] = record
+        self.events[task_id] = []
+        self.wakers[task_id] = asyncio.Event()
+
+    async def get(self, task_id: str) -> Optional[dict]:
+        return self.records.get(task_id)
+
+    async def append_event(self, task_id: str, status: dict):
+        record = self.records.get(task_id)
+        if record is None:
+            return
+        record["state"] = status
+        record["status"] = status.get("status", record.get("status"))
+        record["updated_at"] = time.time()
+        self.events[task_id].append(status)
+        # 唤醒等待中的推送连接
+        waker, self.wakers[task_id] = self.wakers[task_id], asyncio.Event()
+        waker.set()
+
+    async def events_since(self, task_id: str, index: int) -> Optional[List[dict]]:
+        events = self.events.get(task_id)
+        if events is None:
+            return None
+        return events[index:]
+
+    async def wait_for_events(self, task_id: str, index: int, timeout: float):
+        waker = self.wakers.get(task_id)
+        if waker is None or len(self.events.get(task_id, [])) > index:
+            return
+        try:
+            await asyncio.wait_for(waker.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _delete(self, task_id: str):
+        self.records.pop(task_id, None)
+        self.events.pop(task_id, None)
+        waker = self.wakers.pop(task_id, None)
+        if waker:
+            waker.set()
+
+    async def expire(self, task_id: str, ttl: float):
+        asyncio.get_running_loop().call_later(ttl, self._delete, task_id)
+
+class SQLiteTaskStore(TaskStore):
+    """基于 SQLite 的共享任务状态存储，数据库操作在线程中执行，不阻塞事件循环
+
+    任务记录（含用户粘贴的原文）创建后不再改写，最新状态单独存放在 task_states 表中；
+    AI 流式输出的增量事件先在内存中合并，每 stream_interval 秒最多落库一条。
+    """
+
+    def __init__(self, db_path: Path, poll_interval: float, stream_interval: float = 0):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.stream_interval = stream_interval
+        # 尚未落库的流式增量事件: task_id -> (事件, 首个增量的时间)
+        self.pending_streams: Dict[str, tuple] = {}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, record TEXT NOT NULL, expires_at REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_states (task_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "task_id TEXT NOT NULL, seq INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (task_id, seq))"
+        )
 
-    except StopAsyncIteration:
-        # 处理完成，清理处理器
-        if task_id in task_processors:
-            del task_processors[task_id]
+    async def _run(self, func, *args):
+        def locked():
+            with self.lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    def _get(self, task_id: str) -> Optional[dict]:
+        row = self.conn.execute(
+            "SELECT tasks.record, task_states.state, task_states.updated_at FROM tasks "
+            "LEFT JOIN task_states ON task_states.task_id = tasks.task_id "
+            "WHERE tasks.task_id = ? AND (tasks.expires_at IS NULL OR tasks.expires_at > ?)",
+            (task_id, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[0])
+        if row[1] is not None:
+            state = json.loads(row[1])
+            record["state"] = state
+            record["status"] = state.get("status", record.get("status"))
+            record["updated_at"] = row[2]
+        return record
+
+    def _exists(self, task_id: str) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM tasks WHERE task_id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (task_id, time.time())
+        ).fetchone()
+        return row is not None
+
+    def _append_event(self, task_id: str, status: dict):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._exists(task_id):
+                self.conn.execute("ROLLBACK")
+                return
+            data = json.dumps(status, ensure_ascii=False)
+            # 只更新很小的状态行，不读取、不改写包含原文的任务记录
+            self.conn.execute(
+                "INSERT OR REPLACE INTO task_states (task_id, state, updated_at) VALUES (?, ?, ?)",
+                (task_id, data, time.time())
+            )
+            self.conn.execute(
+                "INSERT INTO events (task_id, seq, data) "
+                "SELECT ?, COALESCE(MAX(seq) + 1, 0), ? FROM events WHERE task_id = ?",
+                (task_id, data, task_id)
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _events_since(self, task_id: str, index: int) -> Optional[List[dict]]:
+        if not self._exists(task_id):
+            return None
+        rows = self.conn.execute(
+            "SELECT data FROM events WHERE task_id = ? AND seq >= ? ORDER BY seq",
+            (task_id, index)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _has_event(self, task_id: str, index: int) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM events WHERE task_id = ? AND seq >= ? LIMIT 1", (task_id, index)
+        ).fetchone()
+        return row is not None
+
+    def _expire(self, task_id: str, ttl: float):
+        now = time.time()
+        self.conn.execute("UPDATE tasks SET expires_at = ? WHERE task_id = ?", (now + ttl, task_id))
+        # 顺便清理已过期的任务
+        for table in ("events", "task_states"):
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE task_id IN (SELECT task_id FROM tasks WHERE expires_at < ?)", (now,)
+            )
+        self.conn.execute("DELETE FROM tasks WHERE expires_at < ?", (now,))
+
+    def _create(self, record: dict):
+        self.conn.execute("DELETE FROM task_states WHERE task_id = ?", (record["task_id"],))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, record, expires_at) VALUES (?, ?, NULL)",
+            (record["task_id"], json.dumps(record, ensure_ascii=False))
+        )
+
+    async def create(self, record: dict):
+        await self._run(self._create, record)
+
+    async def get(self, task_id: str) -> Optional[dict]:
+        return await self._run(self._get, task_id)
+
+    def _coalesce_stream(self, task_id: str, status: dict) -> Optional[dict]:
+        """合并连续的流式增量，返回需要落库的事件（到达合并间隔时返回合并后的事件）"""
+        pending = self.pending_streams.get(task_id)
+        if pending:
+            event, since = pending
+            if (event.get("round") == status.get("round")
+                    and event.get("offset", 0) + len(event.get("delta", "")) == status.get("offset")):
+                event["delta"] += status.get("delta", "")
+                if time.monotonic() - since < self.stream_interval:
+                    return None
+                del self.pending_streams[task_id]
+                return event
+        self.pending_streams[task_id] = (dict(status), time.monotonic())
+        # 不连续时先落库之前积累的增量
+        return pending[0] if pending else None
+
+    async def append_event(self, task_id: str, status: dict):
+        if self.stream_interval > 0 and status.get("status") == "ai_streaming":
+            event = self._coalesce_stream(task_id, status)
+            if event is not None:
+                await self._run(self._append_event, task_id, event)
+            return
+        pending = self.pending_streams.pop(task_id, None)
+        if pending:
+            await self._run(self._append_event, task_id, pending[0])
+        await self._run(self._append_event, task_id, status)
+
+    async def events_since(self, task_id: str, index: int) -> Optional[List[dict]]:
+        return await self._run(self._events_since, task_id, index)
+
+    async def wait_for_events(self, task_id: str, index: int, timeout: float):
+        # 其他进程写入的事件无法直接通知，按间隔轮询数据库
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if await self._run(self._has_event, task_id, index):
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def expire(self, task_id: str, ttl: float):
+        await self._run(self._expire, task_id, ttl)
+
+    async def close(self):
+        await self._run(self.conn.close)
+
+def create_task_store() -> TaskStore:
+    """根据 TASK_STORE 配置创建任务状态存储"""
+    if TASK_STORE == "sqlite":
+        logger.info(f"使用 SQLite 任务状态存储: {TASK_STORE_PATH}")
+        return SQLiteTaskStore(TASK_STORE_PATH, TASK_STORE_POLL_INTERVAL, TASK_STORE_STREAM_INTERVAL)
+    if TASK_STORE != "memory":
+        logger.warning(f"未知的任务状态存储类型: {TASK_STORE}，使用内存存储")
+    return MemoryTaskStore()
+
+task_store = create_task_store()
+
+async def record_task_status(task_id: str, status: dict):
+    """记录任务的最新状态"""
+    await task_store.append_event(task_id, status)
+
+# 任务调度配置：同时运行的最大任务数、最大排队数及初始的单任务耗时估计（秒）
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "4"))
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "50"))
+JOB_DURATION_ESTIMATE = float(os.getenv("JOB_DURATION_ESTIMATE", "300"))
+
+class JobScheduler:
+    """任务调度器：限制同时运行的任务数，其余任务按提交顺序排队"""
+
+    def __init__(self, max_concurrent: int, max_queue_depth: int, duration_estimate: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue_depth = max_queue_depth
+        self.avg_duration = duration_estimate
+        self.running = 0
+        self.queue: List[str] = []
+        self.waker = asyncio.Event()
+
+    def _notify(self):
+        waker, self.waker = self.waker, asyncio.Event()
+        waker.set()
+
+    def is_full(self) -> bool:
+        """运行名额已满且排队数已达上限"""
+        return self.running >= self.max_concurrent and len(self.queue) >= self.max_queue_depth
+
+    def estimate_wait(self, position: int) -> int:
+        """估算排在第 position 位的任务需要等待的秒数"""
+        return int(math.ceil(position / self.max_concurrent) * self.avg_duration)
+
+    async def acquire(self, task_id: str):
+        """排队等待运行名额，等待期间产出包含排队位置的状态；生成器结束即表示已获得名额"""
+        self.queue.append(task_id)
+        acquired = False
+        try:
+            last_position = None
+            while True:
+                position = self.queue.index(task_id) + 1
+                if position == 1 and self.running < self.max_concurrent:
+                    self.queue.pop(0)
+                    self.running += 1
+                    acquired = True
+                    self._notify()
+                    return
+                waker = self.waker
+                if position != last_position:
+                    last_position = position
+                    estimated_wait = self.estimate_wait(position)
+                    yield {
+                        "status": "waiting",
+                        "queue_position": position,
+                        "estimated_wait": estimated_wait,
+                        "message": f"排队中，当前第 {position} 位，预计等待 {estimated_wait} 秒"
+                    }
+                await waker.wait()
+        finally:
+            if not acquired and task_id in self.queue:
+                self.queue.remove(task_id)
+                self._notify()
+
+    def release(self, duration: Optional[float] = None):
+        """释放运行名额，并用本次耗时更新平均耗时（指数加权）"""
+        self.running -= 1
+        if duration is not None:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        self._notify()
+
+    def stats(self) -> dict:
         return {
-            "status": "completed",
-            "message": "处理完成"
+            "running": self.running,
+            "queued": len(self.queue),
+            "max_concurrent": self.max_concurrent,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_duration": round(self.avg_duration, 1)
         }
+
+job_scheduler = JobScheduler(MAX_CONCURRENT_JOBS, MAX_QUEUE_DEPTH, JOB_DURATION_ESTIMATE)
+
+async def run_task(task_id: str):
+    """后台执行任务：持续推进处理流程并记录状态，不再依赖前端轮询驱动"""
+    task = await task_store.get(task_id)
+    processor = process_status_generator(task.get("url"), task.get("text"), task_id=task_id,
+                                         use_cache=task.get("use_cache", True))
+    last_status = None
+    started_at = time.monotonic()
+    outcome = "error"
+    try:
+        async for status_data in processor:
+            parsed_status = json.loads(status_data)
+            # 如果状态包含在 data 字段中，提取出来
+            last_status = parsed_status.get("data", parsed_status)
+            await record_task_status(task_id, last_status)
+
+        if not last_status or last_status.get("status") not in TERMINAL_STATUSES:
+            await record_task_status(task_id, {
+                "status": "completed",
+                "message": "处理完成"
+            })
+            outcome = "completed"
+        elif last_status.get("status") == "completed":
+            outcome = "cached" if last_status.get("cached") else "completed"
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        await record_task_status(task_id, {
+            "status": "error",
+            "error": "任务已取消",
+            "message": "处理过程中发生错误"
+        })
+        raise
     except Exception as e:
-        logger.error(f"获取任务状态失败: {str(e)}", exc_info=True)
-        # 发生错误，清理处理器
-        if task_id in task_processors:
-            del task_processors[task_id]
-        return {
+        logger.error(f"后台任务执行失败: {str(e)}", exc_info=True)
+        await record_task_status(task_id, {
             "status": "error",
             "error": str(e),
             "message": "处理过程中发生错误"
-        }
+        })
+    finally:
+        JOBS.inc(outcome=outcome)
+        JOB_SECONDS.observe(time.monotonic() - started_at, outcome=outcome)
+        await processor.aclose()
+        task_runners.pop(task_id, None)
+        if inflight_jobs.get(task.get("job_key")) == task_id:
+            del inflight_jobs[task["job_key"]]
+        # 结束后延迟清理任务数据
+        await task_store.expire(task_id, TASK_RESULT_TTL)
+
+def start_task(task_id: str):
+    """在后台启动任务"""
+    runner = asyncio.create_task(run_task(task_id), name=f"task-{task_id}")
+    task_runners[task_id] = runner
+    return runner
+
+def get_task_status(task: dict) -> dict:
+    """获取任务最新记录的状态"""
+    return task.get("state") or {
+        "status": "waiting",
+        "message": "准备处理..."
+    }
 
 class ProcessRequest(BaseModel):
     url: Optional[str] = None
     text: Optional[str] = None
+    no_cache: bool = False  # 为 True 时跳过结果缓存，强制重新生成
+
+# 进行中的任务：提交内容键 -> task_id，相同提交合并到同一个任务
+inflight_jobs: Dict[str, str] = {}
+
+def submission_key(url: Optional[str], text: Optional[str]) -> str:
+    """计算提交内容的键，用于识别并发的相同请求"""
+    if url:
+        return "url:" + url.strip()
+    return "text:" + hashlib.sha256(" ".join((text or "").split()).encode("utf-8")).hexdigest()
 
 @app.post("/init-process")
 async def init_process(request: ProcessRequest):
     """初始化处理任务"""
+    job_key = submission_key(request.url, request.text)
+    running_task_id = inflight_jobs.get(job_key)
+    if running_task_id in task_runners:
+        # 相同内容正在处理中，直接复用该任务的进度和结果
+        logger.info(f"合并到进行中的相同任务: {running_task_id}")
+        return {"task_id": running_task_id, "coalesced": True}
+
+    if ai_circuit_breaker.state == "open":
+        # 上游AI服务不可用时直接拒绝，避免任务排队后才失败
+        JOBS_REJECTED.inc(reason="circuit_open")
+        raise HTTPException(
+            status_code=503,
+            detail="AI 服务暂时不可用，请稍后重试",
+            headers={"Retry-After": str(math.ceil(ai_circuit_breaker.retry_after()))}
+        )
+
+    if job_scheduler.is_full():
+        retry_after = job_scheduler.estimate_wait(job_scheduler.max_queue_depth)
+        JOBS_REJECTED.inc(reason="queue_full")
+        raise HTTPException(
+            status_code=429,
+            detail="服务繁忙，排队任务已满，请稍后重试",
+            headers={"Retry-After": str(retry_after)}
+        )
+
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {
-        "task_id": task_id,  # 添加 task_id 到任务数据中
+    await task_store.create({
+        "task_id": task_id,
         "url": request.url,
         "text": request.text,
-        "status": "waiting"
-    }
+        "use_cache": not request.no_cache,
+        "job_key": job_key,
+        "status": "waiting",
+        "created_at": time.time()
+    })
+    inflight_jobs[job_key] = task_id
+    start_task(task_id)
     return {"task_id": task_id}
 
 class TaskStatusRequest(BaseModel):
@@ -281,74 +1537,210 @@ class TaskStatusRequest(BaseModel):
 @app.post("/process-events")
 async def process_events(request: TaskStatusRequest):
     """处理状态更新"""
-    if request.task_id not in tasks:
+    task = await task_store.get(request.task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="任务不存在")
         
-    task = tasks[request.task_id]
-    status = await get_task_status(task)
-    
-    # 如果任务完成或出错，清理任务数据
-    if status["status"] in ["completed", "error"]:
-        if request.task_id in tasks:
-            del tasks[request.task_id]
-    
-    return status
+    # 任务可能被多个相同提交共享，结束后的数据由 TASK_RESULT_TTL 统一清理
+    return get_task_status(task)
+
+@app.get("/process-stream/{task_id}")
+async def process_stream(task_id: str, request: Request):
+    """以 SSE 推送任务状态，支持心跳及通过 Last-Event-ID 断线重连"""
+    if await task_store.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    # 断线重连时从上次收到的事件之后继续推送
+    last_event_id = request.headers.get("last-event-id", "")
+    start_index = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    async def event_publisher():
+        index = start_index
+        while True:
+            events = await task_store.events_since(task_id, index)
+            if events is None:
+                return
+            for status in events:
+                yield {
+                    "id": str(index),
+                    "event": "status",
+                    "retry": SSE_RETRY_MS,
+                    "data": json.dumps(status, ensure_ascii=False)
+                }
+                index += 1
+                if status.get("status") in TERMINAL_STATUSES:
+                    return
+            await task_store.wait_for_events(task_id, index, timeout=SSE_PING_INTERVAL)
+
+    return EventSourceResponse(event_publisher(), ping=SSE_PING_INTERVAL)
 
 # 在文件开头添加
 TMP_DIR = Path("tmp")
 TMP_DIR.mkdir(exist_ok=True)
-
+# 生成过程中部分文档的预览文件名
+PREVIEW_FILENAME = "partial.html"
+
+# 结果缓存配置：是否启用、有效期（秒）及最大条目数
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+
+def normalize_content(content: str) -> str:
+    """规范化内容：合并空白字符，使仅有空白差异的提交得到相同的缓存键"""
+    return " ".join(content.split())
+
+def result_cache_key(content: str, budget: str = "") -> str:
+    """根据规范化内容、提示词内容和模型计算结果缓存键；budget 为超出输入预算时的预算及处理策略"""
+    digest = hashlib.sha256()
+    for part in (
+        normalize_content(content),
+        budget,
+        load_prompt("format_prompt.txt"),
+        load_prompt("continue_prompt.txt"),
+        load_prompt("section_prompt.txt"),
+        config_registry.get_str("OPENAI_MODEL", "claude 3.7")
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+SCRIPT_STYLE_BLOCK_PATTERN = re.compile(r'<(script|style)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+
+def has_body_content(html: str) -> bool:
+    """页面 <body> 中是否有可见的文本内容"""
+    match = BODY_INNER_PATTERN.search(html)
+    if match is None:
+        return False
+    body = SCRIPT_STYLE_BLOCK_PATTERN.sub('', match.group(1))
+    return bool(TAG_PATTERN.sub('', body).strip())
+
+class ResultCache:
+    """内容寻址的结果缓存：缓存键 -> 已生成的 static/html/<file_id>.html"""
+
+    def __init__(self, index_file: Path, ttl: int, max_entries: int):
+        self.index_file = index_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._load()
+
+    def _load(self):
+        if not self.index_file.exists():
+            return
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 按最近使用时间排序，保证 LRU 淘汰顺序
+            for key, entry in sorted(data.items(), key=lambda item: item[1].get("last_used", 0)):
+                self.entries[key] = entry
+        except Exception as e:
+            logger.warning(f"加载结果缓存索引失败，将重新建立: {str(e)}")
+
+    async def _save(self):
+        tmp_file = self.index_file.with_suffix(".tmp")
+        async with aiofiles.open(tmp_file, 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(self.entries, ensure_ascii=False))
+        os.replace(tmp_file, self.index_file)
+
+    def _evict(self):
+        """淘汰过期条目，并按 LRU 顺序淘汰超出数量上限的条目"""
+        now = time.time()
+        for key in [key for key, entry in self.entries.items() if now - entry["created_at"] > self.ttl]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时返回 file_id"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["created_at"] > self.ttl or not artifact_store.exists(entry["file_id"]):
+            del self.entries[key]
+            await self._save()
+            return None
+        entry["last_used"] = time.time()
+        self.entries.move_to_end(key)
+        await self._save()
+        return entry["file_id"]
+
+    async def put(self, key: str, file_id: str):
+        """记录新生成的结果"""
+        now = time.time()
+        self.entries[key] = {"file_id": file_id, "created_at": now, "last_used": now}
+        self.entries.move_to_end(key)
+        self._evict()
+        await self._save()
+
+result_cache = ResultCache(CACHE_DIR / "result_cache.json", RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES)
+
+
+# 重叠检测窗口（字符数）及忽略空白差异匹配时的最小重叠长度
+MERGE_OVERLAP_WINDOW = int(os.getenv("MERGE_OVERLAP_WINDOW", "4000"))
+MERGE_FUZZY_MIN_OVERLAP = int(os.getenv("MERGE_FUZZY_MIN_OVERLAP", "16"))
+
+OVERLAP_PROBE_LENGTH = 16
+WHITESPACE_PATTERN = re.compile(r'\s+')
+NON_WHITESPACE_PATTERN = re.compile(r'\S+')
+
+def longest_overlap(first: str, second: str) -> int:
+    """求 first 的后缀与 second 的前缀的最长重叠长度
+
+    先用 second 开头的探测串在 first 中查找候选起点（str.find 在C层线性扫描），
+    从最长的候选开始逐个校验；探测串更短的重叠再逐个长度比较。
+    """
+    max_overlap = min(len(first), len(second))
+    if not max_overlap:
+        return 0
+    probe = second[:OVERLAP_PROBE_LENGTH]
+    start = len(first) - max_overlap
+    position = first.find(probe, start)
+    while position != -1:
+        overlap = len(first) - position
+        if second.startswith(first[position:]):
+            return overlap
+        position = first.find(probe, position + 1)
+    for overlap in range(min(max_overlap, len(probe) - 1), 0, -1):
+        if first.endswith(second[:overlap]):
+            return overlap
+    return 0
+
+def overlap_cut(first: str, second: str) -> int:
+    """计算 second 开头与 first 末尾重复的部分长度，即合并时 second 需要跳过的字符数"""
+    tail = first[-MERGE_OVERLAP_WINDOW:]
+    head = second[:MERGE_OVERLAP_WINDOW]
+    cut = longest_overlap(tail, head)
+
+    # 忽略空白差异再匹配一次（AI续写时常改变缩进和换行），取能去掉更多重复内容的结果
+    fuzzy = longest_overlap(WHITESPACE_PATTERN.sub('', tail), WHITESPACE_PATTERN.sub('', head))
+    if fuzzy >= MERGE_FUZZY_MIN_OVERLAP:
+        # 把去掉空白后的重叠长度换算回 head 中的位置
+        remaining = fuzzy
+        for match in NON_WHITESPACE_PATTERN.finditer(head):
+            run_length = match.end() - match.start()
+            if remaining <= run_length:
+                cut = max(cut, match.start() + remaining)
+                break
+            remaining -= run_length
+    return cut
 
 def merge_ai_strings(first, second):
     """合并两个字符串，检查重叠部分"""
-    # 可能的最大重叠长度是A的长度和B的长度中较小的那个
-    max_overlap = min(len(first), len(second), 100)
-    
-    # 从最大可能重叠开始检查
-    for overlap in range(max_overlap, 0, -1):
-        # 检查A的末尾overlap个字符是否等于B的开头overlap个字符
-        if first[-overlap:] == second[:overlap]:
-            return first + second[overlap:]
-    
-    # 如果没有重叠，直接连接
-    return first + second
+    return first + second[overlap_cut(first, second):]
 
-import re
+# 判断分块是否包含有效HTML的标签
+VALID_CHUNK_TAGS = ["</style>", "</script>", "</div>", "</p>", "</section>", "</h1>", "</h2>", "<svg>", "<div>", "</svg>"]
+CODE_FENCE_START_PATTERN = re.compile(r'^```html\s*\n?')
 
-def chunk_clear(chunks):
-    """清理分块,由于AI的返回内容可能会有多余的空行和换行符，导致直接合并html会出问题"""
 
-    # Step 1: Remove chunks without valid HTML tags
-    cleaned_chunks = []
-    for i, chunk in enumerate(chunks):
-        if not any(tag in chunk.lower() for tag in ["</style>", "</script>", "</div>", "</p>", "</section>", "</h1>", "</h2>", "<svg>","<div>","</svg>"]):
-            logger.warning(f"第 {i + 1} 块因缺少有效HTML标签被移除")
-            continue
-        cleaned_chunks.append(chunk)
-
-    # Step 2: Fix specific cases in the cleaned chunks
-    if len(cleaned_chunks) > 0:
-        # Fix case: xxxxxxxxx\n\n<!DOCTYPE html>
-        cleaned_chunks[0] = cleaned_chunks[0][cleaned_chunks[0].find('<'):]
-        # Fix case: </html>\n\nxxxx这个HTML文件现在是完整的...您可以看效果
-        # 仅当存在</html>标签时才执行截取
-        if '</html>' in cleaned_chunks[-1]:
-            cleaned_chunks[-1] = cleaned_chunks[-1][:cleaned_chunks[-1].rfind('</html>') + len('</html>')]
-
-    # Step 3: Remove ```html\n from the beginning of each chunk
-    final_chunks = []
-    for chunk in cleaned_chunks:
-        # If chunk starts with ```html\n, remove it
-        cleaned_chunk = re.sub(r'^```html\s*\n?', '', chunk, count=1)
-        final_chunks.append(cleaned_chunk)
-
-    return final_chunks
+def has_valid_html_tag(chunk: str) -> bool:
+    """分块中是否包含有效的HTML标签"""
+    lowered = chunk.lower()
+    return any(tag in lowered for tag in VALID_CHUNK_TAGS)
 
-def combined_fix(combined_content):
-    """可显示性修复:修复合并后的HTML内容中的tailwindcss CDN链接"""
-    
-    # 如果内容中没有<html>标签，则添加head_html
-    head_html = '''<!DOCTYPE html>
+
+# 页面公共头部：合并结果缺少<html>时补充，也用作按章节生成时的页面外壳
+HEAD_HTML = '''<!DOCTYPE html>
 <html lang="zh-CN" class="dark">
 <head>
     <meta charset="UTF-8">
@@ -461,74 +1853,1898 @@ def combined_fix(combined_content):
         }
     </style>
 </head>'''
-    if "<html" not in combined_content:
-        combined_content = head_html + combined_content
 
-    
-    # 修复tailwindcss的css链接
-    combined_content = re.sub(
-        r'<link[^>]*href=["\'](.*tailwindcss.*\.css)["\'][^>]*>',
-        r'<link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">',
-        combined_content
-    )
-    
-    # 修复tailwindcss的js链接
-    combined_content = re.sub(
-        r'<script[^>]*src=["\'](.*tailwindcss.*\.js)["\'][^>]*>',
-        r'<script src="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/lib/index.min.js"></script>',
-        combined_content
+# 后处理框架：一次扫描文档中的标签、代码块标记，按顺序交给各个修复步骤处理
+# 注释整体跳过；script/style 连同内容作为一个标记，内部不再切分
+RAW_TEXT_TAGS = ("script", "style")
+
+def build_token_pattern(names: Optional[set], fences: bool = True) -> re.Pattern:
+    """只匹配修复步骤关注的标记，其余内容由正则整段跳过；names 为 None 时匹配所有标签
+
+    和原先的修复一样只识别小写标签名，忽略大小写会让扫描慢几倍
+    """
+    alternatives = [r'!--.*?-->']
+    if names is None or "!doctype" in names:
+        alternatives.append(r'!(?:DOCTYPE|doctype)[^>]*>')
+    if names is None:
+        alternatives.append(r'(/?)([a-zA-Z][a-zA-Z0-9:-]*)(?:\s[^>]*)?/?>')
+    else:
+        tag_names = sorted((names - {"!doctype", "```"}) | set(RAW_TEXT_TAGS))
+        alternatives.append(rf'(/?)({"|".join(tag_names)})(?=[\s/>])[^>]*>')
+    pattern = "<(?:" + "|".join(alternatives) + ")"
+    if fences and (names is None or "```" in names):
+        pattern += r'|```[\w-]*'
+    return re.compile(pattern, re.DOTALL)
+
+RAW_TEXT_END_PATTERNS = {
+    "script": re.compile(r'</script\s*>', re.IGNORECASE),
+    "style": re.compile(r'</style\s*>', re.IGNORECASE),
+}
+ATTRIBUTE_PATTERNS = {
+    name: re.compile(rf'\s{name}\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+    for name in ("href", "src", "class")
+}
+
+class PostToken:
+    """后处理扫描出的标记：标签（script/style 含内容）、doctype 或代码块标记"""
+    __slots__ = ("name", "closing", "text")
+
+    def __init__(self, name: str, closing: bool, text: str):
+        self.name = name
+        self.closing = closing
+        self.text = text
+
+    def attr(self, name: str) -> Optional[str]:
+        """读取开始标签的 href/src/class 属性"""
+        match = ATTRIBUTE_PATTERNS[name].search(self.text[:self.text.find('>') + 1])
+        if match is None:
+            return None
+        return next(value for value in match.groups() if value is not None)
+
+class PostStream:
+    """一次后处理的输出：修复步骤可以丢弃一段内容，或预留位置在扫描结束后填充"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.suppressed_until: Optional[str] = None
+        # 正在扫描的文本及当前标记在其中的位置，供修复步骤向前、向后查看
+        self.source = ""
+        self.start = 0
+        self.end = 0
+
+    def suppress_until(self, name: str):
+        """丢弃之后的内容，直到 name 元素的结束标签（含）"""
+        self.suppressed_until = name
+
+    def placeholder(self) -> int:
+        """预留一个输出位置，返回其下标"""
+        self.parts.append("")
+        return len(self.parts) - 1
+
+class FixPass:
+    """后处理修复步骤，每处理一个文档新建一个实例，可以在实例上保存状态。
+
+    tags 为关注的标记名（None 表示所有标签），fix 返回替换后的文本，返回 None 表示删除
+    """
+    name = "fix"
+    tags: Optional[set] = None
+
+    def begin(self, html: str):
+        """开始处理一个文档，重置状态"""
+
+    def prefix(self, html: str) -> str:
+        """需要补在文档开头的内容，会和文档一起被扫描"""
+        return ""
+
+    def fix(self, token: PostToken, stream: PostStream) -> Optional[str]:
+        return token.text
+
+    def finish(self, stream: PostStream):
+        """扫描结束后的收尾，如填充预留位置"""
+
+class HtmlPostProcessor:
+    """按顺序执行修复步骤，整个文档只扫描一次、只拼接一次，并统计每个步骤的耗时"""
+
+    def __init__(self, pass_types: List[type]):
+        self.pass_types = pass_types
+        names: Optional[set] = set()
+        for pass_type in pass_types:
+            if pass_type.tags is None:
+                names = None
+                break
+            names |= pass_type.tags
+        self.token_pattern = build_token_pattern(names)
+        # 大多数文档不含代码块标记，用不匹配 ``` 的模式扫描更快
+        self.fenceless_pattern = build_token_pattern(names, fences=False)
+        # 累计耗时（秒），tokenize 为扫描本身的耗时
+        self.timings: Dict[str, float] = {"tokenize": 0.0}
+        self.last_timings: Dict[str, float] = {}
+        for pass_type in pass_types:
+            self.timings[pass_type.name] = 0.0
+
+    def process(self, html: str) -> str:
+        started = time.perf_counter()
+        passes = [pass_type() for pass_type in self.pass_types]
+        timings = {fix_pass.name: 0.0 for fix_pass in passes}
+        for fix_pass in passes:
+            fix_pass.begin(html)
+        stream = PostStream()
+        prefix = "".join(fix_pass.prefix(html) for fix_pass in passes)
+        token_pattern = self.token_pattern if "```" in html else self.fenceless_pattern
+        for segment in (prefix, html):
+            if segment:
+                self._scan(segment, token_pattern, passes, stream, timings)
+        for fix_pass in passes:
+            pass_started = time.perf_counter()
+            fix_pass.finish(stream)
+            timings[fix_pass.name] += time.perf_counter() - pass_started
+        result = "".join(stream.parts)
+        timings["tokenize"] = time.perf_counter() - started - sum(timings.values())
+        self.last_timings = timings
+        for name, seconds in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+        logger.debug("后处理耗时: " + ", ".join(f"{name} {seconds * 1000:.2f}ms" for name, seconds in timings.items()))
+        return result
+
+    def _scan(self, segment: str, token_pattern: re.Pattern, passes: List[FixPass], stream: PostStream,
+              timings: Dict[str, float]):
+        parts = stream.parts
+        # 标记名 -> 关注它的修复步骤
+        dispatch: Dict[str, List[FixPass]] = {}
+        stream.source = segment
+        pos = 0
+        length = len(segment)
+        while pos < length:
+            match = token_pattern.search(segment, pos)
+            if match is None:
+                if stream.suppressed_until is None:
+                    parts.append(segment[pos:])
+                break
+            if stream.suppressed_until is None and match.start() > pos:
+                parts.append(segment[pos:match.start()])
+            end = match.end()
+            text = match.group(0)
+            if text.startswith("<!--"):
+                if stream.suppressed_until is None:
+                    parts.append(text)
+                pos = end
+                continue
+            if match.group(2):
+                name = match.group(2).lower()
+                closing = bool(match.group(1))
+                raw_end = RAW_TEXT_END_PATTERNS.get(name)
+                if raw_end is not None and not closing:
+                    close = raw_end.search(segment, end)
+                    end = close.end() if close else length
+                    text = segment[match.start():end]
+            else:
+                name = "!doctype" if text.startswith("<") else "```"
+                closing = False
+            pos = end
+
+            if stream.suppressed_until is not None:
+                if closing and name == stream.suppressed_until:
+                    stream.suppressed_until = None
+                continue
+
+            handlers = dispatch.get(name)
+            if handlers is None:
+                handlers = dispatch[name] = [
+                    fix_pass for fix_pass in passes if fix_pass.tags is None or name in fix_pass.tags
+                ]
+            output: Optional[str] = text
+            if not handlers:
+                parts.append(output)
+                continue
+            token = PostToken(name, closing, text)
+            stream.start, stream.end = match.start(), end
+            for fix_pass in handlers:
+                pass_started = time.perf_counter()
+                output = fix_pass.fix(token, stream)
+                timings[fix_pass.name] += time.perf_counter() - pass_started
+                if output is None or stream.suppressed_until is not None:
+                    break
+                token.text = output
+            if output is not None and stream.suppressed_until is None:
+                parts.append(output)
+
+class DocumentShellPass(FixPass):
+    """缺少<html>时补充公共头部"""
+    name = "document_shell"
+    tags = set()
+
+    def prefix(self, html: str) -> str:
+        return HEAD_HTML if "<html" not in html else ""
+
+TAILWIND_CSS_LINK = '<link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">'
+TAILWIND_JS_SCRIPT = '<script src="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/lib/index.min.js"></script>'
+
+class TailwindCdnPass(FixPass):
+    """修复tailwindcss的css/js链接：统一为可用的 2.2.19 版本"""
+    name = "tailwind_cdn"
+    tags = {"link", "script"}
+
+    def fix(self, token: PostToken, stream: PostStream) -> Optional[str]:
+        if token.closing:
+            return token.text
+        url = token.attr("href" if token.name == "link" else "src")
+        if not url or "tailwindcss" not in url:
+            return token.text
+        if token.name == "link" and url.endswith(".css"):
+            return TAILWIND_CSS_LINK
+        if token.name == "script" and url.endswith(".js"):
+            return TAILWIND_JS_SCRIPT
+        return token.text
+
+TRAILING_WHITESPACE_PATTERN = re.compile(r'\s*\Z')
+
+class StrayFencePass(FixPass):
+    """删除混入HTML中的 markdown 代码块标记（```html、```）：只处理行首或文档末尾的标记，正文中提到的和 pre/code 内的保留"""
+    name = "stray_fence"
+    tags = {"```", "pre", "code"}
+
+    def begin(self, html: str):
+        self.code_depth = 0
+
+    def fix(self, token: PostToken, stream: PostStream) -> Optional[str]:
+        if token.name != "```":
+            self.code_depth = max(self.code_depth + (-1 if token.closing else 1), 0)
+            return token.text
+        if self.code_depth:
+            return token.text
+        line_start = stream.source.rfind("\n", 0, stream.start) + 1
+        at_line_start = not stream.source[line_start:stream.start].strip(" \t")
+        at_end = TRAILING_WHITESPACE_PATTERN.match(stream.source, stream.end) is not None
+        return None if at_line_start or at_end else token.text
+
+HEAD_END_PATTERN = re.compile(r'</head\s*>')
+BODY_START_PATTERN = re.compile(r'<body[\s/>]')
+
+class DuplicateHeadPass(FixPass):
+    """续写时AI可能重新输出页面开头，删除重复的 doctype、<html>、<head>...</head> 和 <body>"""
+    name = "duplicate_head"
+    tags = {"!doctype", "html", "head", "body"}
+
+    def begin(self, html: str):
+        self.seen = set()
+
+    def fix(self, token: PostToken, stream: PostStream) -> Optional[str]:
+        if token.closing:
+            return token.text
+        # 已经出现过 <html> 之后再出现的 doctype 也是重复的
+        key = "html" if token.name == "!doctype" else token.name
+        if token.name == "!doctype" and "!doctype" not in self.seen and "html" not in self.seen:
+            self.seen.add("!doctype")
+            return token.text
+        if key not in self.seen:
+            self.seen.add(key)
+            return token.text
+        if token.name == "head":
+            # 只有在下一个 <body> 之前能找到 </head> 时才丢弃整个重复的头部，否则只删除这个标签，避免吞掉后面的正文
+            head_end = HEAD_END_PATTERN.search(stream.source, stream.end)
+            body_start = BODY_START_PATTERN.search(stream.source, stream.end)
+            if head_end and (body_start is None or head_end.start() < body_start.start()):
+                stream.suppress_until("head")
+        return None
+
+def combined_fix(combined_content):
+    """可显示性修复：补充页面头部、修复CDN链接、删除多余的代码块标记和重复的页面开头，并替换为本地资源"""
+    return page_post_processor.process(combined_content)
+
+# 续写提示中引用的截断处末尾内容长度
+RESUME_HINT_TAIL_CHARS = 120
+
+
+class TagBalanceTracker:
+    """增量扫描HTML标签，维护未闭合元素栈，用于判断文档是否已经完整
+
+    只用正则查找标签，不逐字符解析；每轮只扫描新追加的内容，截断在标签内部时保留末尾待下一轮拼接。
+    """
+
+    # 无需闭合的空元素
+    VOID_ELEMENTS = {
+        "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+        "meta", "param", "source", "track", "wbr",
+    }
+    # 内容按原文处理的元素，其中的 < 不是标签
+    RAW_TEXT_ELEMENTS = ("script", "style")
+    # 开始/结束标签、注释、声明、处理指令；都不匹配的标签开头说明截断在标签或注释内部
+    TOKEN_PATTERN = re.compile(
+        r'<(/?)([a-zA-Z][^\s/>]*)([^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*)>'
+        r'|<!--.*?-->|<!(?!--)[^>]*>|<\?[^>]*>|(<[a-zA-Z/!?])',
+        re.DOTALL
     )
-    
-    return combined_content
+    RAW_TEXT_END_PATTERNS = {tag: re.compile(rf'</{tag}\s*>', re.IGNORECASE) for tag in RAW_TEXT_ELEMENTS}
+    LABEL_ATTR_PATTERN = re.compile(r'(?:^|\s)(id|class)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+    def __init__(self):
+        self.stack: List[str] = []
+        # 与 stack 对应的原始属性文本，生成续写提示时才解析
+        self.stack_attrs: List[str] = []
+        self.root_opened = False
+        self.root_closed = False
+        # 截断在标签、注释内部时尚未扫描的末尾内容；在 script/style 中时为可能被截断的结束标签
+        self.rawdata = ""
+        self.cdata_elem: Optional[str] = None
+
+    def feed(self, data: str):
+        buf = self.rawdata + data
+        self.rawdata = ""
+        pos = 0
+        stack, stack_attrs = self.stack, self.stack_attrs
+        void_elements, raw_text_elements = self.VOID_ELEMENTS, self.RAW_TEXT_ELEMENTS
+        while True:
+            if self.cdata_elem:
+                end = self.RAW_TEXT_END_PATTERNS[self.cdata_elem].search(buf, pos)
+                if end is None:
+                    # 结束标签可能被截断在末尾，保留末尾几个字符与下一轮拼接后再查找
+                    self.rawdata = buf[max(pos, len(buf) - len(self.cdata_elem) - 3):]
+                    return
+                self.handle_endtag(self.cdata_elem)
+                self.cdata_elem = None
+                pos = end.end()
+            for match in self.TOKEN_PATTERN.finditer(buf, pos):
+                closing, name, attrs, partial = match.groups()
+                if name is None:
+                    if partial:
+                        self.rawdata = buf[match.start():]
+                        return
+                    continue
+                tag = name.lower()
+                if closing:
+                    if stack and stack[-1] == tag and tag != "html":
+                        stack.pop()
+                        stack_attrs.pop()
+                    else:
+                        self.handle_endtag(tag)
+                    continue
+                if tag in void_elements:
+                    continue
+                if tag == "html":
+                    self.root_opened = True
+                # <br/> 这类自闭合写法不入栈
+                if attrs and attrs.rstrip().endswith("/"):
+                    continue
+                stack.append(tag)
+                stack_attrs.append(attrs)
+                if tag in raw_text_elements:
+                    # script/style 的内容是代码，直接查找对应的结束标签
+                    self.cdata_elem = tag
+                    pos = match.end()
+                    break
+            else:
+                return
+
+    def handle_endtag(self, tag: str):
+        if tag == "html":
+            self.root_closed = True
+        # 容忍AI输出中漏写的闭合标签：弹出到最近的同名元素为止，找不到则忽略
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index] == tag:
+                del self.stack[index:]
+                del self.stack_attrs[index:]
+                break
+
+    @classmethod
+    def describe_element(cls, tag: str, attrs: str) -> str:
+        found = {}
+        for match in cls.LABEL_ATTR_PATTERN.finditer(attrs):
+            value = next(group for group in match.group(2, 3, 4) if group is not None)
+            found.setdefault(match.group(1).lower(), html_unescape(value))
+        label = tag
+        for name in ("id", "class"):
+            if found.get(name):
+                label += f' {name}="{found[name][:60]}"'
+        return label
+
+    @property
+    def labels(self) -> List[str]:
+        """与 stack 对应的元素描述（带 id/class），用于生成续写提示"""
+        return [self.describe_element(tag, attrs) for tag, attrs in zip(self.stack, self.stack_attrs)]
+
+    @property
+    def pending_markup(self) -> str:
+        """尚未解析的末尾内容，非空说明截断在标签、注释或属性内部"""
+        return "" if self.cdata_elem else self.rawdata
+
+    @property
+    def raw_text_element(self) -> Optional[str]:
+        """截断位置所在的 script/style 元素"""
+        return self.cdata_elem
+
+
+class IncrementalHtmlAssembler:
+    """增量合并器：每轮AI回复到达时立即清理、去重叠并拼接，同时维护标签平衡状态
+
+    清理规则：丢弃不含有效标签的分块，首个分块去掉 '<' 之前的说明文字，
+    去掉开头的 ```html，截断 </html> 之后的内容。
+    """
+
+    def __init__(self, overlap_window: Optional[int] = None):
+        self.overlap_window = overlap_window or MERGE_OVERLAP_WINDOW
+        self.parts: List[str] = []
+        self.tail = ""
+        self.rounds = 0
+        self.tracker = TagBalanceTracker()
+        # 最近一轮是否被丢弃（不含任何HTML），以及是否以闭合的代码块结束
+        self.last_round_dropped = False
+        self.last_round_fenced = False
+
+    def feed(self, raw_chunk: str) -> str:
+        """加入一轮AI回复，返回实际追加到文档中的片段"""
+        self.rounds += 1
+        self.last_round_dropped = not has_valid_html_tag(raw_chunk)
+        self.last_round_fenced = False
+        if self.last_round_dropped:
+            logger.warning(f"第 {self.rounds} 块因缺少有效HTML标签被移除")
+            return ""
+
+        chunk = raw_chunk
+        if not self.parts:
+            # Fix case: xxxxxxxxx\n\n<!DOCTYPE html>
+            chunk = chunk[chunk.find('<'):]
+        if '</html>' in chunk:
+            # Fix case: </html>\n\nxxxx这个HTML文件现在是完整的...您可以看效果
+            chunk = chunk[:chunk.rfind('</html>') + len('</html>')]
+        chunk = CODE_FENCE_START_PATTERN.sub('', chunk, count=1)
+        # Fix case: ...</div>\n```\n\n通过这个设计精美的网页，我们......
+        fence = chunk.rfind('```')
+        if fence > chunk.find('<') >= 0 and '<' not in chunk[fence:]:
+            chunk = chunk[:fence].rstrip()
+            self.last_round_fenced = True
+
+        piece = chunk[overlap_cut(self.tail, chunk):]
+        self.parts.append(piece)
+        self.tail = (self.tail + piece)[-self.overlap_window:]
+        self.tracker.feed(piece)
+        return piece
+
+    @property
+    def content(self) -> str:
+        """当前已合并的文档（未经过 combined_fix）"""
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+    def is_complete(self) -> bool:
+        """根据解析状态判断文档是否完整，无需再续写"""
+        tracker = self.tracker
+        # 本轮没有任何html代码,必须结束,防止无限循环
+        if self.last_round_dropped or tracker.root_closed:
+            return True
+        # 截断在标签、注释或脚本内部
+        if tracker.pending_markup or tracker.raw_text_element:
+            return False
+        if not tracker.stack:
+            return tracker.root_opened or self.last_round_fenced
+        # AI 已结束代码块，只漏写了 </body></html>
+        return self.last_round_fenced and set(tracker.stack) <= {"html", "body"}
+
+    def open_elements(self) -> List[str]:
+        """尚未闭合的元素，从外到内"""
+        return list(self.tracker.stack)
+
+    def truncation(self) -> Dict[str, Any]:
+        """截断位置的结构信息"""
+        tracker = self.tracker
+        return {
+            "open_elements": list(tracker.labels),
+            "pending_markup": tracker.pending_markup,
+            "raw_text_element": tracker.raw_text_element,
+        }
+
+    def resume_hint(self) -> str:
+        """生成续写提示：说明截断发生在哪个元素内部，以及需要依次闭合的标签"""
+        tracker = self.tracker
+        if not tracker.stack and not tracker.pending_markup:
+            return ""
+        lines = []
+        if tracker.labels:
+            lines.append(f"上次输出在 <{tracker.labels[-1]}> 内部被截断，"
+                         f"当前未闭合的元素（从外到内）：{' > '.join(tracker.stack)}。")
+        if tracker.raw_text_element:
+            lines.append(f"截断位置在 <{tracker.raw_text_element}> 的代码中，请先补全该段代码。")
+        if tracker.pending_markup:
+            lines.append(f"最后一个标签不完整：{tracker.pending_markup[:RESUME_HINT_TAIL_CHARS]}，请从这个标签继续写完。")
+        else:
+            tail = self.content[-RESUME_HINT_TAIL_CHARS:]
+            lines.append(f"已输出内容的末尾是：{tail}")
+        closing = "".join(f"</{tag}>" for tag in reversed(tracker.stack))
+        lines.append(f"请紧接末尾续写，不要重复已输出的内容，全部内容完成后依次闭合 {closing}。")
+        return "\n".join(lines)
+
+    def preview(self) -> str:
+        """部分文档的预览：补齐未闭合的元素，便于浏览器渲染"""
+        closing = "".join(f"</{tag}>" for tag in reversed(self.tracker.stack))
+        return combined_fix(self.content + closing)
+
+    def result(self) -> str:
+        """最终结果：合并已在每轮完成，这里只做链接修正"""
+        return combined_fix(self.content)
+
 
 def merge_ai_responses(raw_chunks):
     """合并AI的回复内容"""
-    combined_content = ""
-    # Step1:清理每个分块及检查是否完成
-    chunks = chunk_clear(raw_chunks)
-    # Step2:重叠合并算法
-    for chunk in chunks:
-        combined_content = merge_ai_strings(combined_content, chunk)
+    assembler = IncrementalHtmlAssembler()
+    for chunk in raw_chunks:
+        assembler.feed(chunk)
     # 纠正CDN链接等
-    combined_content = combined_fix(combined_content)
-    return combined_content
+    return assembler.result()
 
 
 def is_complete_html(content: str) -> bool:
-    """检查AI回复内容是否已经完成了HTML输出"""
+    """检查AI回复内容是否已经完成了HTML输出
+
+    按标签栈判断而不是匹配关键字：根元素已闭合、所有元素都已闭合，
+    或代码块已结束且只缺 </body></html> 时视为完成；本段没有任何HTML代码时也结束，防止无限循环。
+    """
+    assembler = IncrementalHtmlAssembler()
+    assembler.feed(content)
+    return assembler.is_complete()
+
+
+
+# 续写上下文策略：bounded 只发送原文、已输出内容的结构摘要和末尾片段；full 发送完整对话历史
+CONTEXT_STRATEGY = os.getenv("CONTEXT_STRATEGY", "bounded").lower()
+# 续写时附带的已输出内容末尾字符数，以及摘要和末尾片段的 token 预算
+CONTEXT_TAIL_CHARS = int(os.getenv("CONTEXT_TAIL_CHARS", "4000"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+HEADING_PATTERN = re.compile(r'<h([1-3])[^>]*>(.*?)</h\1>', re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 字 1 token，其他字符约 4 字符 1 token"""
+    non_cjk = len(CJK_PATTERN.sub('', text))
+    return (len(text) - non_cjk) + math.ceil(non_cjk / 4)
+
+def summarize_emitted_html(html: str) -> List[str]:
+    """提取已输出内容中的章节标题，作为续写时的结构摘要"""
+    headings = []
+    for match in HEADING_PATTERN.finditer(html):
+        title = " ".join(TAG_PATTERN.sub('', match.group(2)).split())
+        if title:
+            headings.append(f"{'  ' * (int(match.group(1)) - 1)}- {title}")
+    return headings
+
+def build_continuation_messages(system_prompt: str, content: str, outputs: List[str],
+                                continue_prompt: str) -> list:
+    """构造续写轮次的消息列表"""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content}
+    ]
+    if CONTEXT_STRATEGY == "full":
+        # 完整历史：每一轮的回复及续写指令
+        for output in outputs:
+            messages.extend([
+                {"role": "assistant", "content": output},
+                {"role": "user", "content": continue_prompt}
+            ])
+        return messages
+
+    emitted = "".join(outputs)
+    headings = summarize_emitted_html(emitted)
+    tail = emitted[-CONTEXT_TAIL_CHARS:]
+    # 末尾片段尽量从标签边界开始
+    first_tag = tail.find('<', 0, 200)
+    if len(tail) < len(emitted) and first_tag > 0:
+        tail = tail[first_tag:]
+
+    def render_summary(items: List[str]) -> str:
+        if not items:
+            return ""
+        return "\n\n已输出的章节结构如下，请勿重复：\n" + "\n".join(items)
+
+    # 超出预算时先缩短末尾片段，再只保留最近的章节标题
+    while estimate_tokens(tail + render_summary(headings)) > CONTEXT_TOKEN_BUDGET:
+        if len(tail) > 500:
+            tail = tail[len(tail) // 4:]
+        elif headings:
+            headings = headings[len(headings) // 2 + 1:] if len(headings) > 1 else []
+        else:
+            break
+
+    messages.extend([
+        {"role": "assistant", "content": tail},
+        {"role": "user", "content": continue_prompt + render_summary(headings)}
+    ])
+    return messages
+
+# 是否以流式方式获取AI输出并实时推送给前端预览
+AI_STREAM_OUTPUT = os.getenv("AI_STREAM_OUTPUT", "true").lower() == "true"
+# 流式增量推送的最小间隔（秒）
+AI_STREAM_FLUSH_INTERVAL = float(os.getenv("AI_STREAM_FLUSH_INTERVAL", "0.5"))
+
+# 提示词缓存：off 不处理；auto 依赖服务端自动前缀缓存（OpenAI、DeepSeek 等），只统计命中情况；
+# cache_control 为系统提示词和原文消息加上 cache_control 断点（Anthropic 兼容的接口，如 OpenRouter、LiteLLM）
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "auto").lower()
+# 流式请求时要求服务端在最后返回 token 用量（stream_options.include_usage），用于用量统计和缓存命中统计；
+# 部分兼容接口不支持该字段，以 400 拒绝时自动去掉后重试
+AI_STREAM_USAGE = os.getenv("AI_STREAM_USAGE", "true").lower() == "true"
+# 接口以 400 拒绝 stream_options 后置为 False，之后的请求不再发送
+stream_usage_supported = True
+
+def apply_prompt_cache(messages: list, cached_prefix: int = 2) -> list:
+    """为稳定的前缀标记缓存断点，返回新的消息列表
+
+    cached_prefix 为各次请求共享的前几条消息：逐轮续写时是系统提示词和原文；
+    章节生成、摘要的用户消息每次都不同，只标记系统提示词，避免为不会复用的内容支付缓存写入费用
+    """
+    if PROMPT_CACHE != "cache_control":
+        return messages
+    marked = []
+    for index, message in enumerate(messages):
+        if index < cached_prefix and isinstance(message.get("content"), str):
+            message = {
+                **message,
+                "content": [{
+                    "type": "text",
+                    "text": message["content"],
+                    "cache_control": {"type": "ephemeral"}
+                }]
+            }
+        marked.append(message)
+    return marked
+
+def parse_usage(usage: Any) -> Optional[dict]:
+    """解析一次请求的 token 用量，区分缓存命中与未命中的输入 token"""
+    if usage is None:
+        return None
+
+    def field(source: Any, name: str) -> int:
+        if source is None:
+            return 0
+        value = source.get(name) if isinstance(source, dict) else getattr(source, name, None)
+        return value if isinstance(value, int) else 0
+
+    input_tokens = field(usage, "prompt_tokens")
+    # OpenAI: prompt_tokens_details.cached_tokens；DeepSeek: prompt_cache_hit_tokens；
+    # Anthropic 兼容接口: cache_read_input_tokens / cache_creation_input_tokens
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (field(details, "cached_tokens") or field(usage, "prompt_cache_hit_tokens")
+                     or field(usage, "cache_read_input_tokens"))
+    return {
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "uncached_tokens": max(input_tokens - cached_tokens, 0),
+        "cache_write_tokens": field(usage, "cache_creation_input_tokens"),
+        "output_tokens": field(usage, "completion_tokens")
+    }
+
+def record_usage(round_no: int, usage: Optional[dict]):
+    """累计 token 用量并记录日志"""
+    if not usage:
+        return
+    ai_pool_stats["input_tokens_total"] += usage["input_tokens"]
+    ai_pool_stats["cached_tokens_total"] += usage["cached_tokens"]
+    ai_pool_stats["output_tokens_total"] += usage["output_tokens"]
+    AI_TOKENS.inc(usage["input_tokens"], type="input")
+    AI_TOKENS.inc(usage["cached_tokens"], type="cached")
+    AI_TOKENS.inc(usage["output_tokens"], type="output")
+    logger.info(
+        f"第 {round_no} 轮 token 用量: 输入 {usage['input_tokens']}"
+        f"（缓存命中 {usage['cached_tokens']}，未命中 {usage['uncached_tokens']}），输出 {usage['output_tokens']}"
+    )
 
-    ''''
-    AI的回复可能存在随机性,最终结果可能并不存在</html>'
-    1. 检查是否包含</html>标签
-    2. ```html开头 找到最后一个```,如果后面还有内容能匹配 "精美"
-    eg: ```\n\n通过这个设计精美的网页，我们......
-    '''
+# 共享的 OpenAI 客户端配置：连接池上限、保活连接数、保活时长及全局并发上限
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", str(OPENAI_MAX_CONNECTIONS)))
+# 单次请求超时（秒）及 SDK 内置的重试次数
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "400"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+
+ai_http_client: Optional[httpx.AsyncClient] = None
+ai_client: Optional[openai.AsyncClient] = None
+ai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+ai_pool_stats = {
+    "in_flight": 0,
+    "waiting": 0,
+    "requests_total": 0,
+    "input_tokens_total": 0,
+    "cached_tokens_total": 0,
+    "output_tokens_total": 0
+}
+
+def get_ai_client() -> openai.AsyncClient:
+    """获取应用级共享的 OpenAI 客户端，所有任务复用同一连接池"""
+    global ai_http_client, ai_client
+    if ai_client is None or ai_http_client.is_closed:
+        # 所有请求都发往 OPENAI_BASE_URL 这一个主机，max_connections 即单主机连接上限
+        ai_http_client = httpx.AsyncClient(
+            verify=False,
+            timeout=httpx.Timeout(
+                connect=120.0,
+                read=240.0,
+                write=240.0,
+                pool=240.0
+            ),
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+            )
+        )
+        ai_client = openai.AsyncClient(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            http_client=ai_http_client,
+            timeout=OPENAI_TIMEOUT,
+            # 重试由 request_ai_round_with_retry 统一处理，避免两层重试叠加
+            max_retries=OPENAI_MAX_RETRIES
+        )
+    return ai_client
+
+async def close_ai_client():
+    """关闭共享的 OpenAI 客户端"""
+    global ai_http_client, ai_client
+    if ai_client is not None:
+        await ai_client.close()
+        ai_client = None
+        ai_http_client = None
+
+@asynccontextmanager
+async def ai_request_slot():
+    """占用一个上游并发名额，限制同时进行的AI请求总数"""
+    ai_pool_stats["waiting"] += 1
+    try:
+        await ai_semaphore.acquire()
+    finally:
+        ai_pool_stats["waiting"] -= 1
+    ai_pool_stats["in_flight"] += 1
+    ai_pool_stats["requests_total"] += 1
+    try:
+        yield
+    finally:
+        ai_pool_stats["in_flight"] -= 1
+        ai_semaphore.release()
+
+def describe_connection_pool(client: Optional[httpx.AsyncClient]) -> dict:
+    """统计 httpx 连接池中的连接情况"""
+    if client is None or client.is_closed:
+        return {"connections": 0, "idle": 0, "active": 0}
+    try:
+        connections = client._transport._pool.connections
+    except AttributeError:
+        return {}
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle
+    }
+
+@app.get("/pool-stats")
+async def pool_stats():
+    """查看上游连接池及并发使用情况"""
+    return {
+        "ai": {
+            **ai_pool_stats,
+            "max_concurrency": OPENAI_MAX_CONCURRENCY,
+            "max_connections": OPENAI_MAX_CONNECTIONS,
+            "prompt_cache": PROMPT_CACHE,
+            "pool": describe_connection_pool(ai_http_client)
+        },
+        "fetch": {
+            "max_connections": FETCH_MAX_CONNECTIONS,
+            "pool": describe_connection_pool(fetch_client)
+        },
+        "jobs": job_scheduler.stats(),
+        "circuit_breaker": ai_circuit_breaker.stats(),
+        "storage": artifact_store.stats(),
+        # 页面后处理各步骤的累计耗时
+        "post_processing_ms": {
+            name: round(seconds * 1000, 2) for name, seconds in page_post_processor.timings.items()
+        }
+    }
 
-    # 1. 检查是否包含</html>标签
-    if "</html>" in content.lower():
+async def request_ai_round(messages: list, round_no: int, result: dict, cached_prefix: int = 2):
+    """请求一轮AI生成，流式模式下产出增量状态事件，完整内容写入 result["content"]，token 用量写入 result["usage"]"""
+    global stream_usage_supported
+    async_client = get_ai_client()
+    messages = apply_prompt_cache(messages, cached_prefix)
+    async with ai_request_slot():
+        if AI_STREAM_OUTPUT:
+            # 流式模式：边生成边把增量内容推送给前端预览
+            stream_options = {"include_usage": True} if AI_STREAM_USAGE and stream_usage_supported else None
+            try:
+                stream = await async_client.chat.completions.create(
+                    model=config_registry.get_str("OPENAI_MODEL", "claude 3.7"),#至少是 claude 3.7级别
+                    messages=messages,
+                    stream=True,
+                    **({"stream_options": stream_options} if stream_options else {})
+                )
+            except openai.BadRequestError as e:
+                if not stream_options or "stream_options" not in str(e):
+                    raise
+                # 接口不支持 stream_options：去掉该字段重试一次，之后不再发送
+                logger.warning(f"AI 接口不支持 stream_options，流式请求不再获取 token 用量: {str(e)}")
+                stream_usage_supported = False
+                stream = await async_client.chat.completions.create(
+                    model=config_registry.get_str("OPENAI_MODEL", "claude 3.7"),
+                    messages=messages,
+                    stream=True
+                )
+            round_parts = []
+            pending_parts = []
+            round_length = 0
+            pending_offset = 0
+            last_flush = time.monotonic()
+            usage = None
+            async for chunk in stream:
+                # 用量在最后一个（choices 为空的）分块中返回
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                round_parts.append(delta)
+                pending_parts.append(delta)
+                round_length += len(delta)
+                # 按时间间隔合并增量，避免事件过多
+                if time.monotonic() - last_flush >= AI_STREAM_FLUSH_INTERVAL:
+                    yield json.dumps({
+                        "status": "ai_streaming",
+                        "round": round_no,
+                        "offset": pending_offset,
+                        "delta": "".join(pending_parts)
+                    })
+                    pending_parts = []
+                    pending_offset = round_length
+                    last_flush = time.monotonic()
+            if pending_parts:
+                yield json.dumps({
+                    "status": "ai_streaming",
+                    "round": round_no,
+                    "offset": pending_offset,
+                    "delta": "".join(pending_parts)
+                })
+            result["content"] = "".join(round_parts)
+        else:
+            response = await async_client.chat.completions.create(
+                model=config_registry.get_str("OPENAI_MODEL", "claude 3.7"),#至少是 claude 3.7级别
+                messages=messages
+            )
+            result["content"] = response.choices[0].message.content
+            usage = getattr(response, "usage", None)
+    result["usage"] = parse_usage(usage)
+    record_usage(round_no, result["usage"])
+
+# 每轮AI请求的最大尝试次数，以及指数退避的基础间隔和上限（秒）
+AI_ROUND_MAX_ATTEMPTS = int(os.getenv("AI_ROUND_MAX_ATTEMPTS", "3"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "2"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "60"))
+# 熔断：连续失败多少次后打开，打开后多少秒允许一次试探请求
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "60"))
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+class CircuitOpenError(Exception):
+    """熔断器打开时拒绝请求"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"AI 服务暂时不可用，{math.ceil(retry_after)} 秒后重试")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """所有任务共享的熔断器：上游持续失败时快速失败，冷却后放行一次试探请求"""
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        """距离允许试探请求的秒数"""
+        if self.opened_at is None:
+            return 0
+        return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0)
+
+    def before_call(self) -> bool:
+        """请求前检查，熔断打开时抛出 CircuitOpenError；返回本次请求是否为半开状态下的试探请求"""
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            logger.info("熔断器半开，放行一次试探请求")
+            return True
+        raise CircuitOpenError(self.retry_after() or self.reset_seconds)
+
+    def release_probe(self):
+        """试探请求没有结论就结束（被取消或非上游故障），允许下一次请求重新试探"""
+        self.probing = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("AI 服务已恢复，熔断器关闭")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            if self.opened_at is None or self.probing:
+                logger.warning(f"AI 请求连续失败 {self.failures} 次，熔断 {self.reset_seconds:.0f} 秒")
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1)
+        }
+
+ai_circuit_breaker = CircuitBreaker(CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS)
+
+def is_retryable_error(error: Exception) -> bool:
+    """连接错误、超时、限流和5xx可以重试，请求参数或鉴权错误不重试"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, httpx.TransportError)):
         return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """读取 429/503 响应中的 Retry-After（秒数或HTTP日期）"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """计算第 attempt 次失败后的等待时间：优先使用 Retry-After，否则指数退避加全抖动"""
+    retry_after = parse_retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, AI_RETRY_MAX_DELAY)
+    return random.uniform(0, min(AI_RETRY_BASE_DELAY * 2 ** (attempt - 1), AI_RETRY_MAX_DELAY))
+
+async def request_ai_round_with_retry(messages: list, round_no: int, result: dict, cached_prefix: int = 2):
+    """带重试和熔断的AI请求：每轮最多尝试 AI_ROUND_MAX_ATTEMPTS 次，重试前产出 ai_retrying 状态"""
+    for attempt in range(1, AI_ROUND_MAX_ATTEMPTS + 1):
+        probe = ai_circuit_breaker.before_call()
+        settled = False
+        started = time.perf_counter()
+        try:
+            async for event in request_ai_round(messages, round_no, result, cached_prefix):
+                yield event
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="ai_round")
+            retryable = is_retryable_error(e)
+            AI_ROUND_ERRORS.inc(retryable=str(retryable).lower())
+            # 非上游故障（如参数错误）不影响熔断状态
+            if retryable:
+                ai_circuit_breaker.record_failure()
+                settled = True
+            if not retryable or attempt >= AI_ROUND_MAX_ATTEMPTS:
+                raise
+            delay = retry_delay(attempt, e)
+            logger.warning(f"第 {round_no} 轮AI请求失败（第 {attempt} 次）: {str(e)}，{delay:.1f} 秒后重试")
+            yield json.dumps({
+                "status": "ai_retrying",
+                "round": round_no,
+                "attempt": attempt + 1,
+                "delay": round(delay, 1),
+                "message": f"AI 请求失败，{math.ceil(delay)} 秒后进行第 {attempt + 1} 次尝试"
+            })
+            await asyncio.sleep(delay)
+        else:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="ai_round")
+            ai_circuit_breaker.record_success()
+            settled = True
+            return
+        finally:
+            # 试探请求被取消、生成器被关闭或遇到非上游故障时，释放试探名额，避免熔断器一直停在半开状态
+            if probe and not settled:
+                ai_circuit_breaker.release_probe()
+
+async def generate_sequentially(content: str, tmp_task_dir: Path, result: dict):
+    """逐轮请求AI生成完整页面，未完成时续写，最终合并结果写入 result["html"]"""
+    # 从文件加载系统提示词
+    system_prompt = load_prompt("format_prompt.txt")
+    logger.info("已加载系统提示词")
     
-    # 2. 检查不存在</html>标签的情况
-    if content.startswith("```html"):
-        # 找到最后一个```
-        last_code_block = content.rsplit("```", 1)[-1]
-        # 检查是否包含"精美"
-        if "精美" in last_code_block:
-            return True
+    # 初始化消息列表
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": content
+        }
+    ]
     
-    # 3. 检查特殊情况,本次没有任何html代码,必须结束,防止无限循环
-    if not any(tag in content.lower() for tag in ["</style>", "</script>", "</div>", "</p>", "</section>", "</h1>", "</h2>"]):
-        return True
+    full_content = []
+    assembler = IncrementalHtmlAssembler()
+    # 记录初始最大段数设置
+    max_ai_segments = config_registry.get_int("MAX_AI_SEGMENTS", 20)
+    logger.info(f"AI生成内容最大段数设置为: {max_ai_segments}")
+    attempt = 0
+    
+    while attempt < max_ai_segments:
+        # 每轮读取最新配置（注册表按修改时间重新加载 .env，不会每轮读取文件）
+        current_max_segments = config_registry.get_int("MAX_AI_SEGMENTS", 20)
+        
+        # 如果最大段数设置发生变化，记录日志
+        if current_max_segments != max_ai_segments:
+            logger.info(f"AI生成内容最大段数已更新: {max_ai_segments} -> {current_max_segments}")
+            max_ai_segments = current_max_segments
+        
+        try:
+            round_result = {}
+            async for event in request_ai_round_with_retry(messages, attempt + 1, round_result):
+                yield event
+            current_content = round_result["content"]
+
+            full_content.append(current_content)
+            result["rounds"] = len(full_content)
+            # 到达即合并，最终无需再整体合并一次
+            with STAGE_SECONDS.time(stage="merge"):
+                await asyncio.to_thread(assembler.feed, current_content)
+            
+            # 保存当前轮次的返回数据
+            tmp_file = tmp_task_dir / f"round_{attempt + 1}.html"
+            async with aiofiles.open(tmp_file, 'w', encoding='utf-8') as f:
+                await f.write(current_content)
+            logger.info(f"保存第 {attempt + 1}/{max_ai_segments} 段AI返回数据: {tmp_file}")
+            
+            if assembler.is_complete():
+                break
 
-    return False
+            # 保存部分文档供预览
+            preview = await asyncio.to_thread(assembler.preview)
+            await asyncio.to_thread(atomic_write_bytes, tmp_task_dir / PREVIEW_FILENAME, preview.encode("utf-8"))
+                
+            # 从文件加载续写提示词（如果有）
+            continue_prompt = load_prompt("continue_prompt.txt")
+            # 根据标签栈给出精确的续写位置
+            resume_hint = assembler.resume_hint()
+            if resume_hint:
+                logger.info(f"第 {attempt + 1} 段在 {' > '.join(assembler.open_elements())} 处截断")
+                continue_prompt = f"{continue_prompt}\n\n{resume_hint}"
+            
+            # 构造下一轮的消息：原文 + 已输出内容（按上下文策略裁剪）+ 续写指令
+            messages = build_continuation_messages(system_prompt, content, full_content, continue_prompt)
+            
+            attempt += 1
+            
+            yield json.dumps({
+                "status": "ai_processing",
+                "round": attempt,
+                "usage": round_result.get("usage"),
+                "preview_url": f"/preview/{tmp_task_dir.name}",
+                "message": f"AI优化处理第 {attempt} 轮..."
+            })
+            await asyncio.sleep(0.1) #添加小延迟，确保状态被前端接收
+            
+        except Exception as e:
+            logger.error(f"AI 请求失败: {str(e)}", exc_info=True)
+            # 保存错误信息
+            error_file = tmp_task_dir / f"error_round_{attempt + 1}.txt"
+            async with aiofiles.open(error_file, 'w', encoding='utf-8') as f:
+                await f.write(f"Error: {str(e)}")
+            # 重试已在 request_ai_round_with_retry 中完成，此处直接结束任务，不再占用 worker
+            raise
+    
+    # 达到最大段数仍未写完的页面不完整
+    result["complete"] = assembler.is_complete()
+    # 各轮已在到达时合并，这里只修正链接
+    with STAGE_SECONDS.time(stage="post_process"):
+        result["html"] = await asyncio.to_thread(assembler.result)
+
+# 生成模式：sequential 逐轮续写；sections 将长文档拆分成章节并行生成后拼接
+GENERATION_MODE = os.getenv("GENERATION_MODE", "sequential").lower()
+# 内容达到该长度才使用章节模式；单个章节的最大字符数；同时生成的章节数
+SECTION_MODE_MIN_CHARS = int(os.getenv("SECTION_MODE_MIN_CHARS", "12000"))
+SECTION_MAX_CHARS = int(os.getenv("SECTION_MAX_CHARS", "6000"))
+SECTION_CONCURRENCY = int(os.getenv("SECTION_CONCURRENCY", "4"))
+
+SECTION_HEADING_PATTERN = re.compile(
+    r'^\s*(#{1,6}\s+\S|第[一二三四五六七八九十百零〇0-9]+[章节部分篇]|[一二三四五六七八九十]+、|\d+(\.\d+)*[、.．]\s*\S)'
+)
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[。！？!?])|(?<=[.;；])(?=\s)')
+BODY_INNER_PATTERN = re.compile(r'<body[^>]*>(.*?)(?:</body>|$)', re.IGNORECASE | re.DOTALL)
+
+def split_into_sections(content: str, max_chars: int) -> List[str]:
+    """按标题和段落将内容拆分成不超过 max_chars 的章节，尽量在标题处分界"""
+    # 1. 切分成块：标题行开始新块，空行结束段落
+    blocks = []
+    current_lines = []
+    current_is_heading = False
+    for line in content.splitlines():
+        is_heading = bool(SECTION_HEADING_PATTERN.match(line))
+        if is_heading or not line.strip():
+            if current_lines:
+                blocks.append((current_is_heading, "\n".join(current_lines)))
+            current_lines = [line] if is_heading else []
+            current_is_heading = is_heading
+        else:
+            current_lines.append(line)
+    if current_lines:
+        blocks.append((current_is_heading, "\n".join(current_lines)))
+
+    # 2. 过长的块按句子拆分，单句仍过长时按长度硬拆分
+    pieces = []
+    for is_heading, block in blocks:
+        if len(block) <= max_chars:
+            pieces.append((is_heading, block))
+            continue
+        buffer = ""
+        for sentence in SENTENCE_BOUNDARY_PATTERN.split(block):
+            while len(sentence) > max_chars:
+                if buffer:
+                    pieces.append((is_heading, buffer))
+                    is_heading, buffer = False, ""
+                pieces.append((is_heading, sentence[:max_chars]))
+                is_heading, sentence = False, sentence[max_chars:]
+            if buffer and len(buffer) + len(sentence) > max_chars:
+                pieces.append((is_heading, buffer))
+                is_heading, buffer = False, ""
+            buffer += sentence
+        if buffer:
+            pieces.append((is_heading, buffer))
+
+    # 3. 合并成章节：超过上限，或已过半且遇到新标题时开始新章节
+    sections = []
+    section = ""
+    for is_heading, piece in pieces:
+        if section and (len(section) + len(piece) + 2 > max_chars
+                        or (is_heading and len(section) >= max_chars // 2)):
+            sections.append(section)
+            section = ""
+        section = f"{section}\n\n{piece}" if section else piece
+    if section:
+        sections.append(section)
+    return sections
+
+def clean_section_fragment(fragment: str) -> str:
+    """清理章节片段：去掉代码块标记、页面结构及标签外的说明文字"""
+    fragment = re.sub(r'```(?:html)?', '', fragment)
+    body_match = BODY_INNER_PATTERN.search(fragment)
+    if body_match:
+        fragment = body_match.group(1)
+    start = fragment.find('<')
+    end = fragment.rfind('>')
+    if start < 0 or end < start:
+        return ""
+    return fragment[start:end + 1]
+
+def build_section_page(content: str, fragments: List[str]) -> str:
+    """将各章节片段拼接进公共页面外壳"""
+    title = content.strip().splitlines()[0].lstrip("# ").strip()[:60] if content.strip() else ""
+    head = HEAD_HTML.replace("<title></title>", f"<title>{html_escape(title)}</title>", 1)
+    body = "\n".join(clean_section_fragment(fragment) for fragment in fragments)
+    page = (
+        f"{head}\n"
+        '<body class="bg-white text-gray-800 dark:bg-gray-900 dark:text-gray-100">\n'
+        '<main class="max-w-4xl mx-auto px-4 py-8 space-y-8">\n'
+        f"{body}\n"
+        "</main>\n"
+        "</body>\n"
+        "</html>"
+    )
+    return combined_fix(page)
+
+async def generate_by_sections(content: str, tmp_task_dir: Path, result: dict,
+                               max_chars: Optional[int] = None):
+    """将长文档拆分成章节并行生成，拼接后的页面写入 result["html"]"""
+    sections = split_into_sections(content, max_chars or SECTION_MAX_CHARS)
+    total = len(sections)
+    logger.info(f"按章节并行生成，共 {total} 个章节，并发数 {SECTION_CONCURRENCY}")
+    section_prompt = load_prompt("section_prompt.txt")
+    events: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(SECTION_CONCURRENCY)
+
+    async def generate_section(index: int, section: str) -> str:
+        try:
+            messages = [
+                {"role": "system", "content": section_prompt},
+                {"role": "user", "content": f"这是全文第 {index + 1}/{total} 部分：\n\n{section}"}
+            ]
+            async with semaphore:
+                section_result = {}
+                # 轮次编号即章节序号，前端预览按序号拼接各章节
+                async for event in request_ai_round_with_retry(messages, index + 1, section_result, cached_prefix=1):
+                    await events.put(event)
+            fragment = section_result["content"]
+            async with aiofiles.open(tmp_task_dir / f"section_{index + 1}.html", 'w', encoding='utf-8') as f:
+                await f.write(fragment)
+        except Exception as e:
+            await events.put(e)
+            raise
+        await events.put(None)
+        return fragment
+
+    workers = [asyncio.create_task(generate_section(index, section)) for index, section in enumerate(sections)]
+    try:
+        finished = 0
+        while finished < total:
+            event = await events.get()
+            if isinstance(event, Exception):
+                raise event
+            if event is None:
+                finished += 1
+                yield json.dumps({
+                    "status": "ai_processing",
+                    "round": finished,
+                    "message": f"已完成 {finished}/{total} 个章节"
+                })
+                continue
+            yield event
+        fragments = [worker.result() for worker in workers]
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    result["rounds"] = total
+    result["complete"] = all(fragment.strip() for fragment in fragments)
+    with STAGE_SECONDS.time(stage="merge"):
+        result["html"] = await asyncio.to_thread(build_section_page, content, fragments)
+
+# 输入预算：发送给模型前估算 token 数，超出 INPUT_TOKEN_BUDGET 时按策略处理（默认 0 表示不限制）
+# split 按章节并行生成，每次请求只包含一个章节；truncate 截断到预算内；summarize 先分段摘要再生成
+# 章节生成模式本身会拆分原文，超出预算时总是按 split 处理，不截断或摘要
+INPUT_TOKEN_BUDGET = int(os.getenv("INPUT_TOKEN_BUDGET", "0"))
+INPUT_BUDGET_STRATEGY = os.getenv("INPUT_BUDGET_STRATEGY", "split").lower()
+# 网页提取的内容中，不超过此长度且像导航、分享、版权信息的重复行视为样板内容（如"分享到微信"、"展开全文"），只保留第一次出现
+BOILERPLATE_LINE_MAX_CHARS = 80
+BOILERPLATE_LINE_PATTERN = re.compile(
+    r'分享|转发|收藏|点赞|在看|关注|扫码|二维码|阅读原文|展开全文|阅读全文|上一篇|下一篇|返回顶部|登录|注册|'
+    r'版权|©|首页|导航|菜单|\b(?:copyright|all rights reserved|share|follow|subscribe|sign (?:in|up)|log ?in|menu|home)\b',
+    re.IGNORECASE
+)
+NOISE_PATTERN = re.compile(r'[\u200b-\u200f\u2028\u2029\ufeff\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+INLINE_SPACE_PATTERN = re.compile(r'[ \t\u00a0\u3000]+')
+
+def compact_content(content: str, drop_boilerplate: bool = False) -> str:
+    """压缩原文：去掉不可见字符、合并空白和多余空行，代码块内保持原样
+
+    drop_boilerplate 为 True（网页提取的内容）时删除重复出现的导航、分享、版权等样板短行；
+    用户粘贴的文本中重复的列表项、歌词副歌、"是/否"等都是正文，全部保留
+    """
+    lines = []
+    seen = set()
+    in_code = False
+    for raw_line in NOISE_PATTERN.sub('', content).splitlines():
+        if raw_line.strip().startswith("```"):
+            in_code = not in_code
+            lines.append(raw_line.strip())
+            continue
+        if in_code:
+            lines.append(raw_line.rstrip())
+            continue
+        line = INLINE_SPACE_PATTERN.sub(' ', raw_line).strip()
+        if not line:
+            if lines and lines[-1]:
+                lines.append("")
+            continue
+        if (drop_boilerplate and len(line) <= BOILERPLATE_LINE_MAX_CHARS
+                and BOILERPLATE_LINE_PATTERN.search(line)):
+            if line in seen:
+                continue
+            seen.add(line)
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def truncate_to_budget(content: str, budget: int) -> str:
+    """按行截断到 token 预算内，单行超出时截断该行"""
+    kept = []
+    used = 0
+    lines = content.splitlines()
+    for index, line in enumerate(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost <= budget:
+            kept.append(line)
+            used += cost
+            continue
+        # 二分查找该行能保留的最长前缀
+        low, high = 0, len(line)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_tokens(line[:middle]) <= budget - used:
+                low = middle
+            else:
+                high = middle - 1
+        if low:
+            kept.append(line[:low])
+        omitted = estimate_tokens("\n".join([line[low:]] + lines[index + 1:]))
+        kept.append(f"\n（原文过长，已截断，省略约 {omitted} tokens）")
+        break
+    return "\n".join(kept)
+
+async def summarize_to_budget(content: str, budget: int) -> str:
+    """按章节并行请求AI摘要，使整体长度接近预算"""
+    sections = split_into_sections(content, SECTION_MAX_CHARS)
+    ratio = budget / max(estimate_tokens(content), 1)
+    prompt = load_prompt("summarize_prompt.txt")
+    semaphore = asyncio.Semaphore(SECTION_CONCURRENCY)
+
+    async def summarize(index: int, section: str) -> str:
+        target = max(50, int(estimate_tokens(section) * ratio))
+        messages = [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": f"目标长度：约 {target} tokens\n\n{section}"}
+        ]
+        async with semaphore:
+            round_result = {}
+            # 摘要不需要推送流式预览，丢弃增量事件
+            async for _ in request_ai_round_with_retry(messages, index + 1, round_result, cached_prefix=1):
+                pass
+        return round_result["content"].strip()
+
+    summaries = await asyncio.gather(*(summarize(i, section) for i, section in enumerate(sections)))
+    return "\n\n".join(summaries)
+
+async def apply_input_budget(content: str, tokens: int, strategy: str) -> str:
+    """内容超出预算时按策略处理，返回处理后的内容（split 策略内容不变，由调用方按章节生成）"""
+    if strategy == "summarize":
+        try:
+            content = await summarize_to_budget(content, INPUT_TOKEN_BUDGET)
+            logger.info(f"原文已摘要: {tokens} -> {estimate_tokens(content)} tokens")
+        except Exception as e:
+            logger.warning(f"摘要失败，改为截断: {str(e)}")
+    elif strategy == "split":
+        return content
+    elif strategy != "truncate":
+        logger.warning(f"未知的输入预算策略 {strategy}，使用 truncate")
+    if estimate_tokens(content) > INPUT_TOKEN_BUDGET:
+        content = truncate_to_budget(content, INPUT_TOKEN_BUDGET)
+        logger.info(f"原文已截断到 {estimate_tokens(content)} tokens")
+    return content
+
+# 自托管前端资源：scripts/fetch_vendor_assets.py 下载到 static/vendor，文件缺失时页面继续使用CDN
+SELF_HOST_ASSETS = os.getenv("SELF_HOST_ASSETS", "true").lower() == "true"
+VENDOR_DIR = STATIC_DIR / "vendor"
+TAILWIND_CSS_FILE = VENDOR_DIR / "tailwind" / "tailwind.min.css"
+FONT_AWESOME_CSS_FILE = VENDOR_DIR / "fontawesome" / "css" / "all.min.css"
+# HEAD_HTML 中引用的 Google Fonts Inter 字体（样式表及字体文件）
+INTER_FONT_CSS_FILE = VENDOR_DIR / "inter" / "inter.css"
+
+TAILWIND_LINK_PATTERN = re.compile(r'<link\b[^>]*href=["\'][^"\']*tailwind[^"\']*\.css[^"\']*["\'][^>]*>', re.IGNORECASE)
+TAILWIND_SCRIPT_PATTERN = re.compile(
+    r'<script\b[^>]*src=["\'][^"\']*tailwind[^"\']*["\'][^>]*>\s*</script>', re.IGNORECASE
+)
+FONT_AWESOME_LINK_PATTERN = re.compile(
+    r'<link\b[^>]*href=["\'][^"\']*font-?awesome[^"\']*\.css[^"\']*["\'][^>]*>', re.IGNORECASE
+)
+GOOGLE_FONTS_IMPORT_PATTERN = re.compile(r'@import\s+url\(\s*["\']?https?://fonts\.googleapis\.com[^)]*\)\s*;?', re.IGNORECASE)
+GOOGLE_FONTS_LINK_PATTERN = re.compile(r'<link\b[^>]*fonts\.(?:googleapis|gstatic)\.com[^>]*>', re.IGNORECASE)
+INTER_FONT_FAMILY_PATTERN = re.compile(r'family=Inter(?![\w+])', re.IGNORECASE)
+CLASS_ATTRIBUTE_PATTERN = re.compile(r'\bclass\s*=\s*(["\'])(.*?)\1', re.IGNORECASE | re.DOTALL)
+# 脚本中动态切换的类名，如 classList.toggle('dark')
+CLASS_LIST_CALL_PATTERN = re.compile(r'classList\.(?:add|remove|toggle|replace)\(([^)]*)\)')
+QUOTED_STRING_PATTERN = re.compile(r'["\']([^"\']+)["\']')
+CSS_CLASS_PATTERN = re.compile(r'\.((?:\\[0-9a-fA-F]{1,6}\s?|\\.|[\w-])+)')
+CSS_ESCAPE_PATTERN = re.compile(r'\\(?:([0-9a-fA-F]{1,6})\s?|(.))')
+
+def unescape_css_identifier(identifier: str) -> str:
+    """还原CSS转义的类名，如 md\\:w-1\\/2 -> md:w-1/2，\\32xl -> 2xl"""
+    return CSS_ESCAPE_PATTERN.sub(lambda m: chr(int(m.group(1), 16)) if m.group(1) else m.group(2), identifier)
+
+def split_selectors(prelude: str) -> List[str]:
+    """按顶层逗号拆分选择器列表"""
+    selectors = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(prelude):
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            selectors.append(prelude[start:index].strip())
+            start = index + 1
+    selectors.append(prelude[start:].strip())
+    return [selector for selector in selectors if selector]
+
+def parse_css_rules(css: str, pos: int = 0) -> tuple:
+    """把CSS解析成规则列表：
+
+    ("rule", [(选择器, 选择器用到的类名集合), ...], 声明) 普通规则
+    ("block", 条件, 子规则列表) @media/@supports
+    ("raw", 原文) 其他 @ 规则（@keyframes、@font-face 等），原样保留
+    """
+    nodes = []
+    length = len(css)
+    while pos < length:
+        # 跳过空白和注释
+        while pos < length and (css[pos].isspace() or css.startswith("/*", pos)):
+            if css.startswith("/*", pos):
+                end = css.find("*/", pos + 2)
+                pos = length if end < 0 else end + 2
+            else:
+                pos += 1
+        if pos >= length:
+            break
+        if css[pos] == "}":
+            return nodes, pos + 1
+        start = pos
+        while pos < length and css[pos] not in "{;":
+            pos += 1
+        prelude = css[start:pos].strip()
+        if pos >= length:
+            break
+        if css[pos] == ";":
+            nodes.append(("raw", prelude + ";"))
+            pos += 1
+            continue
+        pos += 1
+        if prelude.startswith(("@media", "@supports")):
+            children, pos = parse_css_rules(css, pos)
+            nodes.append(("block", prelude, children))
+            continue
+        # 找到匹配的右括号，@keyframes 等规则内部还有嵌套
+        body_start = pos
+        depth = 1
+        while pos < length and depth:
+            char = css[pos]
+            if char in "\"'":
+                end = css.find(char, pos + 1)
+                pos = length if end < 0 else end
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+            pos += 1
+        body = css[body_start:pos - 1]
+        if prelude.startswith("@"):
+            nodes.append(("raw", f"{prelude}{{{body}}}"))
+        else:
+            selectors = [
+                (selector, frozenset(unescape_css_identifier(name) for name in CSS_CLASS_PATTERN.findall(selector)))
+                for selector in split_selectors(prelude)
+            ]
+            nodes.append(("rule", selectors, body))
+    return nodes, pos
+
+def purge_css_rules(nodes: list, used_classes: set) -> str:
+    """只保留用到的类名对应的规则；不含类名的基础样式（元素选择器等）全部保留"""
+    output = []
+    for node in nodes:
+        if node[0] == "rule":
+            kept = [selector for selector, classes in node[1] if classes <= used_classes]
+            if kept:
+                output.append(f"{','.join(kept)}{{{node[2]}}}")
+        elif node[0] == "block":
+            inner = purge_css_rules(node[2], used_classes)
+            if inner:
+                output.append(f"{node[1]}{{{inner}}}")
+        else:
+            output.append(node[1])
+    return "".join(output)
 
+# 已解析的 Tailwind 规则：(文件修改时间, 规则列表)，只在文件变化时重新解析
+tailwind_rules_cache: Dict[str, Any] = {}
 
+def load_tailwind_rules() -> Optional[list]:
+    """读取并缓存本地 Tailwind CSS 的解析结果，文件不存在时返回 None"""
+    try:
+        mtime = TAILWIND_CSS_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if tailwind_rules_cache.get("mtime") != mtime:
+        nodes, _ = parse_css_rules(TAILWIND_CSS_FILE.read_text(encoding="utf-8"))
+        tailwind_rules_cache.update({"mtime": mtime, "nodes": nodes})
+        logger.info(f"已加载本地 Tailwind CSS，共 {len(nodes)} 条规则")
+    return tailwind_rules_cache["nodes"]
+
+def collect_used_classes(html: str) -> set:
+    """收集页面用到的类名，包括脚本中通过 classList 切换的类名"""
+    used = {"dark", "light"}
+    for match in CLASS_ATTRIBUTE_PATTERN.finditer(html):
+        used.update(match.group(2).split())
+    for match in CLASS_LIST_CALL_PATTERN.finditer(html):
+        used.update(QUOTED_STRING_PATTERN.findall(match.group(1)))
+    return used
+
+# 本地资源URL缓存：路径 -> (修改时间, URL)，文件变化时才重新计算哈希
+vendor_asset_urls: Dict[str, tuple] = {}
+
+def vendor_asset_url(path: Path) -> Optional[str]:
+    """本地资源URL，带内容哈希作为版本号；文件不存在时返回 None"""
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = vendor_asset_urls.get(str(path))
+    if cached is None or cached[0] != mtime:
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()[:10]
+        cached = (mtime, f"/{path.as_posix()}?v={digest}")
+        vendor_asset_urls[str(path)] = cached
+    return cached[1]
+
+class SelfHostAssetsPass(FixPass):
+    """把页面中的 CDN 资源替换为本地资源：Tailwind 按用到的类名裁剪后内联，Font Awesome 和 Inter 字体指向 /static/vendor
+
+    本地没有对应文件时保留原链接，其他 Google Fonts 字体也保留原链接
+    """
+    name = "self_host_assets"
+    tags = {"link", "script", "style"}
+
+    def begin(self, html: str):
+        self.used_classes = set()
+        self.tailwind_slot: Optional[int] = None
+        self.tailwind_rules = load_tailwind_rules()
+        self.font_awesome_url = vendor_asset_url(FONT_AWESOME_CSS_FILE)
+        self.inter_font_url = vendor_asset_url(INTER_FONT_CSS_FILE)
+
+    def fix(self, token: PostToken, stream: PostStream) -> Optional[str]:
+        if token.closing:
+            return token.text
+        if token.name == "script":
+            if self.tailwind_rules is not None and TAILWIND_SCRIPT_PATTERN.match(token.text):
+                return self.tailwind_placeholder(stream)
+            return token.text
+        if token.name == "link":
+            if self.tailwind_rules is not None and TAILWIND_LINK_PATTERN.match(token.text):
+                return self.tailwind_placeholder(stream)
+            if self.font_awesome_url and FONT_AWESOME_LINK_PATTERN.match(token.text):
+                return f'<link rel="stylesheet" href="{self.font_awesome_url}">'
+            if (self.inter_font_url and GOOGLE_FONTS_LINK_PATTERN.match(token.text)
+                    and INTER_FONT_FAMILY_PATTERN.search(token.text)):
+                return f'<link rel="stylesheet" href="{self.inter_font_url}">'
+        elif token.name == "style" and self.inter_font_url:
+            return GOOGLE_FONTS_IMPORT_PATTERN.sub(self.local_font_import, token.text)
+        return token.text
+
+    def local_font_import(self, match: re.Match) -> str:
+        if INTER_FONT_FAMILY_PATTERN.search(match.group()):
+            return f"@import url('{self.inter_font_url}');"
+        return match.group()
+
+    def tailwind_placeholder(self, stream: PostStream) -> None:
+        """第一个 Tailwind 链接（或脚本）处预留内联样式的位置，其余删除"""
+        if self.tailwind_slot is None:
+            self.tailwind_slot = stream.placeholder()
+        return None
+
+    def finish(self, stream: PostStream):
+        # 页面扫描完才知道用到了哪些类名，脚本中拼接的 class 属性和 classList 切换的类名也算在内
+        if self.tailwind_slot is not None:
+            for part in stream.parts:
+                self.used_classes |= collect_used_classes(part)
+            purged = purge_css_rules(self.tailwind_rules, self.used_classes)
+            stream.parts[self.tailwind_slot] = f"<style>{purged}</style>"
+
+def build_post_processor() -> HtmlPostProcessor:
+    """组装后处理步骤，顺序即执行顺序"""
+    passes = [DocumentShellPass, DuplicateHeadPass, StrayFencePass, TailwindCdnPass]
+    if SELF_HOST_ASSETS:
+        passes.append(SelfHostAssetsPass)
+    return HtmlPostProcessor(passes)
+
+page_post_processor = build_post_processor()
+
+# 生成结果写入时是否压缩HTML，以及预压缩的 gzip 级别
+MINIFY_OUTPUT = os.getenv("MINIFY_OUTPUT", "true").lower() == "true"
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "9"))
+
+# 安装了 brotli 时额外生成 .br 文件
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# 内容需要原样保留的元素
+PRESERVED_BLOCK_PATTERN = re.compile(r'(<(pre|textarea|script|style)\b[^>]*>.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+HTML_COMMENT_PATTERN = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+# CSS 中的引号字符串需原样保留（如 content 的取值），注释与字符串一起扫描，避免把字符串中的 /* 当作注释
+CSS_STRING_OR_COMMENT_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|/\*.*?\*/', re.DOTALL)
+CSS_PUNCTUATION_PATTERN = re.compile(r'\s*([{};,])\s*')
+
+def minify_css(css: str) -> str:
+    """去掉CSS注释和多余空白，引号字符串保持原样"""
+    parts = []
+    # 两个字符串之间的代码（已去掉注释），遇到字符串时统一压缩
+    code = []
+    last = 0
+    for match in CSS_STRING_OR_COMMENT_PATTERN.finditer(css):
+        code.append(css[last:match.start()])
+        last = match.end()
+        if match.group().startswith('/*'):
+            continue
+        parts.append(CSS_PUNCTUATION_PATTERN.sub(r'\1', WHITESPACE_PATTERN.sub(' ', "".join(code))))
+        parts.append(match.group())
+        code = []
+    code.append(css[last:])
+    parts.append(CSS_PUNCTUATION_PATTERN.sub(r'\1', WHITESPACE_PATTERN.sub(' ', "".join(code))))
+    return "".join(parts).strip()
+
+def minify_html(html: str) -> str:
+    """保守的HTML压缩：去掉注释、合并空白为单个空格，压缩内联CSS；pre/textarea/script 保持原样"""
+    parts = []
+    last = 0
+    for match in PRESERVED_BLOCK_PATTERN.finditer(html):
+        parts.append(WHITESPACE_PATTERN.sub(' ', HTML_COMMENT_PATTERN.sub('', html[last:match.start()])))
+        block = match.group(1)
+        if match.group(2).lower() == "style":
+            open_end = block.index('>') + 1
+            close_start = block.lower().rindex('</style')
+            block = block[:open_end] + minify_css(block[open_end:close_start]) + block[close_start:]
+        parts.append(block)
+        last = match.end()
+    parts.append(WHITESPACE_PATTERN.sub(' ', HTML_COMMENT_PATTERN.sub('', html[last:])))
+    return "".join(parts).strip()
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """先写同目录下的临时文件再重命名，读取方不会看到写了一半的文件"""
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def write_compressed_variants(file_path: Path, data: bytes):
+    """生成 gzip/brotli 预压缩文件，供 /view 按 Accept-Encoding 直接返回"""
+    gzip_path = file_path.with_name(file_path.name + ".gz")
+    # mtime=0 保证相同内容的压缩结果一致
+    atomic_write_bytes(gzip_path, gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    if BROTLI_AVAILABLE:
+        atomic_write_bytes(file_path.with_name(file_path.name + ".br"), brotli.compress(data, mode=brotli.MODE_TEXT))
+
+# 生成结果存储：local 为本地文件系统，相同内容只保存一份
+ARTIFACT_STORE = os.getenv("ARTIFACT_STORE", "local").lower()
+# 生成结果的保留时间（秒）及占用上限（字节），默认 0 表示不限制：/view 链接是永久链接，启用后过期的页面会被删除
+RESULT_RETENTION_SECONDS = int(os.getenv("RESULT_RETENTION_SECONDS", "0"))
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", "0"))
+# 任务临时文件（每轮返回、预览、错误信息）的保留时间（秒）及占用上限（字节），0 表示不限制
+TMP_RETENTION_SECONDS = int(os.getenv("TMP_RETENTION_SECONDS", str(24 * 3600)))
+TMP_MAX_BYTES = int(os.getenv("TMP_MAX_BYTES", str(512 * 1024 * 1024)))
+# 任务成功后是否保留临时文件（调试用），失败任务的临时文件总是保留到过期
+KEEP_TMP_FILES = os.getenv("KEEP_TMP_FILES", "false").lower() == "true"
+# 后台清理间隔（秒），0 表示不清理
+STORAGE_SWEEP_INTERVAL = int(os.getenv("STORAGE_SWEEP_INTERVAL", "600"))
+# 写入中断留下的临时文件、未被引用的内容超过该时间（秒）后清理
+STALE_FILE_SECONDS = 3600
+
+# 结果文件及其预压缩版本的后缀
+RESULT_VARIANT_SUFFIXES = ("", ".gz", ".br")
+
+def expired_units(units: list, now: float, retention: int, max_bytes: int) -> list:
+    """按保留策略选出要删除的条目：超过保留时间的，以及超出占用上限时最旧的
+
+    units 为 (修改时间, 字节数, 条目) 列表，返回要删除的条目
+    """
+    total = sum(size for _, size, _ in units)
+    expired = []
+    for mtime, size, item in sorted(units, key=lambda unit: unit[0]):
+        if (retention and now - mtime > retention) or (max_bytes and total > max_bytes):
+            expired.append(item)
+            total -= size
+    return expired
+
+class ArtifactStore(ABC):
+    """生成结果存储接口：按 file_id 保存页面及预压缩版本，并按保留策略清理"""
+
+    @abstractmethod
+    async def put(self, file_id: str, data: bytes) -> bool:
+        """保存页面，内容已存在（去重）时返回 True"""
+
+    @abstractmethod
+    def path_for(self, file_id: str, suffix: str = "") -> Path:
+        """页面（或其预压缩版本）的本地路径"""
+
+    def exists(self, file_id: str) -> bool:
+        return self.path_for(file_id).exists()
+
+    @abstractmethod
+    async def sweep(self) -> dict:
+        """按保留策略清理，返回清理统计"""
+
+    def stats(self) -> dict:
+        return {}
+
+class LocalArtifactStore(ArtifactStore):
+    """本地文件系统存储：内容保存在 .objects/<sha256>.html（含预压缩版本），<file_id>.html 是指向它的硬链接"""
+
+    def __init__(self, root: Path, retention: int, max_bytes: int):
+        self.root = root
+        self.objects_dir = root / ".objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.deduplicated = 0
+        self.last_sweep: Optional[dict] = None
+
+    def path_for(self, file_id: str, suffix: str = "") -> Path:
+        return self.root / f"{file_id}.html{suffix}"
+
+    @staticmethod
+    def _link(source: Path, target: Path):
+        """原子地创建硬链接，文件系统不支持硬链接时复制"""
+        tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+
+    def _put(self, file_id: str, data: bytes) -> bool:
+        object_path = self.objects_dir / f"{hashlib.sha256(data).hexdigest()}.html"
+        variants = [object_path.with_name(object_path.name + suffix) for suffix in RESULT_VARIANT_SUFFIXES]
+        deduplicated = object_path.exists()
+        if deduplicated:
+            # 保留期从最近一次生成算起，共享这份内容的 file_id 一起延长
+            for variant in variants:
+                if variant.exists():
+                    os.utime(variant)
+        else:
+            # 先写预压缩版本，主文件存在即表示整组文件已写完
+            write_compressed_variants(object_path, data)
+            atomic_write_bytes(object_path, data)
+        for suffix, variant in zip(RESULT_VARIANT_SUFFIXES, variants):
+            if variant.exists():
+                self._link(variant, self.path_for(file_id, suffix))
+        return deduplicated
+
+    async def put(self, file_id: str, data: bytes) -> bool:
+        deduplicated = await asyncio.to_thread(self._put, file_id, data)
+        if deduplicated:
+            self.deduplicated += 1
+            logger.info(f"结果 {file_id} 与已有内容相同，已链接到同一份文件")
+        return deduplicated
+
+    def _sweep(self) -> dict:
+        now = time.time()
+        # inode -> 内容：同一份内容的对象文件和各个 file_id 的链接归为一组，一起保留或删除
+        contents: Dict[int, dict] = {}
+        for directory, is_object in ((self.objects_dir, True), (self.root, False)):
+            for path in directory.iterdir():
+                try:
+                    if path.name.startswith("."):
+                        if path.name.endswith(".tmp") and now - path.stat().st_mtime > STALE_FILE_SECONDS:
+                            path.unlink(missing_ok=True)
+                        continue
+                    if not path.name.endswith(".html"):
+                        continue
+                    stat = path.stat()
+                    variants = [
+                        variant for variant in (path.with_name(path.name + suffix) for suffix in RESULT_VARIANT_SUFFIXES)
+                        if variant.exists()
+                    ]
+                    content = contents.get(stat.st_ino)
+                    if content is None:
+                        content = contents[stat.st_ino] = {
+                            "mtime": stat.st_mtime,
+                            "size": sum(variant.stat().st_size for variant in variants),
+                            "paths": [],
+                            "linked": False
+                        }
+                    content["paths"].extend(variants)
+                    content["linked"] = content["linked"] or not is_object
+                except FileNotFoundError:
+                    continue
+
+        orphans = [
+            content for content in contents.values()
+            if not content["linked"] and now - content["mtime"] > STALE_FILE_SECONDS
+        ]
+        linked = [(content["mtime"], content["size"], content) for content in contents.values() if content["linked"]]
+        expired = expired_units(linked, now, self.retention, self.max_bytes)
+        for content in orphans + expired:
+            for path in content["paths"]:
+                path.unlink(missing_ok=True)
+        return {
+            "contents": len(linked) - len(expired),
+            "bytes": sum(size for _, size, _ in linked) - sum(content["size"] for content in expired),
+            "removed": len(expired),
+            "orphans_removed": len(orphans),
+            "swept_at": int(now)
+        }
+
+    async def sweep(self) -> dict:
+        self.last_sweep = await asyncio.to_thread(self._sweep)
+        if self.last_sweep["removed"] or self.last_sweep["orphans_removed"]:
+            logger.info(
+                f"已清理 {self.last_sweep['removed']} 个过期结果、{self.last_sweep['orphans_removed']} 个未引用内容，"
+                f"剩余 {self.last_sweep['bytes']} 字节"
+            )
+        return self.last_sweep
+
+    def stats(self) -> dict:
+        return {
+            "backend": "local",
+            "retention_seconds": self.retention,
+            "max_bytes": self.max_bytes,
+            "deduplicated": self.deduplicated,
+            "last_sweep": self.last_sweep
+        }
 
-async def process_status_generator(url: Optional[str] = None, text: Optional[str] = None):
+def create_artifact_store() -> ArtifactStore:
+    """根据 ARTIFACT_STORE 配置创建生成结果存储"""
+    if ARTIFACT_STORE != "local":
+        logger.warning(f"未知的结果存储类型: {ARTIFACT_STORE}，使用本地存储")
+    return LocalArtifactStore(HTML_DIR, RESULT_RETENTION_SECONDS, RESULT_STORE_MAX_BYTES)
+
+artifact_store = create_artifact_store()
+
+def sweep_tmp_dirs(tmp_dir: Path, retention: int, max_bytes: int, active: set) -> dict:
+    """按保留策略清理任务临时目录，跳过正在运行的任务"""
+    now = time.time()
+    units = []
+    for task_dir in tmp_dir.iterdir():
+        if not task_dir.is_dir() or task_dir.name in active:
+            continue
+        try:
+            mtime = task_dir.stat().st_mtime
+            size = 0
+            for path in task_dir.iterdir():
+                stat = path.stat()
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+        except FileNotFoundError:
+            continue
+        units.append((mtime, size, task_dir))
+    expired = expired_units(units, now, retention, max_bytes)
+    for task_dir in expired:
+        shutil.rmtree(task_dir, ignore_errors=True)
+    return {"task_dirs": len(units) - len(expired), "removed": len(expired)}
+
+async def run_storage_sweeper():
+    """后台定期清理过期的临时文件和生成结果"""
+    while True:
+        try:
+            tmp_stats = await asyncio.to_thread(
+                sweep_tmp_dirs, TMP_DIR, TMP_RETENTION_SECONDS, TMP_MAX_BYTES, set(task_runners)
+            )
+            if tmp_stats["removed"]:
+                logger.info(f"已清理 {tmp_stats['removed']} 个过期的任务临时目录")
+            await artifact_store.sweep()
+        except Exception as e:
+            logger.error(f"清理存储失败: {str(e)}", exc_info=True)
+        await asyncio.sleep(STORAGE_SWEEP_INTERVAL)
+
+async def write_result_page(file_id: str, html: str):
+    """写入生成的页面（可选压缩）及其预压缩版本，相同内容只保存一份"""
+    if MINIFY_OUTPUT:
+        html = await asyncio.to_thread(minify_html, html)
+    await artifact_store.put(file_id, html.encode("utf-8"))
+
+async def process_status_generator(url: Optional[str] = None, text: Optional[str] = None,
+                                   task_id: Optional[str] = None, use_cache: bool = True):
     """生成处理状态事件"""
-    task_id = str(uuid.uuid4())
+    task_id = task_id or str(uuid.uuid4())
     tmp_task_dir = TMP_DIR / task_id
     tmp_task_dir.mkdir(exist_ok=True)
+    completed = False
+    slot_acquired_at = None
     
     try:
         yield json.dumps({
@@ -539,137 +3755,90 @@ async def process_status_generator(url: Optional[str] = None, text: Optional[str
         
         # 提取内容
         if url:
-            content = extract_main_content(url)
+            content = await extract_main_content(url)
         else:
             content = text
 
+        content = compact_content(content, drop_boilerplate=bool(url))
         content_length = len(content)
+        estimated_tokens = estimate_tokens(content)
+        over_budget = 0 < INPUT_TOKEN_BUDGET < estimated_tokens
+        section_mode = GENERATION_MODE == "sections" and content_length >= SECTION_MODE_MIN_CHARS
+        budget_strategy = "split" if section_mode else INPUT_BUDGET_STRATEGY
+        message = f"正在提取内容...内容长度: {content_length} 字符，约 {estimated_tokens} tokens"
+        if over_budget:
+            message += f"，超出输入预算 {INPUT_TOKEN_BUDGET} tokens，按 {budget_strategy} 策略处理"
         yield json.dumps({
             "status": "extracting",
-            "message": f"正在提取内容...内容长度: {content_length} 字符",
-            "content_length": content_length  # 添加长度信息
+            "message": message,
+            "content_length": content_length,  # 添加长度信息
+            "estimated_tokens": estimated_tokens,
+            "token_budget": INPUT_TOKEN_BUDGET,
+            "budget_strategy": budget_strategy if over_budget else None
         })
         await asyncio.sleep(0.1) #添加小延迟，确保状态被前端接收
-        
-        # 创建 httpx 客户端
-        http_client = httpx.AsyncClient(
-            verify=False,
-            timeout=httpx.Timeout(
-                connect=120.0,
-                read=240.0,
-                write=240.0,
-                pool=240.0
-            )
-        )
-        
-        # 创建 OpenAI 客户端
-        async_client = openai.AsyncClient(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url=os.getenv("OPENAI_BASE_URL"),
-            http_client=http_client,
-            timeout=400.0,
-            max_retries=5
-        )
-        
-        try:
-            # 从文件加载系统提示词
-            system_prompt = load_prompt("format_prompt.txt")
-            logger.info("已加载系统提示词")
-            
-            # 初始化消息列表
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": content
-                }
-            ]
-            
-            full_content = []
-            # 记录初始最大段数设置
-            max_ai_segments = int(os.getenv("MAX_AI_SEGMENTS", "20"))
-            logger.info(f"AI生成内容最大段数设置为: {max_ai_segments}")
-            attempt = 0
-            
-            while attempt < max_ai_segments:
-                # 每次循环重新加载环境变量，确保配置实时更新
-                load_dotenv(override=True)
-                current_max_segments = int(os.getenv("MAX_AI_SEGMENTS", "20"))
-                
-                # 如果最大段数设置发生变化，记录日志
-                if current_max_segments != max_ai_segments:
-                    logger.info(f"AI生成内容最大段数已更新: {max_ai_segments} -> {current_max_segments}")
-                    max_ai_segments = current_max_segments
-                
-                try:
-                    response = await async_client.chat.completions.create(
-                        model=os.getenv("OPENAI_MODEL", "claude 3.7"),#至少是 claude 3.7级别
-                        messages=messages
-                    )
-                    
-                    current_content = response.choices[0].message.content
-                    full_content.append(current_content)
-                    
-                    # 保存当前轮次的返回数据
-                    tmp_file = tmp_task_dir / f"round_{attempt + 1}.html"
-                    async with aiofiles.open(tmp_file, 'w', encoding='utf-8') as f:
-                        await f.write(current_content)
-                    logger.info(f"保存第 {attempt + 1}/{max_ai_segments} 段AI返回数据: {tmp_file}")
-                    
-                    if is_complete_html(current_content):  # 使用新的检查函数
-                        break
-                        
-                    # 从文件加载续写提示词（如果有）
-                    continue_prompt = load_prompt("continue_prompt.txt")
-                    
-                    # 更新消息历史，添加 AI 的回复和新的用户指令
-                    messages.extend([
-                        {"role": "assistant", "content": current_content},
-                        {"role": "user", "content": continue_prompt}
-                    ])
-                    
-                    attempt += 1
-                    
-                    yield json.dumps({
-                        "status": "ai_processing",
-                        "round": attempt,
-                        "message": f"AI优化处理第 {attempt} 轮..."
-                    })
-                    await asyncio.sleep(0.1) #添加小延迟，确保状态被前端接收
-                    
-                except Exception as e:
-                    logger.error(f"AI 请求失败: {str(e)}", exc_info=True)
-                    # 保存错误信息
-                    error_file = tmp_task_dir / f"error_round_{attempt + 1}.txt"
-                    async with aiofiles.open(error_file, 'w', encoding='utf-8') as f:
-                        await f.write(f"Error: {str(e)}")
-                    continue
-            
-            # 修正和保存最终合并的内容
-            combined_content = merge_ai_responses(full_content)
 
-            final_file = tmp_task_dir / "final.html"
-            async with aiofiles.open(final_file, 'w', encoding='utf-8') as f:
-                await f.write(combined_content)
-            
-            # 复制到最终目标位置，使用之前生成的task_id
-            file_path = HTML_DIR / f"{task_id}.html"
-            async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-                await f.write(combined_content)
-                
-            yield json.dumps({
-                "status": "completed",
-                "file_id": task_id,  # 使用task_id作为file_id
-                "message": "处理完成！"
-            })
-            await asyncio.sleep(0.1) #添加小延迟，确保状态被前端接收
+        # 相同内容已生成过时直接返回已有结果；缓存键基于预算处理前的原文，摘要等输出不确定的处理不影响命中
+        budget = ""
+        if over_budget:
+            budget = f"{INPUT_TOKEN_BUDGET}:{budget_strategy}"
+            if budget_strategy == "summarize":
+                budget += "\0" + load_prompt("summarize_prompt.txt")
+        cache_key = result_cache_key(content, budget)
+        if RESULT_CACHE_ENABLED and use_cache:
+            cached_file_id = await result_cache.get(cache_key)
+            if cached_file_id:
+                logger.info(f"命中结果缓存: {cached_file_id}")
+                completed = True
+                yield json.dumps({
+                    "status": "completed",
+                    "file_id": cached_file_id,
+                    "cached": True,
+                    "message": "处理完成！"
+                })
+                return
+
+        # 只有生成阶段占用运行名额，抓取、提取和命中缓存的任务无需排队
+        async for queue_status in job_scheduler.acquire(task_id):
+            yield json.dumps(queue_status)
+        slot_acquired_at = time.monotonic()
+
+        # 长文档可按章节并行生成，否则逐轮续写生成
+        generation_result = {}
+        if over_budget and budget_strategy == "split":
+            # 按预算折算每个章节的最大字符数，保证单次请求不超出预算
+            max_chars = min(SECTION_MAX_CHARS, content_length * INPUT_TOKEN_BUDGET // estimated_tokens)
+            generator = generate_by_sections(content, tmp_task_dir, generation_result, max(max_chars, 1))
+        elif section_mode:
+            generator = generate_by_sections(content, tmp_task_dir, generation_result)
+        else:
+            if over_budget:
+                content = await apply_input_budget(content, estimated_tokens, budget_strategy)
+            generator = generate_sequentially(content, tmp_task_dir, generation_result)
+        async for event in generator:
+            yield event
+        combined_content = generation_result["html"]
+
+        JOB_ROUNDS.observe(generation_result.get("rounds", 0))
+
+        # 压缩写入最终目标位置，使用之前生成的task_id
+        with STAGE_SECONDS.time(stage="write"):
+            await write_result_page(task_id, combined_content)
+        completed = True
+
+        # 只缓存完整生成的页面，未写完或正文为空的结果下次重新生成
+        if RESULT_CACHE_ENABLED and generation_result.get("complete") and has_body_content(combined_content):
+            await result_cache.put(cache_key, task_id)
+        elif RESULT_CACHE_ENABLED:
+            logger.warning(f"生成结果不完整或正文为空，不写入结果缓存: {task_id}")
             
-        finally:
-            # 确保关闭 http 客户端
-            await http_client.aclose()
+        yield json.dumps({
+            "status": "completed",
+            "file_id": task_id,  # 使用task_id作为file_id
+            "message": "处理完成！"
+        })
+        await asyncio.sleep(0.1) #添加小延迟，确保状态被前端接收
+        
 
     except Exception as e:
         logger.error(f"处理失败: {str(e)}", exc_info=True)
@@ -685,17 +3854,94 @@ async def process_status_generator(url: Optional[str] = None, text: Optional[str
         await asyncio.sleep(0.1) #添加小延迟，确保状态被前端接收
         
     finally:
-        # 可以选择在这里添加临时文件的清理逻辑
-        # 或者保留临时文件以供调试
-        pass
+        if slot_acquired_at is not None:
+            job_scheduler.release(time.monotonic() - slot_acquired_at)
+        # 成功后删除每轮返回等临时文件，失败时保留以供调试，由后台清理按保留期删除
+        if completed and not KEEP_TMP_FILES:
+            await asyncio.to_thread(shutil.rmtree, tmp_task_dir, True)
+
+@app.get("/preview/{task_id}")
+async def preview_html(task_id: str):
+    """查看生成中的部分页面，任务完成后跳转到最终页面"""
+    task = await task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    # 任务完成后临时目录会被清理，预览链接直接指向最终结果
+    state = task.get("state") or {}
+    if state.get("status") == "completed" and state.get("file_id"):
+        return RedirectResponse(f"/view/{state['file_id']}", headers={"Cache-Control": "no-store"})
+    file_path = TMP_DIR / task_id / PREVIEW_FILENAME
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="预览尚未生成")
+    return FileResponse(file_path, media_type="text/html", headers={"Cache-Control": "no-store"})
+
+# file_id 对应的内容不会改变，浏览器和CDN可以长期缓存
+VIEW_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 预压缩文件后缀，按优先级排列
+CONTENT_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+# 页面内容哈希缓存：路径 -> (修改时间, 哈希)，按 LRU 保留最近访问的页面
+PAGE_ETAG_CACHE_SIZE = 4096
+page_etags: "OrderedDict[str, tuple]" = OrderedDict()
+
+def page_etag(file_path: Path) -> str:
+    """基于内容哈希的强 ETag，文件修改时间不变时使用缓存"""
+    key = str(file_path)
+    try:
+        mtime = file_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        # 文件已被清理
+        page_etags.pop(key, None)
+        raise
+    cached = page_etags.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, hashlib.sha256(file_path.read_bytes()).hexdigest()[:32])
+        page_etags[key] = cached
+    page_etags.move_to_end(key)
+    while len(page_etags) > PAGE_ETAG_CACHE_SIZE:
+        page_etags.popitem(last=False)
+    return cached[1]
+
+def accepted_encodings(header: str) -> set:
+    """解析 Accept-Encoding，忽略 q=0 的编码"""
+    encodings = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
 
 @app.get("/view/{file_id}")
-async def view_html(file_id: str):
-    """查看生成的HTML文件"""
-    file_path = HTML_DIR / f"{file_id}.html"
+async def view_html(file_id: str, request: Request):
+    """查看生成的HTML文件：按 Accept-Encoding 返回预压缩版本，支持 ETag 条件请求"""
+    file_path = artifact_store.path_for(file_id)
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="文件不存在")
-    return FileResponse(file_path, media_type="text/html")
+
+    encoding, serve_path = None, file_path
+    accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+    for name, suffix in CONTENT_ENCODINGS:
+        variant = artifact_store.path_for(file_id, suffix)
+        if (name in accepted or "*" in accepted) and variant.exists():
+            encoding, serve_path = name, variant
+            break
+
+    # 不同编码是不同的表示，使用不同的强 ETag
+    try:
+        digest = await asyncio.to_thread(page_etag, file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": VIEW_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(serve_path, media_type="text/html", headers=headers)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,85 @@
+# 下载自托管的前端资源
+"""
+将生成页面使用的 Tailwind CSS、Font Awesome 和 Inter 字体（Google Fonts）下载到 static/vendor，
+服务端会把页面中的 CDN 链接替换为本地资源（Tailwind 按页面用到的类名裁剪后内联）。
+文件缺失时页面继续使用 CDN。
+用法：
+    python scripts/fetch_vendor_assets.py
+"""
+
+import re
+import sys
+from pathlib import Path
+
+import httpx
+
+VENDOR_DIR = Path(__file__).resolve().parent.parent / "static" / "vendor"
+
+TAILWIND_URL = "https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css"
+FONT_AWESOME_BASE = "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0"
+FONT_AWESOME_FONTS = ["fa-brands-400", "fa-regular-400", "fa-solid-900", "fa-v4compatibility"]
+
+ASSETS = [(TAILWIND_URL, "tailwind/tailwind.min.css"), (f"{FONT_AWESOME_BASE}/css/all.min.css", "fontawesome/css/all.min.css")]
+ASSETS += [
+    (f"{FONT_AWESOME_BASE}/webfonts/{name}.{ext}", f"fontawesome/webfonts/{name}.{ext}")
+    for name in FONT_AWESOME_FONTS for ext in ("woff2", "ttf")
+]
+
+# 与 main.py 中 HEAD_HTML 引用的地址一致
+INTER_FONT_URL = "https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap"
+# Google Fonts 按 User-Agent 返回不同格式，使用现代浏览器的 UA 获取 woff2
+BROWSER_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+)
+FONT_FILE_URL_PATTERN = re.compile(r'url\((https://fonts\.gstatic\.com/[^)]+)\)')
+
+
+def write_atomic(target: Path, data: bytes):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # 先写临时文件再改名，避免服务读到不完整的文件
+    temp = target.with_name(target.name + ".tmp")
+    temp.write_bytes(data)
+    temp.replace(target)
+
+
+def fetch_inter_font(client: httpx.Client) -> None:
+    """下载 Inter 字体的样式表及其引用的字体文件，并把字体地址改为相对路径"""
+    css = client.get(INTER_FONT_URL, headers={"User-Agent": BROWSER_USER_AGENT})
+    css.raise_for_status()
+    font_dir = VENDOR_DIR / "inter"
+    names = {}
+    for url in dict.fromkeys(FONT_FILE_URL_PATTERN.findall(css.text)):
+        response = client.get(url)
+        response.raise_for_status()
+        names[url] = f"files/{url.rsplit('/', 1)[-1]}"
+        write_atomic(font_dir / names[url], response.content)
+    text = FONT_FILE_URL_PATTERN.sub(lambda match: f"url({names[match.group(1)]})", css.text)
+    # 样式表最后写入，存在即表示字体文件已下载完
+    write_atomic(font_dir / "inter.css", text.encode("utf-8"))
+    print(f"已下载 inter/inter.css（{len(names)} 个字体文件）")
+
+
+def main() -> int:
+    failed = 0
+    with httpx.Client(follow_redirects=True, timeout=60) as client:
+        for url, relative_path in ASSETS:
+            target = VENDOR_DIR / relative_path
+            try:
+                response = client.get(url)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                print(f"下载失败 {url}: {e}")
+                failed += 1
+                continue
+            write_atomic(target, response.content)
+            print(f"已下载 {relative_path} ({len(response.content)} 字节)")
+        try:
+            fetch_inter_font(client)
+        except httpx.HTTPError as e:
+            print(f"下载失败 {INTER_FONT_URL}: {e}")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
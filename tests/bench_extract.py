@@ -0,0 +1,59 @@
+# 正文提取性能对比
+"""
+此脚本对比各提取后端（bs4 旧版、density 标准库流式解析、lxml 流式解析）的
+解析耗时、峰值内存以及输出给模型的字符数和估算 token 数。
+数据来源：
+1. `tests/samples/*.html` 保存的样例网页
+2. 将样例网页正文重复多次构造的大页面
+3. 可选：命令行传入的其他 HTML 文件
+用法：
+    python tests/bench_extract.py [page.html ...]
+"""
+
+import sys
+import re
+import time
+import tracemalloc
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from main import EXTRACTORS, LXML_AVAILABLE, estimate_tokens
+
+SAMPLES_DIR = Path(__file__).parent / "samples"
+
+
+def build_large_page(html, repeat=200):
+    """把样例页面的 <body> 内容重复多次，模拟大页面"""
+    match = re.search(r"<body[^>]*>(.*)</body>", html, re.S)
+    body = match.group(1) if match else html
+    return f"<html><head><title>large</title></head><body>{body * repeat}</body></html>"
+
+
+def bench(name, func, html, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text = func(html)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {elapsed * 1000:10.2f} ms   峰值内存 {peak / 1024 / 1024:8.2f} MB   "
+          f"输出 {len(text):8d} 字符 / {estimate_tokens(text):8d} tokens")
+
+
+def run(name, html, repeat):
+    print(f"== {name} ({len(html)} 字符)")
+    for backend, func in EXTRACTORS.items():
+        if backend == "lxml" and not LXML_AVAILABLE:
+            print(f"{backend:<10} 未安装 lxml，跳过")
+            continue
+        bench(backend, func, html, repeat)
+
+
+if __name__ == "__main__":
+    pages = sorted(SAMPLES_DIR.glob("*.html")) + [Path(arg) for arg in sys.argv[1:]]
+    for page in pages:
+        html = page.read_text(encoding="utf-8")
+        run(page.name, html, 50)
+        run(f"{page.name} x200", build_large_page(html), 3)
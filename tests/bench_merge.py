@@ -0,0 +1,120 @@
+# 合并算法性能对比
+"""
+此脚本对比旧版合并算法（逐个长度切片比较、最多检测100个字符、字符串反复拼接）
+与当前合并算法的耗时。
+数据来源：
+1. `tests/test_merge_responses.py` 中使用的分块数据
+2. 按真实AI多轮返回特征构造的大文档（每轮末尾与下一轮开头存在重复）
+3. 可选：`tmp/<task_id>` 目录下保存的 round_*.html 真实数据
+用法：
+    python tests/bench_merge.py [task_id]
+"""
+
+import sys
+import re
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from main import merge_ai_responses, combined_fix, has_valid_html_tag, logger, CODE_FENCE_START_PATTERN
+
+
+def legacy_chunk_clear(chunks):
+    """旧版分块清理：丢弃不含有效标签的分块，去掉首块的说明文字、末块 </html> 之后的内容和开头的 ```html"""
+    cleaned_chunks = []
+    for i, chunk in enumerate(chunks):
+        if not has_valid_html_tag(chunk):
+            logger.warning(f"第 {i + 1} 块因缺少有效HTML标签被移除")
+            continue
+        cleaned_chunks.append(chunk)
+    if cleaned_chunks:
+        cleaned_chunks[0] = cleaned_chunks[0][cleaned_chunks[0].find('<'):]
+        if '</html>' in cleaned_chunks[-1]:
+            cleaned_chunks[-1] = cleaned_chunks[-1][:cleaned_chunks[-1].rfind('</html>') + len('</html>')]
+    return [CODE_FENCE_START_PATTERN.sub('', chunk, count=1) for chunk in cleaned_chunks]
+
+
+def legacy_merge_ai_strings(first, second):
+    """旧版合并算法"""
+    max_overlap = min(len(first), len(second), 100)
+    for overlap in range(max_overlap, 0, -1):
+        if first[-overlap:] == second[:overlap]:
+            return first + second[overlap:]
+    return first + second
+
+
+def legacy_merge_ai_responses(raw_chunks):
+    """旧版合并流程"""
+    combined_content = ""
+    chunks = legacy_chunk_clear(raw_chunks)
+    for chunk in chunks:
+        combined_content = legacy_merge_ai_strings(combined_content, chunk)
+    return combined_fix(combined_content)
+
+
+# tests/test_merge_responses.py 中的分块数据
+TEST_FIXTURES = [
+    ["<!DOCTYPE html><html><head>", "<title>Test</title></head>", "<body><h1>Hello</h1></body></html>"],
+    ["<!DOCTYPE html><html><head><title>", "<title>Test</title></head>", "</head><body>Content</body></html>"],
+    ["```html\n<!DOCTYPE html><html>", "<body>Test</body></html>"],
+    ["<!DOCTYPE html><html>", "<body>Test"],
+    ["# Here is the HTML\n<!DOCTYPE html><html>", "<body>Content</body></html>\n\nThis looks good!"],
+    [],
+    ["<!DOCTYPE html><html><head><title>Test</title></head>",
+     "Invalid content without HTML tags",
+     "<body><div>Content</div></body></html>"],
+]
+
+
+def build_large_rounds(rounds=20, paragraphs=400, overlap=300):
+    """构造多轮大文档：每轮以上一轮末尾的 overlap 个字符开头"""
+    chunks = []
+    previous_tail = ""
+    for r in range(rounds):
+        body = "".join(
+            f'<div class="card"><p class="mb-4">第{r}轮第{i}段内容，用于测试合并性能。</p></div>\n'
+            for i in range(paragraphs)
+        )
+        chunk = previous_tail + body
+        if r == 0:
+            chunk = "```html\n<!DOCTYPE html><html><body>\n" + chunk
+        if r == rounds - 1:
+            chunk += "</body></html>\n```\n说明文字"
+        chunks.append(chunk)
+        previous_tail = chunk[-overlap:]
+    return chunks
+
+
+def load_task_rounds(task_id):
+    tmp_dir = Path("tmp") / task_id
+    round_files = sorted(
+        tmp_dir.glob("round_*.html"),
+        key=lambda x: int(re.search(r'round_(\d+)\.html', x.name).group(1))
+    )
+    return [file.read_text(encoding='utf-8') for file in round_files]
+
+
+def bench(name, func, datasets, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for chunks in datasets:
+            func(chunks)
+    elapsed = (time.perf_counter() - start) / repeat
+    # 输出长度用于对比去重效果：旧算法无法识别超过100个字符的重复内容
+    output_length = sum(len(func(chunks)) for chunks in datasets)
+    print(f"{name:<10} {elapsed * 1000:10.2f} ms   输出 {output_length} 字符")
+    return elapsed
+
+
+def run(name, datasets, repeat):
+    print(f"== {name}")
+    legacy = bench("legacy", legacy_merge_ai_responses, datasets, repeat)
+    current = bench("current", merge_ai_responses, datasets, repeat)
+    print(f"speedup    {legacy / current:10.2f}x")
+
+
+if __name__ == "__main__":
+    run("test fixtures", TEST_FIXTURES, 1000)
+    run("large rounds", [build_large_rounds()], 5)
+    if len(sys.argv) > 1:
+        run(f"tmp/{sys.argv[1]}", [load_task_rounds(sys.argv[1])], 5)
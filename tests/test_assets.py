@@ -0,0 +1,69 @@
+import unittest
+import sys
+import tempfile
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+from main import parse_css_rules, purge_css_rules, collect_used_classes, HtmlPostProcessor, SelfHostAssetsPass
+
+TAILWIND_SAMPLE = (
+    r"*,::after,::before{box-sizing:border-box}html{line-height:1.5}.container{width:100%}"
+    r"@media (min-width:640px){.container{max-width:640px}.sm\:flex{display:flex}}"
+    r".bg-white{background-color:#fff}.hover\:bg-blue-500:hover{background:blue}.w-1\/2{width:50%}"
+    r".group:hover .group-hover\:text-white{color:#fff}@keyframes spin{to{transform:rotate(360deg)}}"
+    r"@media (min-width:1536px){.\32xl\:flex{display:flex}}.hidden{display:none}"
+)
+
+
+class TestPurgeTailwind(unittest.TestCase):
+    def test_keeps_used_classes_and_base_styles(self):
+        nodes, _ = parse_css_rules(TAILWIND_SAMPLE)
+        html = (
+            '<div class="bg-white sm:flex w-1/2 group"><p class="group-hover:text-white 2xl:flex">a</p></div>'
+            "<script>el.classList.toggle('hidden')</script>"
+        )
+        purged = purge_css_rules(nodes, collect_used_classes(html))
+        self.assertEqual(
+            purged,
+            r"*,::after,::before{box-sizing:border-box}html{line-height:1.5}"
+            r"@media (min-width:640px){.sm\:flex{display:flex}}"
+            r".bg-white{background-color:#fff}.w-1\/2{width:50%}"
+            r".group:hover .group-hover\:text-white{color:#fff}@keyframes spin{to{transform:rotate(360deg)}}"
+            r"@media (min-width:1536px){.\32xl\:flex{display:flex}}.hidden{display:none}"
+        )
+
+
+class TestSelfHostFonts(unittest.TestCase):
+    PAGE = (
+        '<html><head><link href="https://fonts.googleapis.com/css2?family=Inter:wght@400&display=swap" rel="stylesheet">'
+        '<link href="https://fonts.googleapis.com/css2?family=Noto+Sans+SC&display=swap" rel="stylesheet">'
+        "<style>@import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;700&display=swap');</style>"
+        '</head><body></body></html>'
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original = (main.INTER_FONT_CSS_FILE, main.FONT_AWESOME_CSS_FILE, main.TAILWIND_CSS_FILE)
+        missing = Path(self.tmp.name) / "missing.css"
+        main.INTER_FONT_CSS_FILE = Path(self.tmp.name) / "inter.css"
+        main.FONT_AWESOME_CSS_FILE = main.TAILWIND_CSS_FILE = missing
+        self.processor = HtmlPostProcessor([SelfHostAssetsPass])
+
+    def tearDown(self):
+        main.INTER_FONT_CSS_FILE, main.FONT_AWESOME_CSS_FILE, main.TAILWIND_CSS_FILE = self.original
+        self.tmp.cleanup()
+
+    def test_google_fonts_kept_without_local_copy(self):
+        self.assertEqual(self.processor.process(self.PAGE), self.PAGE)
+
+    def test_inter_served_locally(self):
+        main.INTER_FONT_CSS_FILE.write_text("@font-face{font-family:'Inter'}")
+        html = self.processor.process(self.PAGE)
+        self.assertNotIn("family=Inter", html)
+        self.assertEqual(html.count("inter.css?v="), 2)
+        self.assertIn("family=Noto+Sans+SC", html)
+        self.assertEqual(main.vendor_asset_url(main.INTER_FONT_CSS_FILE), main.vendor_asset_url(main.INTER_FONT_CSS_FILE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import asyncio
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+
+
+class TestCircuitBreakerProbe(unittest.TestCase):
+    def setUp(self):
+        self.original_round = main.request_ai_round
+        self.breaker = main.ai_circuit_breaker
+        # 冷却已结束，下一次请求是半开状态的试探请求
+        self.breaker.failures = self.breaker.threshold
+        self.breaker.opened_at = time.monotonic() - self.breaker.reset_seconds - 1
+        self.breaker.probing = False
+
+    def tearDown(self):
+        main.request_ai_round = self.original_round
+        self.breaker.record_success()
+
+    def test_cancelled_probe_releases_breaker(self):
+        async def slow_round(messages, round_no, result, cached_prefix=2):
+            yield '{"status": "ai_streaming"}'
+            await asyncio.sleep(60)
+
+        main.request_ai_round = slow_round
+
+        async def run():
+            generator = main.request_ai_round_with_retry([], 1, {})
+            await generator.__anext__()
+            self.assertTrue(self.breaker.probing)
+            await generator.aclose()
+
+        asyncio.run(run())
+        self.assertFalse(self.breaker.probing)
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertTrue(self.breaker.before_call())
+
+
+if __name__ == '__main__':
+    unittest.main()
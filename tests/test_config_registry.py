@@ -0,0 +1,90 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from fastapi.testclient import TestClient
+import main
+from main import ConfigRegistry, app
+
+
+class TestConfigRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.env_file = self.root / ".env"
+        self.prompt_dir = self.root / "prompts"
+        self.prompt_dir.mkdir()
+        self.write(self.prompt_dir / "format_prompt.txt", "第一版提示词")
+        self.write(self.env_file, "TEST_REGISTRY_VALUE=1\n")
+        self.original_env = os.environ.pop("TEST_REGISTRY_VALUE", None)
+
+    def tearDown(self):
+        os.environ.pop("TEST_REGISTRY_VALUE", None)
+        if self.original_env is not None:
+            os.environ["TEST_REGISTRY_VALUE"] = self.original_env
+        self.tmp.cleanup()
+
+    def write(self, path: Path, text: str):
+        # 修改时间精度有限，每次写入后推进修改时间，保证能检测到变化
+        previous = path.stat().st_mtime_ns if path.exists() else 0
+        path.write_text(text, encoding="utf-8")
+        os.utime(path, ns=(previous + 10 ** 9, previous + 10 ** 9))
+
+    def test_prompt_cached_until_file_changes(self):
+        registry = ConfigRegistry(self.env_file, self.prompt_dir, 0)
+        self.assertEqual(registry.get_prompt("format_prompt.txt"), "第一版提示词")
+        self.assertEqual(registry.version, 0)
+        self.write(self.prompt_dir / "format_prompt.txt", "第二版提示词")
+        self.assertEqual(registry.get_prompt("format_prompt.txt"), "第二版提示词")
+        self.assertEqual(registry.version, 1)
+        self.assertEqual(registry.get_prompt("format_prompt.txt"), "第二版提示词")
+        self.assertEqual(registry.version, 1)
+
+    def test_checks_throttled_by_interval(self):
+        registry = ConfigRegistry(self.env_file, self.prompt_dir, 3600)
+        registry.get_prompt("format_prompt.txt")
+        self.write(self.prompt_dir / "format_prompt.txt", "第二版提示词")
+        self.assertEqual(registry.get_prompt("format_prompt.txt"), "第一版提示词")
+        # 强制刷新不受检查间隔限制
+        self.assertTrue(registry.refresh(force=True))
+        self.assertEqual(registry.get_prompt("format_prompt.txt"), "第二版提示词")
+
+    def test_env_file_reloaded(self):
+        registry = ConfigRegistry(self.env_file, self.prompt_dir, 0)
+        self.assertEqual(registry.get_int("TEST_REGISTRY_VALUE", 0), 0)
+        self.write(self.env_file, "TEST_REGISTRY_VALUE=2\n")
+        self.assertEqual(registry.get_int("TEST_REGISTRY_VALUE", 0), 2)
+        self.write(self.env_file, "TEST_REGISTRY_VALUE=3\n")
+        self.assertEqual(registry.get_str("TEST_REGISTRY_VALUE", ""), "3")
+        self.assertFalse(registry.refresh())
+
+    def test_missing_prompt_uses_default(self):
+        registry = ConfigRegistry(self.env_file, self.prompt_dir, 0)
+        self.assertEqual(registry.get_prompt("section_prompt.txt"), main.SECTION_PROMPT_DEFAULT)
+
+
+class TestAdminReload(unittest.TestCase):
+    def setUp(self):
+        self.original_token = main.ADMIN_TOKEN
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        main.ADMIN_TOKEN = self.original_token
+
+    def test_disabled_without_token(self):
+        main.ADMIN_TOKEN = ""
+        self.assertEqual(self.client.post("/admin/reload").status_code, 404)
+
+    def test_reload_requires_token(self):
+        main.ADMIN_TOKEN = "secret"
+        self.assertEqual(self.client.post("/admin/reload", headers={"X-Admin-Token": "wrong"}).status_code, 403)
+        version = main.config_registry.version
+        response = self.client.post("/admin/reload", headers={"X-Admin-Token": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["version"], version + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+from main import build_continuation_messages, estimate_tokens, summarize_emitted_html
+
+
+def page_output(count: int) -> str:
+    return "<html><body>" + "".join(
+        f"<section><h2>第{index}章</h2><p>{'内容' * 200}</p></section>" for index in range(count)
+    )
+
+
+class TestContinuationMessages(unittest.TestCase):
+    def setUp(self):
+        self.original = (main.CONTEXT_STRATEGY, main.CONTEXT_TAIL_CHARS, main.CONTEXT_TOKEN_BUDGET)
+
+    def tearDown(self):
+        main.CONTEXT_STRATEGY, main.CONTEXT_TAIL_CHARS, main.CONTEXT_TOKEN_BUDGET = self.original
+
+    def test_full_history(self):
+        main.CONTEXT_STRATEGY = "full"
+        messages = build_continuation_messages("系统", "原文", ["第一轮", "第二轮"], "继续")
+        self.assertEqual([message["role"] for message in messages],
+                         ["system", "user", "assistant", "user", "assistant", "user"])
+        self.assertEqual(messages[4]["content"], "第二轮")
+        self.assertEqual(messages[-1]["content"], "继续")
+
+    def test_bounded_sends_tail_and_structure(self):
+        main.CONTEXT_STRATEGY = "bounded"
+        main.CONTEXT_TAIL_CHARS = 1000
+        main.CONTEXT_TOKEN_BUDGET = 3000
+        output = page_output(10)
+        messages = build_continuation_messages("系统", "原文", [output[:5000], output[5000:]], "继续")
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(messages[:2], [{"role": "system", "content": "系统"}, {"role": "user", "content": "原文"}])
+        tail = messages[2]["content"]
+        self.assertLessEqual(len(tail), 1000)
+        self.assertTrue(output.endswith(tail))
+        # 末尾片段从标签边界开始
+        self.assertTrue(tail.startswith("<"))
+        self.assertTrue(messages[3]["content"].startswith("继续"))
+        self.assertIn("- 第0章", messages[3]["content"])
+        self.assertIn("- 第9章", messages[3]["content"])
+
+    def test_bounded_respects_token_budget(self):
+        main.CONTEXT_STRATEGY = "bounded"
+        main.CONTEXT_TAIL_CHARS = 4000
+        main.CONTEXT_TOKEN_BUDGET = 1000
+        messages = build_continuation_messages("系统", "原文", [page_output(200)], "继续")
+        summary = messages[3]["content"][len("继续"):]
+        self.assertLessEqual(estimate_tokens(messages[2]["content"] + summary), 1000)
+        # 超出预算时缩短末尾片段，并只保留最近的章节标题
+        self.assertLess(len(messages[2]["content"]), 4000)
+        self.assertIn("- 第199章", summary)
+        self.assertNotIn("- 第0章\n", summary)
+
+    def test_short_output_kept_whole(self):
+        main.CONTEXT_STRATEGY = "bounded"
+        messages = build_continuation_messages("系统", "原文", ["<html><body><h1>标题</h1>"], "继续")
+        self.assertEqual(messages[2]["content"], "<html><body><h1>标题</h1>")
+
+    def test_summarize_emitted_html(self):
+        html = "<h1>标题</h1><h2 class='x'>小节 <span>一</span></h2><h3>\n细节\n</h3><h4>忽略</h4>"
+        self.assertEqual(summarize_emitted_html(html), ["- 标题", "  - 小节 一", "    - 细节"])
+
+
+if __name__ == '__main__':
+    unittest.main()
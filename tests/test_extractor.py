@@ -0,0 +1,67 @@
+import unittest
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from main import parse_main_content, LXML_AVAILABLE
+
+SAMPLES_DIR = Path(__file__).parent / "samples"
+
+
+class TestDensityExtractor(unittest.TestCase):
+    def setUp(self):
+        self.html = (SAMPLES_DIR / "blog_article.html").read_text(encoding="utf-8")
+
+    def check_blog_article(self, text):
+        # 保留标题、列表、表格、图片链接和代码
+        self.assertIn("# 用 asyncio 构建高并发爬虫", text)
+        self.assertIn("## 为什么选择 asyncio", text)
+        self.assertIn("- 单线程即可支撑大量并发连接", text)
+        self.assertIn("| asyncio + httpx | 500 | 2400 |", text)
+        self.assertIn("![吞吐量对比图](https://example.com/images/throughput.png)", text)
+        self.assertIn("responses = await asyncio.gather", text)
+        # 去掉导航、侧边栏、评论、分享和页脚
+        for junk in ("归档", "热门文章", "写得很好", "分享到微博", "相关文章", "京ICP备", "dataLayer"):
+            self.assertNotIn(junk, text)
+
+    def test_density_backend(self):
+        self.check_blog_article(parse_main_content(self.html, "https://example.com/post/1", backend="density"))
+
+    @unittest.skipUnless(LXML_AVAILABLE, "未安装 lxml")
+    def test_lxml_backend(self):
+        self.check_blog_article(parse_main_content(self.html, "https://example.com/post/1", backend="lxml"))
+
+    def test_unclosed_tags(self):
+        html = "<html><body><nav><p>菜单<p>更多</nav><div><p>" + "正文内容，" * 60 + "</div></body></html>"
+        text = parse_main_content(html, backend="density")
+        self.assertIn("正文内容", text)
+        self.assertNotIn("菜单", text)
+
+    def webforms_page(self):
+        paragraphs = "".join(f"<p>第{i}条：" + "关于推进政务公开工作的通知内容，" * 8 + "</p>" for i in range(5))
+        return (
+            "<html><head><title>政务公开</title></head><body>"
+            '<form method="post" action="./Default.aspx" id="form1">'
+            '<input type="hidden" name="__VIEWSTATE" value="abc">'
+            '<div class="search"><form action="/search"><input name="q"><p>站内搜索</p></form></div>'
+            f'<div id="main">{paragraphs}</div>'
+            "</form></body></html>"
+        )
+
+    def test_webforms_page(self):
+        """正文整体包在 form 中的页面（ASP.NET WebForms），不能只剩标题"""
+        for backend in ("density", "lxml") if LXML_AVAILABLE else ("density",):
+            text = parse_main_content(self.webforms_page(), backend=backend)
+            self.assertIn("第4条：关于推进政务公开工作的通知内容", text)
+            self.assertNotIn("站内搜索", text)
+
+    def test_fallback_to_bs4_when_empty(self):
+        html = (
+            "<html><head><title>通知</title></head><body><template>x</template>"
+            '<aside class="sidebar"><p>' + "侧栏里的全部正文，" * 30 + "</p></aside></body></html>"
+        )
+        text = parse_main_content(html, backend="density")
+        self.assertIn("侧栏里的全部正文", text)
+
+
+if __name__ == '__main__':
+    unittest.main()
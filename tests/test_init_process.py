@@ -0,0 +1,74 @@
+import unittest
+import asyncio
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from fastapi import HTTPException
+import main
+from main import ProcessRequest, init_process, submission_key
+
+
+class TestSubmissionKey(unittest.TestCase):
+    def test_text_whitespace_ignored(self):
+        self.assertEqual(submission_key(None, "# 标题\n\n正文"), submission_key(None, " # 标题 正文 "))
+        self.assertNotEqual(submission_key(None, "正文"), submission_key(None, "正 文"))
+
+    def test_url_and_text_do_not_collide(self):
+        self.assertEqual(submission_key(" https://a.example/ ", None), submission_key("https://a.example/", None))
+        self.assertNotEqual(submission_key("https://a.example/", None), submission_key(None, "https://a.example/"))
+
+
+class TestInitProcessCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.original = (main.task_store, main.start_task, main.job_scheduler)
+        main.task_store = main.MemoryTaskStore()
+        main.job_scheduler = main.JobScheduler(2, 10, 60)
+        self.started = []
+
+        def start_task(task_id):
+            # 只登记为运行中，不真正执行任务
+            self.started.append(task_id)
+            main.task_runners[task_id] = None
+
+        main.start_task = start_task
+
+    def tearDown(self):
+        main.task_store, main.start_task, main.job_scheduler = self.original
+        for task_id in self.started:
+            main.task_runners.pop(task_id, None)
+        main.inflight_jobs.clear()
+
+    def submit(self, **fields):
+        return asyncio.run(init_process(ProcessRequest(**fields)))
+
+    def test_identical_submissions_share_a_task(self):
+        first = self.submit(text="# 标题\n\n正文内容")
+        second = self.submit(text="# 标题 正文内容")
+        self.assertEqual(second, {"task_id": first["task_id"], "coalesced": True})
+        self.assertEqual(self.started, [first["task_id"]])
+
+    def test_different_submissions_get_their_own_task(self):
+        first = self.submit(url="https://a.example/")
+        second = self.submit(url="https://b.example/")
+        self.assertNotEqual(first["task_id"], second["task_id"])
+        self.assertEqual(len(self.started), 2)
+
+    def test_finished_task_not_reused(self):
+        first = self.submit(text="正文内容")
+        # 任务结束后 run_task 会移除运行记录
+        del main.task_runners[first["task_id"]]
+        second = self.submit(text="正文内容")
+        self.assertNotIn("coalesced", second)
+        self.assertNotEqual(first["task_id"], second["task_id"])
+
+    def test_coalesced_even_when_queue_full(self):
+        first = self.submit(text="正文内容")
+        main.job_scheduler.is_full = lambda: True
+        self.assertEqual(self.submit(text="正文内容")["task_id"], first["task_id"])
+        with self.assertRaises(HTTPException) as context:
+            self.submit(text="其他内容")
+        self.assertEqual(context.exception.status_code, 429)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+from main import compact_content, truncate_to_budget, estimate_tokens
+
+
+class TestInputBudget(unittest.TestCase):
+    def test_compact_content(self):
+        content = "分享到微信\n正文​  第一行\n\n\n\n分享到微信\n```\n}\n}\n```\n| a |\n| a |"
+        self.assertEqual(
+            compact_content(content, drop_boilerplate=True),
+            "分享到微信\n正文 第一行\n\n```\n}\n}\n```\n| a |\n| a |"
+        )
+
+    def test_pasted_repeats_kept(self):
+        content = "- 是\n- 否\n- 是\n\n副歌\n第一段\n副歌"
+        self.assertEqual(compact_content(content), content)
+        self.assertEqual(compact_content(content, drop_boilerplate=True), content)
+
+    def test_truncate_to_budget(self):
+        content = "第一行内容\n" + "很长" * 100 + "\n第三行"
+        result = truncate_to_budget(content, 30)
+        self.assertTrue(result.startswith("第一行内容\n很长"))
+        self.assertIn("已截断", result)
+        self.assertNotIn("第三行", result)
+        self.assertLess(estimate_tokens(result), 60)
+
+    def test_within_budget_unchanged(self):
+        content = "第一行\n第二行"
+        self.assertEqual(truncate_to_budget(content, 100), content)
+
+
+class TestSectionModeBudget(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patched = {}
+        self.patch(
+            TMP_DIR=Path(self.tmp.name), GENERATION_MODE="sections", SECTION_MODE_MIN_CHARS=1000,
+            INPUT_TOKEN_BUDGET=500, INPUT_BUDGET_STRATEGY="truncate", RESULT_CACHE_ENABLED=False,
+            generate_by_sections=self.fake_sections, write_result_page=self.fake_write
+        )
+        self.received = None
+
+    def tearDown(self):
+        for name, value in self.patched.items():
+            setattr(main, name, value)
+        self.tmp.cleanup()
+
+    def patch(self, **values):
+        for name, value in values.items():
+            self.patched[name] = getattr(main, name)
+            setattr(main, name, value)
+
+    async def fake_sections(self, content, tmp_task_dir, result, max_chars=None):
+        self.received = (content, max_chars)
+        result["html"] = "<html><body><p>a</p></body></html>"
+        result["complete"] = True
+        yield '{"status": "ai_processing"}'
+
+    async def fake_write(self, task_id, html):
+        pass
+
+    def test_long_document_reaches_sections_in_full(self):
+        content = "\n\n".join(f"## 第{i}章\n" + "正文内容" * 100 for i in range(20))
+
+        async def run():
+            return [event async for event in main.process_status_generator(text=content, task_id="budget")]
+
+        events = asyncio.run(run())
+        self.assertIn('"completed"', events[-1])
+        received, max_chars = self.received
+        self.assertEqual(received, content)
+        self.assertLess(max_chars, len(content))
+
+
+if __name__ == '__main__':
+    unittest.main()
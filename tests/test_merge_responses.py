@@ -3,7 +3,10 @@ import sys
 from pathlib import Path
 import re
 sys.path.append(str(Path(__file__).parent.parent))
-from main import merge_ai_responses
+from main import (
+    merge_ai_responses, merge_ai_strings, longest_overlap, IncrementalHtmlAssembler, is_complete_html, TagBalanceTracker,
+    HtmlPostProcessor, DocumentShellPass, DuplicateHeadPass, StrayFencePass, TailwindCdnPass
+)
 import aiofiles
 import asyncio
 from bs4 import BeautifulSoup
@@ -132,5 +135,158 @@ class TestMergeAIResponses(unittest.TestCase):
         self.assertIn("</html>", result)
         self.assertNotIn("Invalid content", result)
 
+class TestMergeAIStrings(unittest.TestCase):
+    def test_longest_overlap(self):
+        self.assertEqual(longest_overlap("abcabc", "abcabd"), 3)
+        self.assertEqual(longest_overlap("aaaa", "aaa"), 3)
+        self.assertEqual(longest_overlap("abc", "xyz"), 0)
+        self.assertEqual(longest_overlap("", "abc"), 0)
+
+    def test_no_overlap(self):
+        self.assertEqual(merge_ai_strings("<p>a</p>", "<p>b</p>"), "<p>a</p><p>b</p>")
+
+    def test_overlap_longer_than_100_chars(self):
+        """AI续写时重复的内容经常超过100个字符"""
+        repeated = "<p>" + "重复的段落内容" * 30 + "</p>"
+        first = "<div>" + repeated
+        second = repeated + "</div>"
+        self.assertEqual(merge_ai_strings(first, second), "<div>" + repeated + "</div>")
+
+    def test_whitespace_tolerant_overlap(self):
+        first = '<div>\n    <p class="mb-4">整体思路来源于分享的方法</p>'
+        second = '<p class="mb-4">\n整体思路来源于分享的方法</p>\n</div>'
+        self.assertEqual(
+            merge_ai_strings(first, second),
+            '<div>\n    <p class="mb-4">整体思路来源于分享的方法</p>\n</div>'
+        )
+
+class TestIncrementalHtmlAssembler(unittest.TestCase):
+    def test_complete_after_root_closed(self):
+        assembler = IncrementalHtmlAssembler()
+        assembler.feed("好的，下面是页面：\n<!DOCTYPE html><html><head><style>p { color: red; }</style></head><body><div><p>第一段</p>")
+        self.assertFalse(assembler.is_complete())
+        self.assertEqual(assembler.open_elements(), ["html", "body", "div"])
+        self.assertTrue(assembler.preview().rstrip().endswith("</div></body></html>"))
+        assembler.feed("```html\n<p>第一段</p><p>第二段</p></div></body></html>\n\n这个HTML文件现在是完整的")
+        self.assertTrue(assembler.is_complete())
+        self.assertEqual(
+            assembler.content,
+            "<!DOCTYPE html><html><head><style>p { color: red; }</style></head>"
+            "<body><div><p>第一段</p><p>第二段</p></div></body></html>"
+        )
+
+    def test_same_result_as_merge(self):
+        chunks = [
+            "<!DOCTYPE html><html><head><title>Test</title></head><body><div>",
+            "Invalid content without HTML tags",
+            "<div><p>Content</p></div></body></html>"
+        ]
+        assembler = IncrementalHtmlAssembler()
+        for chunk in chunks:
+            assembler.feed(chunk)
+        self.assertEqual(assembler.result(), merge_ai_responses(chunks))
+
+class TestIsCompleteHtml(unittest.TestCase):
+    def test_root_closed(self):
+        self.assertTrue(is_complete_html("<html><body><div>a</div></body></html>\n说明"))
+
+    def test_truncated_inside_element(self):
+        self.assertFalse(is_complete_html("<html><body><section><p>第一段</p><p>第二"))
+        self.assertFalse(is_complete_html('<html><body><p>a</p><div class="ca'))
+
+    def test_fence_closed_without_root_end(self):
+        """AI结束了代码块，只漏写 </body></html>"""
+        content = "```html\n<html><body><div>a</div>\n```\n\n通过这个设计精美的网页，我们......"
+        self.assertTrue(is_complete_html(content))
+        self.assertFalse(is_complete_html("```html\n<html><body><div>a\n```\n\n通过这个设计精美的网页"))
+
+    def test_no_html(self):
+        self.assertTrue(is_complete_html("抱歉，无法继续。"))
+
+    def test_resume_hint(self):
+        assembler = IncrementalHtmlAssembler()
+        assembler.feed('<html><body><section id="intro"><p>第一段</p><div class="ca')
+        self.assertFalse(assembler.is_complete())
+        hint = assembler.resume_hint()
+        self.assertIn('<section id="intro">', hint)
+        self.assertIn('<div class="ca', hint)
+        self.assertIn("</section></body></html>", hint)
+
+class TestTagBalanceTracker(unittest.TestCase):
+    def test_state_kept_between_feeds(self):
+        tracker = TagBalanceTracker()
+        tracker.feed('<html><body><div x-show="a > b" class="ca')
+        self.assertEqual(tracker.stack, ["html", "body"])
+        self.assertEqual(tracker.pending_markup, '<div x-show="a > b" class="ca')
+        tracker.feed('rd"><br/><img src="a.png"><p>1</p>')
+        self.assertEqual(tracker.stack, ["html", "body", "div"])
+        self.assertEqual(tracker.labels[-1], 'div class="card"')
+        self.assertEqual(tracker.pending_markup, "")
+
+    def test_raw_text_and_comments(self):
+        tracker = TagBalanceTracker()
+        tracker.feed('<html><body><script>var s = "<div>";</scr')
+        self.assertEqual(tracker.raw_text_element, "script")
+        tracker.feed('ipt><!-- <section> ')
+        self.assertIsNone(tracker.raw_text_element)
+        self.assertTrue(tracker.pending_markup.startswith("<!--"))
+        tracker.feed('--></body></html>')
+        self.assertEqual(tracker.stack, [])
+        self.assertTrue(tracker.root_closed)
+
+class TestHtmlPostProcessor(unittest.TestCase):
+    def setUp(self):
+        self.processor = HtmlPostProcessor([DocumentShellPass, DuplicateHeadPass, StrayFencePass, TailwindCdnPass])
+
+    def test_tailwind_links(self):
+        html = (
+            '<html><head><link rel="stylesheet" href="https://cdn.example.com/tailwindcss@3/tailwind.css">'
+            '<script src="https://cdn.jsdelivr.net/npm/tailwindcss@4.1.2/dist/lib.min.js"></script>'
+            '<link rel="stylesheet" href="/other.css"></head><body></body></html>'
+        )
+        self.assertEqual(
+            self.processor.process(html),
+            '<html><head><link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">'
+            '<script src="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/lib/index.min.js"></script>'
+            '<link rel="stylesheet" href="/other.css"></head><body></body></html>'
+        )
+
+    def test_stray_fences_and_duplicate_head(self):
+        html = (
+            "<!DOCTYPE html><html><head><title>a</title></head><body><p>1</p>\n```html\n"
+            "<!DOCTYPE html><html lang=\"zh\"><head><title>b</title></head><body>"
+            "<pre><code>```js```</code></pre><script>var s = '<head>';</script></body></html>\n```"
+        )
+        self.assertEqual(
+            self.processor.process(html),
+            "<!DOCTYPE html><html><head><title>a</title></head><body><p>1</p>\n\n"
+            "<pre><code>```js```</code></pre><script>var s = '<head>';</script></body></html>\n"
+        )
+        self.assertEqual(set(self.processor.last_timings), {
+            "tokenize", "document_shell", "duplicate_head", "stray_fence", "tailwind_cdn"
+        })
+
+    def test_duplicate_head_without_end(self):
+        """重复的头部没有 </head> 时只删除标签，不能吞掉后面的正文"""
+        html = (
+            "<!DOCTYPE html><html><head><title>a</title></head><body><p>part1</p>"
+            "<!DOCTYPE html><html><head><title>b</title><body><p>part2</p></body></html>"
+        )
+        self.assertEqual(
+            self.processor.process(html),
+            "<!DOCTYPE html><html><head><title>a</title></head><body><p>part1</p>"
+            "<title>b</title><p>part2</p></body></html>"
+        )
+
+    def test_fence_in_prose_kept(self):
+        html = "<html><body><p>Markdown 用 ```python 开始代码块</p>\n  ```\n</body></html>"
+        self.assertEqual(
+            self.processor.process(html),
+            "<html><body><p>Markdown 用 ```python 开始代码块</p>\n  \n</body></html>"
+        )
+
+    def test_document_shell(self):
+        self.assertTrue(self.processor.process("<div>a</div>").startswith("<!DOCTYPE html>"))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,35 @@
+import unittest
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from main import Counter, Histogram, metrics_registry
+
+
+class TestMetrics(unittest.TestCase):
+    def tearDown(self):
+        del metrics_registry[-1]
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "测试", ("stage",), buckets=(0.1, 1))
+        histogram.observe(0.05, stage="a")
+        histogram.observe(0.1, stage="a")
+        histogram.observe(3, stage="a")
+        self.assertEqual(histogram.render(), [
+            "# HELP test_seconds 测试",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{stage="a",le="0.1"} 2',
+            'test_seconds_bucket{stage="a",le="1"} 2',
+            'test_seconds_bucket{stage="a",le="+Inf"} 3',
+            'test_seconds_sum{stage="a"} 3.15',
+            'test_seconds_count{stage="a"} 3',
+        ])
+
+    def test_counter_escapes_labels(self):
+        counter = Counter("test_total", "测试", ("reason",))
+        counter.inc(reason='say "hi"\n')
+        counter.inc(2, reason='say "hi"\n')
+        self.assertEqual(counter.samples(), ['test_total{reason="say \\"hi\\"\\n"} 3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+from main import PageCache, load_page_text
+
+PAGE_HTML = "<html><body><article><h1>标题</h1><p>" + "正文内容，" * 100 + "</p></article></body></html>"
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup_after_store(self):
+        cache = PageCache(self.root, 1024 * 1024)
+        self.assertIsNone(asyncio.run(cache.lookup("https://a.example/")))
+        asyncio.run(cache.store("https://a.example/", PAGE_HTML, "正文", '"v1"', None))
+        meta = asyncio.run(cache.lookup("https://a.example/"))
+        self.assertEqual(meta["text"], "正文")
+        self.assertEqual(meta["etag"], '"v1"')
+        self.assertEqual(asyncio.run(cache.load_html("https://a.example/")), PAGE_HTML)
+
+    def test_evicts_least_recently_used_over_budget(self):
+        cache = PageCache(self.root, 1024 * 1024)
+        asyncio.run(cache.store("https://a.example/", PAGE_HTML, "a", None, None))
+        asyncio.run(cache.store("https://b.example/", PAGE_HTML, "b", None, None))
+        cache.max_bytes = cache.total_bytes + 100
+        asyncio.run(cache.lookup("https://a.example/"))
+        asyncio.run(cache.store("https://c.example/", PAGE_HTML, "c", None, None))
+        self.assertIsNone(asyncio.run(cache.lookup("https://b.example/")))
+        self.assertFalse((self.root / f"{PageCache.key_for('https://b.example/')}.html").exists())
+        self.assertIsNotNone(asyncio.run(cache.lookup("https://a.example/")))
+        self.assertIsNotNone(asyncio.run(cache.lookup("https://c.example/")))
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+
+    def test_index_rebuilt_from_disk(self):
+        cache = PageCache(self.root, 1024 * 1024)
+        asyncio.run(cache.store("https://a.example/", PAGE_HTML, "a", None, None))
+        reloaded = PageCache(self.root, 1024 * 1024)
+        self.assertEqual(reloaded.total_bytes, cache.total_bytes)
+        self.assertEqual(asyncio.run(reloaded.lookup("https://a.example/"))["text"], "a")
+
+
+class TestConditionalFetch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.originals = (main.page_cache, main.PAGE_CACHE_ENABLED, main.PAGE_CACHE_FRESH_SECONDS)
+        main.page_cache = PageCache(Path(self.tmp.name), 1024 * 1024)
+        main.PAGE_CACHE_ENABLED = True
+        main.PAGE_CACHE_FRESH_SECONDS = 300
+        self.requests = []
+
+    def tearDown(self):
+        main.page_cache, main.PAGE_CACHE_ENABLED, main.PAGE_CACHE_FRESH_SECONDS = self.originals
+        self.tmp.cleanup()
+
+    def fake_fetch(self, responses):
+        async def fetch_page(url, extra_headers=None):
+            self.requests.append(extra_headers)
+            return responses.pop(0)
+        return mock.patch.object(main, "fetch_page", fetch_page)
+
+    def test_fresh_cache_skips_fetch(self):
+        response = {"not_modified": False, "html": PAGE_HTML, "etag": '"v1"', "last_modified": None}
+        with self.fake_fetch([response]):
+            first = asyncio.run(load_page_text("https://a.example/"))
+            second = asyncio.run(load_page_text("https://a.example/"))
+        self.assertEqual(first, second)
+        self.assertIn("正文内容", first)
+        self.assertEqual(self.requests, [None])
+
+    def test_stale_cache_revalidated_with_validators(self):
+        response = {
+            "not_modified": False, "html": PAGE_HTML,
+            "etag": '"v1"', "last_modified": "Wed, 21 Oct 2015 07:28:00 GMT"
+        }
+        with self.fake_fetch([response, {"not_modified": True}]):
+            first = asyncio.run(load_page_text("https://a.example/"))
+            meta = asyncio.run(main.page_cache.lookup("https://a.example/"))
+            meta["fetched_at"] = time.time() - 3600
+            asyncio.run(main.page_cache.save_meta("https://a.example/", meta))
+            second = asyncio.run(load_page_text("https://a.example/"))
+        self.assertEqual(first, second)
+        self.assertEqual(self.requests[1], {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT"
+        })
+        # 304 后刷新抓取时间，新鲜期内不再请求
+        meta = asyncio.run(main.page_cache.lookup("https://a.example/"))
+        self.assertLess(time.time() - meta["fetched_at"], 60)
+
+    def test_changed_page_replaces_cache(self):
+        changed_html = PAGE_HTML.replace("正文内容", "新的内容")
+        responses = [
+            {"not_modified": False, "html": PAGE_HTML, "etag": '"v1"', "last_modified": None},
+            {"not_modified": False, "html": changed_html, "etag": '"v2"', "last_modified": None},
+        ]
+        with self.fake_fetch(responses):
+            asyncio.run(load_page_text("https://a.example/"))
+            main.PAGE_CACHE_FRESH_SECONDS = 0
+            text = asyncio.run(load_page_text("https://a.example/"))
+        self.assertIn("新的内容", text)
+        self.assertEqual(asyncio.run(main.page_cache.lookup("https://a.example/"))["etag"], '"v2"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+from main import apply_prompt_cache, parse_usage
+
+
+class TestParseUsage(unittest.TestCase):
+    def test_openai_usage_object(self):
+        usage = SimpleNamespace(
+            prompt_tokens=1000, completion_tokens=200,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=800)
+        )
+        self.assertEqual(parse_usage(usage), {
+            "input_tokens": 1000, "cached_tokens": 800, "uncached_tokens": 200,
+            "cache_write_tokens": 0, "output_tokens": 200
+        })
+
+    def test_deepseek_and_anthropic_fields(self):
+        deepseek = parse_usage({"prompt_tokens": 500, "completion_tokens": 10, "prompt_cache_hit_tokens": 300})
+        self.assertEqual((deepseek["cached_tokens"], deepseek["uncached_tokens"]), (300, 200))
+        anthropic = parse_usage({
+            "prompt_tokens": 500, "completion_tokens": 10,
+            "cache_read_input_tokens": 0, "cache_creation_input_tokens": 450
+        })
+        self.assertEqual((anthropic["cached_tokens"], anthropic["cache_write_tokens"]), (0, 450))
+
+    def test_missing_usage(self):
+        self.assertIsNone(parse_usage(None))
+        self.assertEqual(parse_usage(SimpleNamespace(prompt_tokens=None))["input_tokens"], 0)
+
+
+class TestApplyPromptCache(unittest.TestCase):
+    def setUp(self):
+        self.original = main.PROMPT_CACHE
+        self.messages = [
+            {"role": "system", "content": "系统提示词"},
+            {"role": "user", "content": "原文"},
+            {"role": "assistant", "content": "<html>"},
+        ]
+
+    def tearDown(self):
+        main.PROMPT_CACHE = self.original
+
+    def test_auto_leaves_messages(self):
+        main.PROMPT_CACHE = "auto"
+        self.assertIs(apply_prompt_cache(self.messages), self.messages)
+
+    def test_cache_control_marks_prefix(self):
+        main.PROMPT_CACHE = "cache_control"
+        marked = apply_prompt_cache(self.messages, cached_prefix=1)
+        self.assertEqual(marked[0]["content"], [
+            {"type": "text", "text": "系统提示词", "cache_control": {"type": "ephemeral"}}
+        ])
+        self.assertEqual(marked[1:], self.messages[1:])
+        self.assertEqual(self.messages[0]["content"], "系统提示词")
+        self.assertEqual(sum(isinstance(m["content"], list) for m in apply_prompt_cache(self.messages)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
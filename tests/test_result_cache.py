@@ -0,0 +1,90 @@
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+from main import LocalArtifactStore, ResultCache, result_cache_key
+
+
+class TestResultCacheKey(unittest.TestCase):
+    def test_whitespace_differences_share_a_key(self):
+        self.assertEqual(result_cache_key("# 标题\n\n正文  内容"), result_cache_key("# 标题 正文\t内容\n"))
+        self.assertNotEqual(result_cache_key("正文内容"), result_cache_key("正文 内容"))
+
+    def test_budget_is_part_of_the_key(self):
+        self.assertNotEqual(result_cache_key("正文"), result_cache_key("正文", "1000:truncate"))
+        self.assertNotEqual(result_cache_key("正文", "1000:truncate"), result_cache_key("正文", "1000:summarize"))
+
+    def test_prompt_and_model_are_part_of_the_key(self):
+        key = result_cache_key("正文")
+        original = main.load_prompt
+        with mock.patch.object(main, "load_prompt", lambda filename: original(filename) + ("!" if filename == "format_prompt.txt" else "")):
+            self.assertNotEqual(result_cache_key("正文"), key)
+        with mock.patch.dict(os.environ, {"OPENAI_MODEL": "another-model"}):
+            self.assertNotEqual(result_cache_key("正文"), key)
+        self.assertEqual(result_cache_key("正文"), key)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.index_file = self.root / "result_cache.json"
+        self.original_store = main.artifact_store
+        main.artifact_store = LocalArtifactStore(self.root / "html", 0, 0)
+        asyncio.run(main.artifact_store.put("page", b"<html>page</html>"))
+
+    def tearDown(self):
+        main.artifact_store = self.original_store
+        self.tmp.cleanup()
+
+    def test_hit_after_put(self):
+        cache = ResultCache(self.index_file, 3600, 10)
+        self.assertIsNone(asyncio.run(cache.get("key")))
+        asyncio.run(cache.put("key", "page"))
+        self.assertEqual(asyncio.run(cache.get("key")), "page")
+
+    def test_missing_file_invalidates_entry(self):
+        cache = ResultCache(self.index_file, 3600, 10)
+        asyncio.run(cache.put("key", "gone"))
+        self.assertIsNone(asyncio.run(cache.get("key")))
+        self.assertNotIn("key", cache.entries)
+
+    def test_expired_entry_invalidated(self):
+        cache = ResultCache(self.index_file, 3600, 10)
+        asyncio.run(cache.put("key", "page"))
+        cache.entries["key"]["created_at"] = time.time() - 7200
+        self.assertIsNone(asyncio.run(cache.get("key")))
+
+    def test_lru_eviction(self):
+        cache = ResultCache(self.index_file, 3600, 2)
+        asyncio.run(cache.put("a", "page"))
+        asyncio.run(cache.put("b", "page"))
+        asyncio.run(cache.get("a"))
+        asyncio.run(cache.put("c", "page"))
+        self.assertEqual(list(cache.entries), ["a", "c"])
+
+    def test_index_saved_and_reloaded(self):
+        cache = ResultCache(self.index_file, 3600, 10)
+        asyncio.run(cache.put("a", "page"))
+        asyncio.run(cache.put("b", "page"))
+        asyncio.run(cache.get("a"))
+        self.assertTrue(self.index_file.exists())
+        self.assertFalse(self.index_file.with_suffix(".tmp").exists())
+        reloaded = ResultCache(self.index_file, 3600, 10)
+        self.assertEqual(list(reloaded.entries), ["b", "a"])
+        self.assertEqual(asyncio.run(reloaded.get("b")), "page")
+
+    def test_corrupt_index_ignored(self):
+        self.index_file.write_text("{not json", encoding="utf-8")
+        cache = ResultCache(self.index_file, 3600, 10)
+        self.assertEqual(len(cache.entries), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import main
+
+
+class TestSchedulerSlots(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original = (main.TMP_DIR, main.RESULT_CACHE_ENABLED, main.result_cache.get, main.job_scheduler)
+        main.TMP_DIR = Path(self.tmp.name)
+        main.RESULT_CACHE_ENABLED = True
+
+    def tearDown(self):
+        main.TMP_DIR, main.RESULT_CACHE_ENABLED, main.result_cache.get, main.job_scheduler = self.original
+        self.tmp.cleanup()
+
+    def test_cache_hit_while_slots_busy(self):
+        async def cached(key):
+            return "cached-file"
+
+        async def run():
+            # 所有运行名额都被正在生成的任务占用
+            main.job_scheduler = main.JobScheduler(2, 10, 60)
+            main.job_scheduler.running = 2
+            main.result_cache.get = cached
+            generator = main.process_status_generator(text="已经生成过的内容", task_id="hit")
+            return [json.loads(event) async for event in generator]
+
+        events = asyncio.run(asyncio.wait_for(run(), timeout=5))
+        self.assertEqual(events[-1]["status"], "completed")
+        self.assertEqual(events[-1]["file_id"], "cached-file")
+        self.assertFalse(any("queue_position" in event for event in events))
+        self.assertEqual(main.job_scheduler.running, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
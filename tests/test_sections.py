@@ -0,0 +1,55 @@
+import unittest
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from main import split_into_sections
+
+
+def compact(text: str) -> str:
+    return "".join(text.split())
+
+
+def chapter(title: str, paragraphs: int) -> str:
+    return "\n\n".join([title] + [f"本节的第{index}段。" + "正文内容。" * 20 for index in range(paragraphs)])
+
+
+class TestSplitIntoSections(unittest.TestCase):
+    def test_short_content_single_section(self):
+        content = "# 标题\n\n一段正文。"
+        self.assertEqual(split_into_sections(content, 1000), [content])
+
+    def test_sections_within_limit_and_lossless(self):
+        content = "\n\n".join(chapter(f"## 第{index}节", 6) for index in range(8))
+        sections = split_into_sections(content, 1500)
+        self.assertGreater(len(sections), 1)
+        self.assertTrue(all(len(section) <= 1500 for section in sections))
+        self.assertEqual(compact("".join(sections)), compact(content))
+
+    def test_breaks_at_headings(self):
+        content = "\n\n".join(chapter(f"## 第{index}节", 3) for index in range(6))
+        sections = split_into_sections(content, 800)
+        # 每一节都能放进一个章节时，章节从标题处开始
+        self.assertTrue(all(section.startswith("## 第") for section in sections))
+
+    def test_recognizes_chinese_headings(self):
+        content = "\n\n".join(chapter(title, 3) for title in ("第一章 总述", "第二章 细节", "一、补充", "1. 附录"))
+        sections = split_into_sections(content, 600)
+        self.assertEqual([section.split("\n")[0] for section in sections],
+                         ["第一章 总述", "第二章 细节", "一、补充", "1. 附录"])
+
+    def test_long_paragraph_split_at_sentences(self):
+        content = "。".join(f"第{index}句内容" + "很长" * 10 for index in range(100)) + "。"
+        sections = split_into_sections(content, 500)
+        self.assertTrue(all(len(section) <= 500 for section in sections))
+        self.assertTrue(all(section.endswith("。") for section in sections))
+        self.assertEqual(compact("".join(sections)), compact(content))
+
+    def test_unbroken_text_hard_split(self):
+        content = "字" * 2500
+        sections = split_into_sections(content, 1000)
+        self.assertEqual([len(section) for section in sections], [1000, 1000, 500])
+        self.assertEqual("".join(sections), content)
+
+
+if __name__ == '__main__':
+    unittest.main()
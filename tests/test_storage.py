@@ -0,0 +1,113 @@
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from main import LocalArtifactStore, SQLiteTaskStore, minify_css, minify_html, sweep_tmp_dirs
+
+
+class TestLocalArtifactStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_content_shares_one_file(self):
+        store = LocalArtifactStore(self.root, 0, 0)
+        self.assertFalse(asyncio.run(store.put("a", b"<html>same</html>")))
+        self.assertTrue(asyncio.run(store.put("b", b"<html>same</html>")))
+        first, second = store.path_for("a"), store.path_for("b")
+        self.assertEqual(second.read_bytes(), b"<html>same</html>")
+        self.assertEqual(first.stat().st_ino, second.stat().st_ino)
+        self.assertEqual(store.path_for("a", ".gz").stat().st_ino, store.path_for("b", ".gz").stat().st_ino)
+        self.assertEqual([path.name for path in self.root.glob(".*.tmp")], [])
+
+    def test_sweep_removes_oldest_over_quota(self):
+        store = LocalArtifactStore(self.root, 0, 0)
+        asyncio.run(store.put("old", b"<html>old</html>" * 100))
+        asyncio.run(store.put("new", b"<html>new</html>" * 100))
+        past = time.time() - 100
+        os.utime(store.path_for("old"), (past, past))
+        store.max_bytes = store.path_for("new").stat().st_size + store.path_for("new", ".gz").stat().st_size + 200
+        stats = asyncio.run(store.sweep())
+        self.assertEqual(stats["removed"], 1)
+        self.assertFalse(store.exists("old"))
+        self.assertFalse(store.path_for("old", ".gz").exists())
+        self.assertTrue(store.exists("new"))
+        self.assertEqual(len(list(store.objects_dir.glob("*.html"))), 1)
+
+    def test_sweep_keeps_results_by_default(self):
+        store = LocalArtifactStore(self.root, 0, 0)
+        asyncio.run(store.put("new", b"<html>new</html>"))
+        # 升级前生成的页面不在 .objects 中
+        legacy = store.path_for("legacy")
+        legacy.write_bytes(b"<html>legacy</html>")
+        past = time.time() - 365 * 24 * 3600
+        os.utime(legacy, (past, past))
+        stats = asyncio.run(store.sweep())
+        self.assertEqual(stats["removed"], 0)
+        self.assertTrue(store.exists("legacy"))
+        self.assertTrue(store.exists("new"))
+
+    def test_sweep_tmp_dirs_by_age(self):
+        for name in ("expired", "running", "fresh"):
+            (self.root / name).mkdir()
+            (self.root / name / "round_1.html").write_text("<html>")
+        past = time.time() - 3600
+        for name in ("expired", "running"):
+            os.utime(self.root / name / "round_1.html", (past, past))
+            os.utime(self.root / name, (past, past))
+        stats = sweep_tmp_dirs(self.root, 600, 0, {"running"})
+        self.assertEqual(stats["removed"], 1)
+        self.assertEqual(sorted(path.name for path in self.root.iterdir()), ["fresh", "running"])
+
+
+class TestSQLiteTaskStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = SQLiteTaskStore(Path(self.tmp.name) / "tasks.db", 0.01, stream_interval=60)
+
+    def tearDown(self):
+        asyncio.run(self.store.close())
+        self.tmp.cleanup()
+
+    def test_events_keep_record_and_coalesce_stream(self):
+        async def run():
+            await self.store.create({"task_id": "t", "text": "原文" * 1000, "status": "pending"})
+            await self.store.append_event("t", {"status": "processing"})
+            for offset, delta in ((0, "<html>"), (6, "<body>"), (12, "</body>")):
+                await self.store.append_event("t", {"status": "ai_streaming", "round": 1, "offset": offset, "delta": delta})
+            self.assertEqual(len(await self.store.events_since("t", 0)), 1)
+            await self.store.append_event("t", {"status": "completed"})
+            return await self.store.get("t"), await self.store.events_since("t", 0)
+
+        record, events = asyncio.run(run())
+        self.assertEqual(record["text"], "原文" * 1000)
+        self.assertEqual(record["status"], "completed")
+        self.assertEqual([event["status"] for event in events], ["processing", "ai_streaming", "completed"])
+        self.assertEqual(events[1]["offset"], 0)
+        self.assertEqual(events[1]["delta"], "<html><body></body>")
+        row = self.store.conn.execute("SELECT record FROM tasks WHERE task_id = 't'").fetchone()
+        self.assertNotIn("state", row[0])
+
+
+class TestMinify(unittest.TestCase):
+    def test_css_strings_kept(self):
+        css = 'a::before { content: "a , b ;  c" ; font-family: \'My  Font\' , serif; } /* 注释 */ .b { color : red ; }'
+        self.assertEqual(
+            minify_css(css),
+            'a::before{content: "a , b ;  c";font-family: \'My  Font\',serif;}.b{color : red;}'
+        )
+
+    def test_html_keeps_pre(self):
+        html = "<p>a   b</p>\n<!-- x -->\n<pre>  1\n  2</pre><style>p { content: \"x ; y\" }</style>"
+        self.assertEqual(minify_html(html), '<p>a b</p> <pre>  1\n  2</pre><style>p{content: "x ; y"}</style>')
+
+
+if __name__ == '__main__':
+    unittest.main()
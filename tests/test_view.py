@@ -0,0 +1,95 @@
+import unittest
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from fastapi.testclient import TestClient
+import main
+from main import LocalArtifactStore, app, page_etag
+
+
+class TestViewHtml(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = LocalArtifactStore(Path(self.tmp.name), 0, 0)
+        asyncio.run(self.store.put("page", b"<html><body>" + b"hello " * 200 + b"</body></html>"))
+        self.original_store = main.artifact_store
+        main.artifact_store = self.store
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        main.artifact_store = self.original_store
+        main.page_etags.clear()
+        self.tmp.cleanup()
+
+    def get(self, **headers):
+        return self.client.get("/view/page", headers=headers)
+
+    def test_serves_precompressed_variant(self):
+        response = self.get(**{"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertTrue(response.headers["etag"].endswith('-gzip"'))
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertIn(b"hello", response.content)
+
+    def test_prefers_brotli(self):
+        if not self.store.path_for("page", ".br").exists():
+            self.skipTest("brotli 未安装")
+        response = self.get(**{"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["content-encoding"], "br")
+        self.assertTrue(response.headers["etag"].endswith('-br"'))
+
+    def test_identity_when_encoding_refused(self):
+        response = self.get(**{"Accept-Encoding": "gzip;q=0, br;q=0"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertNotIn("-", response.headers["etag"])
+        self.assertEqual(response.content, self.store.path_for("page").read_bytes())
+
+    def test_not_modified(self):
+        etag = self.get(**{"Accept-Encoding": "gzip"}).headers["etag"]
+        response = self.get(**{"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], etag)
+        self.assertEqual(response.content, b"")
+        # 编码不同时 ETag 不同，不能返回 304
+        response = self.get(**{"Accept-Encoding": "identity", "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_file(self):
+        self.assertEqual(self.client.get("/view/missing").status_code, 404)
+
+
+class TestPageEtag(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.original_size = main.PAGE_ETAG_CACHE_SIZE
+
+    def tearDown(self):
+        main.PAGE_ETAG_CACHE_SIZE = self.original_size
+        main.page_etags.clear()
+        self.tmp.cleanup()
+
+    def test_cache_is_bounded(self):
+        main.PAGE_ETAG_CACHE_SIZE = 2
+        paths = [self.root / f"{index}.html" for index in range(3)]
+        for path in paths:
+            path.write_text(path.name)
+            page_etag(path)
+        self.assertEqual(list(main.page_etags), [str(path) for path in paths[1:]])
+
+    def test_removed_file_is_dropped(self):
+        path = self.root / "page.html"
+        path.write_text("page")
+        page_etag(path)
+        path.unlink()
+        with self.assertRaises(FileNotFoundError):
+            page_etag(path)
+        self.assertNotIn(str(path), main.page_etags)
+
+
+if __name__ == '__main__':
+    unittest.main()